@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from builtins import object
+import calendar
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+from botocore.credentials import RefreshableCredentials
+from botocore.session import get_session
+
+from .resources.config import BOTO3_RETRIES, BOTO3_DIRECT_RETRIES, ROLE_SESSION_NAME
+from .resources.config import ROLE_SESSION_DURATION, IMAGE_IDS_CHUNK, ACTIVE_INSTANCE_STATES
+
+# boto3 sessions are not thread safe, clients are
+_session_lock = threading.Lock()
+
+# client methods which are not api calls
+NOT_API_CALLS = ("can_paginate", "close", "generate_presigned_url",
+                 "get_paginator", "get_waiter")
+
+
+def get_client(service, region=None, session=None, retries=BOTO3_RETRIES):
+
+    """
+    Returns a boto3 client for a service, bound to a region
+    :param service: aws service name, ex: ec2
+    :param region: aws region name, None for the default one
+    :param session: boto3 session, None for the default credentials
+    :param retries: retries of the aws sdk, see BOTO3_DIRECT_RETRIES
+    """
+
+    config = Config(retries={'max_attempts': retries})
+
+    with _session_lock:
+        session = session or boto3.session.Session()
+        return session.client(service, region_name=region, config=config)
+
+
+def is_api_call(name, attr):
+
+    """ Returns whether a client attribute is an api call method """
+
+    return callable(attr) and not name.startswith("_") and name not in NOT_API_CALLS
+
+
+def get_enabled_regions(session=None):
+
+    """ Returns the names of the regions enabled for the account """
+
+    resp = get_client('ec2', session=session, retries=BOTO3_DIRECT_RETRIES).describe_regions()
+    return sorted(r.get("RegionName") for r in resp.get("Regions", []))
+
+
+def get_account_id(role_arn):
+
+    """ Returns the account id of an iam role arn """
+
+    parts = (role_arn or "").split(":")
+    return parts[4] if len(parts) > 5 else role_arn
+
+
+class SessionCache(object):
+
+    """
+    Assumes iam roles once and caches their sessions, the credentials
+    of a session are assumed again by botocore before they expire
+    """
+
+    def __init__(self, session=None, duration=ROLE_SESSION_DURATION):
+        self.session = session
+        self.duration = duration
+        self.sessions = dict()
+        self.lock = threading.Lock()
+        self.locks = dict()
+        self.sts = None
+
+    def assume_role(self, role_arn):
+
+        """ Returns the credentials of a role, as RefreshableCredentials metadata """
+
+        with self.lock:
+            self.sts = self.sts or get_client('sts', session=self.session, retries=BOTO3_DIRECT_RETRIES)
+
+        creds = self.sts.assume_role(
+            RoleArn=role_arn,
+            RoleSessionName=ROLE_SESSION_NAME,
+            DurationSeconds=self.duration
+        ).get("Credentials")
+
+        expiration = calendar.timegm(creds.get("Expiration").utctimetuple())
+        return {
+            "access_key": creds.get("AccessKeyId"),
+            "secret_key": creds.get("SecretAccessKey"),
+            "token": creds.get("SessionToken"),
+            "expiry_time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(expiration)),
+        }
+
+    def get(self, role_arn):
+
+        """
+        Returns the session of a role, the targets of a role
+        wait for a single assume role call
+        """
+
+        with self.lock:
+            lock = self.locks.setdefault(role_arn, threading.Lock())
+
+        with lock:
+            session = self.sessions.get(role_arn)
+            if session is None:
+                botocore_session = get_session()
+                botocore_session._credentials = RefreshableCredentials.create_from_metadata(
+                    metadata=self.assume_role(role_arn),
+                    refresh_using=lambda: self.assume_role(role_arn),
+                    method="sts-assume-role"
+                )
+                session = boto3.session.Session(botocore_session=botocore_session)
+                self.sessions[role_arn] = session
+            return session
+
+
+def paginate(method, page_size=None, page_size_param='MaxResults', **kwargs):
+
+    """
+    Calls an aws api method and yields every response page,
+    following NextToken until the last one
+    :param method: bound boto3 client method, ex: ec2.describe_images
+    :param page_size: number of items per page, None for the api default
+    :param page_size_param: name of the page size parameter of the api
+    """
+
+    if page_size:
+        kwargs[page_size_param] = page_size
+
+    while True:
+        resp = method(**kwargs)
+        yield resp
+
+        token = resp.get('NextToken')
+        if not token:
+            return
+        kwargs['NextToken'] = token
+
+
+def find_image_ids(ec2, image_ids, owner_id='self'):
+
+    """
+    Returns the AMIs of image_ids which still exist on aws,
+    described by batches of IMAGE_IDS_CHUNK ids
+    """
+
+    image_ids = sorted(set(image_ids))
+    found = set()
+    for i in range(0, len(image_ids), IMAGE_IDS_CHUNK):
+        pages = paginate(
+            ec2.describe_images, Owners=[owner_id], Filters=[{
+                "Name": "image-id", "Values": image_ids[i:i + IMAGE_IDS_CHUNK]
+            }]
+        )
+        found.update(image.get("ImageId")
+                     for page in pages for image in page.get("Images", []))
+
+    return found
+
+
+def find_used_image_ids(ec2, image_ids):
+
+    """
+    Returns the AMIs of image_ids used by not terminated instances,
+    described by batches of IMAGE_IDS_CHUNK ids
+    """
+
+    image_ids = sorted(set(image_ids))
+    used = set()
+    for i in range(0, len(image_ids), IMAGE_IDS_CHUNK):
+        pages = paginate(
+            ec2.describe_instances, Filters=[
+                {"Name": "image-id", "Values": image_ids[i:i + IMAGE_IDS_CHUNK]},
+                {"Name": "instance-state-name", "Values": ACTIVE_INSTANCE_STATES},
+            ]
+        )
+        used.update(instance.get("ImageId")
+                    for page in pages
+                    for reservation in page.get("Reservations", [])
+                    for instance in reservation.get("Instances", []))
+
+    return used
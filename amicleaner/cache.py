@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from builtins import object
+from datetime import datetime, timedelta
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .aws import find_image_ids, paginate
+from .resources.config import CACHE_TTL, INVENTORY_FULL_REFRESH, INVENTORY_MAX_DELTA_DAYS
+from .resources.models import AMI
+
+
+class InventoryCache(object):
+
+    """
+    On disk cache of aws api responses, stored page by page in sqlite
+    and keyed by account, region, api call and parameters
+    """
+
+    def __init__(self, cache_dir, ttl=CACHE_TTL):
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.path = os.path.join(cache_dir, "inventory.sqlite")
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, scope TEXT, created REAL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "key TEXT, seq INTEGER, body TEXT, PRIMARY KEY (key, seq))"
+            )
+
+    @staticmethod
+    def get_key(scope, method, kwargs):
+
+        """ Returns the cache key of an api call """
+
+        return "{0}/{1}/{2}".format(
+            scope, method.__name__, json.dumps(kwargs, sort_keys=True)
+        )
+
+    def is_fresh(self, key):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT created FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+        return row is not None and row[0] + self.ttl > time.time()
+
+    def read_pages(self, key):
+        seq = 0
+        while True:
+            with self.lock:
+                row = self.conn.execute(
+                    "SELECT body FROM pages WHERE key = ? AND seq = ?",
+                    (key, seq)
+                ).fetchone()
+            if row is None:
+                return
+            yield json.loads(row[0])
+            seq += 1
+
+    def write_pages(self, key, scope, pages):
+
+        """
+        Yields and stores api pages, the entry is only recorded once
+        the last page is stored so partial listings are never served
+        """
+
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+
+        for seq, page in enumerate(pages):
+            page.pop("ResponseMetadata", None)
+            body = json.dumps(page, default=str)
+            with self.lock, self.conn:
+                self.conn.execute(
+                    "INSERT INTO pages (key, seq, body) VALUES (?, ?, ?)",
+                    (key, seq, body)
+                )
+            yield page
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO entries (key, scope, created) VALUES (?, ?, ?)",
+                (key, scope, time.time())
+            )
+
+    def paginate(self, scope, method, page_size=None, page_size_param='MaxResults', **kwargs):
+
+        """
+        Yields the pages of an api call from the cache when fresh,
+        from aws otherwise, see aws.paginate
+        :param scope: account and region of the client, ex: 123456/eu-west-1
+        """
+
+        key = self.get_key(scope, method, dict(kwargs, page_size=page_size))
+
+        if self.is_fresh(key):
+            self.hits += 1
+            return self.read_pages(key)
+
+        self.misses += 1
+        return self.write_pages(
+            key, scope, paginate(method, page_size, page_size_param, **kwargs)
+        )
+
+    def invalidate(self, scope=None):
+
+        """ Drops the cached responses of a scope, or all of them """
+
+        with self.lock, self.conn:
+            if scope is None:
+                self.conn.execute("DELETE FROM entries")
+                self.conn.execute("DELETE FROM pages")
+            else:
+                self.conn.execute(
+                    "DELETE FROM pages WHERE key IN "
+                    "(SELECT key FROM entries WHERE scope = ?)", (scope,)
+                )
+                self.conn.execute(
+                    "DELETE FROM entries WHERE scope = ?", (scope,)
+                )
+
+    def stats(self):
+
+        """ Returns cache hits and misses counters """
+
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def get_delta_dates(watermark, now=None):
+
+    """
+    Returns creation-date filter wildcards of the days from the day of
+    a watermark (ex: 2020-01-05T10:00:00.000Z) to the current one
+    """
+
+    day = datetime.strptime(watermark[:10], "%Y-%m-%d")
+    today = datetime.utcfromtimestamp(now or time.time())
+
+    values = []
+    while day <= today:
+        values.append(day.strftime("%Y-%m-%dT*"))
+        day += timedelta(days=1)
+    return values
+
+
+class InventoryStore(object):
+
+    """
+    Incremental on disk inventory of AMIs by account, region and owner.
+    AMIs are immutable : after a first full listing, runs only fetch the
+    AMIs created since a creation date watermark. AMIs deregistered by
+    amicleaner are removed from the store, the ones deregistered outside
+    are dropped when their creation day is fetched again, when verified
+    (see verify) or by a full refresh every `full_refresh` seconds
+    """
+
+    def __init__(self, cache_dir, full_refresh=INVENTORY_FULL_REFRESH,
+                 max_delta_days=INVENTORY_MAX_DELTA_DAYS):
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.path = os.path.join(cache_dir, "amis.sqlite")
+        self.full_refresh = full_refresh
+        self.max_delta_days = max_delta_days
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS images ("
+                "scope TEXT, image_id TEXT, creation_date TEXT, body TEXT, "
+                "PRIMARY KEY (scope, image_id))"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS watermarks ("
+                "scope TEXT PRIMARY KEY, watermark TEXT, refreshed REAL)"
+            )
+
+    def get_watermark(self, scope):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT watermark, refreshed FROM watermarks WHERE scope = ?",
+                (scope,)
+            ).fetchone()
+
+    def refresh(self, scope, ec2, owner_id='self', page_size=None):
+
+        """
+        Brings the AMIs of a scope up to date, returns "full" or "delta"
+        :param scope: account, region and owner, ex: 123456/eu-west-1/self
+        """
+
+        row = self.get_watermark(scope)
+        now = time.time()
+
+        filters = None
+        if row and row[0] and row[1] + self.full_refresh > now:
+            filters = get_delta_dates(row[0], now)
+            if len(filters) > self.max_delta_days:
+                filters = None
+
+        kwargs = {"Filters": [{"Name": "creation-date", "Values": filters}]} if filters else {}
+        pages = paginate(ec2.describe_images, page_size, Owners=[owner_id], **kwargs)
+
+        images = dict()
+        watermark = None
+        pending = None
+        for page in pages:
+            for image in page.get("Images", []):
+                image_id = image.get("ImageId")
+                creation_date = str(image.get("CreationDate") or "")
+                images[image_id] = (creation_date, json.dumps(image, default=str))
+                watermark = max(watermark or creation_date, creation_date)
+                # pending AMIs are fetched again until they are available
+                if image.get("State", "available") != "available":
+                    pending = min(pending or creation_date, creation_date)
+
+        with self.lock, self.conn:
+            if filters:
+                # AMIs of the fetched days missing from aws were deregistered
+                self.conn.execute(
+                    "DELETE FROM images WHERE scope = ? AND creation_date >= ?",
+                    (scope, filters[0][:10])
+                )
+            else:
+                self.conn.execute("DELETE FROM images WHERE scope = ?", (scope,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO images (scope, image_id, creation_date, body) "
+                "VALUES (?, ?, ?, ?)",
+                [(scope, image_id, d, body) for image_id, (d, body) in images.items()]
+            )
+
+            watermark = pending or watermark or (row[0] if filters else None)
+            refreshed = row[1] if filters else now
+            self.conn.execute(
+                "INSERT OR REPLACE INTO watermarks (scope, watermark, refreshed) "
+                "VALUES (?, ?, ?)", (scope, watermark, refreshed)
+            )
+
+        return "delta" if filters else "full"
+
+    def invalidate(self, scope=None):
+
+        """ Drops the stored AMIs of a scope, or all of them """
+
+        with self.lock, self.conn:
+            if scope is None:
+                self.conn.execute("DELETE FROM images")
+                self.conn.execute("DELETE FROM watermarks")
+            else:
+                self.conn.execute("DELETE FROM images WHERE scope = ?", (scope,))
+                self.conn.execute("DELETE FROM watermarks WHERE scope = ?", (scope,))
+
+    def iter_amis(self, scope):
+
+        """ Yields the stored AMIs of a scope """
+
+        with self.lock:
+            bodies = [row[0] for row in self.conn.execute(
+                "SELECT body FROM images WHERE scope = ?", (scope,)
+            )]
+        for body in bodies:
+            yield AMI.object_with_json(json.loads(body))
+
+    def remove(self, scope, image_ids):
+
+        """ Removes deregistered AMIs from the store """
+
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM images WHERE scope = ? AND image_id = ?",
+                [(scope, image_id) for image_id in image_ids]
+            )
+
+    def verify(self, scope, ec2, image_ids, owner_id='self'):
+
+        """
+        Checks AMIs still exist on aws, the missing ones are
+        removed from the store and returned
+        """
+
+        image_ids = sorted(set(image_ids))
+        found = find_image_ids(ec2, image_ids, owner_id)
+
+        missing = [image_id for image_id in image_ids if image_id not in found]
+        self.remove(scope, missing)
+        return missing
@@ -5,24 +5,42 @@ from __future__ import print_function
 from __future__ import absolute_import
 from builtins import input
 from builtins import object
+import copy
 import sys
+import threading
+import time
+
+from botocore.exceptions import BotoCoreError, ClientError
 
 from amicleaner import __version__
+from .aws import SessionCache, get_account_id, get_client, get_enabled_regions
+from .cache import InventoryCache, InventoryStore
 from .core import AMICleaner, OrphanSnapshotCleaner
+from .fanout import fan_out
 from .fetch import Fetcher
+from .inventory import Inventory
+from .journal import DeletionJournal
+from .limiter import LimitedClient, RateLimiter
+from .metrics import InstrumentedClient, Metrics
+from .planfile import check_plan, dump_groups, dump_plan, load_report, read_plan, write_plan
+from .planner import get_images_filters
+from .report import get_report_writer
+from .server import serve
 from .resources.config import MAPPING_KEY, MAPPING_VALUES, EXCLUDED_MAPPING_VALUES
-from .resources.config import TERM
+from .resources.config import NO_TAGS_GROUP, TERM
+from .resources.models import AMIExclusions
 from .utils import Printer, parse_args
 
 
 class App(object):
 
-    def __init__(self, args):
+    def __init__(self, args, region=None, session=None):
 
         self.version = args.version
         self.mapping_key = args.mapping_key or MAPPING_KEY
         self.mapping_values = args.mapping_values or MAPPING_VALUES
         self.excluded_mapping_values = args.excluded_mapping_values or EXCLUDED_MAPPING_VALUES
+        self.mapping_match = args.mapping_match
         self.keep_previous = args.keep_previous
         self.check_orphans = args.check_orphans
         self.from_ids = args.from_ids
@@ -31,78 +49,371 @@ class App(object):
         self.ami_min_days = args.ami_min_days
         self.owner_id = args.owner_id or "self"
         self.dry_run = args.dry_run
+        self.page_size = args.page_size
+        self.workers = args.workers
+        self.snapshot_workers = args.snapshot_workers
+        self.regions = args.regions
+        self.role_arns = args.role_arns
+        self.concurrency = args.concurrency
+        self.metrics_json = args.metrics_json
+        self.metrics_prom = args.metrics_prom
+        self.resume = args.resume
+        self.report_format = args.report_format
+        self.report_output = args.report_output
+        # stdout of a json lines or csv report, see run_cli
+        self.report_stream = None
+        self.server_filters = args.server_filters
+        self.serve = args.serve
+        self.serve_address = args.serve_address
+        self.serve_port = args.serve_port
+        self.serve_interval = args.serve_interval
+        self.plan_file = args.plan_output or args.apply_input
+        self.command = None
+        if args.plan_output:
+            self.command = "plan"
+        elif args.apply_input:
+            self.command = "apply"
+        self.check_stale = args.check_stale
+
+        # shared by every target of the run
+        self.metrics = Metrics()
+        self.limiter = RateLimiter(max_rate=args.max_api_rate, metrics=self.metrics)
+        self.journal = DeletionJournal(args.journal) if args.journal else None
+
+        self.cache = None
+        self.store = None
+        if args.cache_dir:
+            self.cache = InventoryCache(args.cache_dir, args.cache_ttl)
+            if args.incremental:
+                self.store = InventoryStore(args.cache_dir)
+            if args.cache_clear:
+                self.cache.invalidate()
+                if self.store:
+                    self.store.invalidate()
+
+        # aws target of this App, see for_target
+        self.region = region
+        self.session = session
+        self.role_arn = None
+        self.sessions = SessionCache(session)
+        self.label = region or ""
+        self.clients = dict()
+        self.clients_session = None
+        self.clients_lock = threading.Lock()
+
+        # results of plan and delete on a target
+        self.reset()
 
         self.mapping_strategy = {
             "key": self.mapping_key,
             "values": self.mapping_values,
             "excluded": self.excluded_mapping_values,
+            "match": self.mapping_match,
         }
 
+    def for_target(self, region=None, role_arn=None, label=None):
+
+        """
+        Returns a copy of this App bound to another aws target,
+        a region and an optional iam role to assume
+        """
+
+        app = copy.copy(self)
+        app.region = region
+        app.role_arn = role_arn
+        app.label = label or region or ""
+        app.clients = dict()
+        app.clients_session = None
+        app.clients_lock = threading.Lock()
+        app.reset()
+        return app
+
+    def reset(self):
+
+        """
+        Drops the inventory and the plan and delete results of this
+        App target, its aws clients are kept
+        """
+
+        self.inventory = None
+        self.exclusions = AMIExclusions()
+        self.excluded = []
+        self.report = dict()
+        self.kept = dict()
+        self.results = []
+        self.error = None
+        self.timings = dict()
+
+    def client(self, service):
+
+        """ Returns the aws client of a service for this App target """
+
+        session = self.session
+        if self.role_arn:
+            session = self.sessions.get(self.role_arn)
+
+        with self.clients_lock:
+            # clients are bound to a session, its credentials refresh themselves
+            if session is not self.clients_session:
+                self.clients = dict()
+                self.clients_session = session
+            if service not in self.clients:
+                self.clients[service] = LimitedClient(
+                    InstrumentedClient(
+                        get_client(service, self.region, session),
+                        self.metrics, service
+                    ),
+                    self.limiter, self.label or None, service
+                )
+            return self.clients[service]
+
+    def get_scope(self):
+
+        """ Returns the account and region of this App target """
+
+        account = self.client('sts').get_caller_identity().get("Account")
+        return "{0}/{1}".format(account, self.client('ec2').meta.region_name)
+
+    def get_inventory(self):
+
+        """ Returns the inventory shared by the fetchers of a run """
+
+        if self.inventory is None:
+            self.inventory = Inventory(
+                ec2=self.client('ec2'),
+                autoscaling=self.client('autoscaling'),
+                cache=self.cache,
+                scope=self.get_scope() if self.cache else None,
+                workers=self.workers,
+                # fresh exclusions before deleting
+                cache_exclusions=self.dry_run or self.command == "plan"
+            )
+        return self.inventory
+
+    def invalidate_cache(self, ami_ids=()):
+
+        """
+        Drops cached responses of this App target after changes,
+        and the deregistered AMIs from the stored inventory
+        """
+
+        if self.cache:
+            self.cache.invalidate(self.get_inventory().scope)
+        if self.store and ami_ids:
+            self.store.remove(self.get_store_scope(), ami_ids)
+
+    def get_store_scope(self):
+
+        """ Returns the account, region and owner of the stored AMIs """
+
+        return "{0}/{1}".format(self.get_inventory().scope, self.owner_id)
+
+    def fetch_stored_amis(self):
+
+        """
+        Refreshes the stored inventory of this App target from aws,
+        with only the AMIs created since the last run, and returns it
+        """
+
+        scope = self.get_store_scope()
+        mode = self.store.refresh(scope, self.client('ec2'), self.owner_id, self.page_size)
+        print(TERM.green("inventory : {0} refresh of {1}".format(mode, scope)))
+        return self.store.iter_amis(scope)
+
+    def verify_kept(self, cleaner, mapped_amis, splits, now):
+
+        """
+        Checks the AMIs kept from a stored inventory still exist,
+        groups keeping deregistered AMIs are split again
+        """
+
+        verified = set()
+        while True:
+            kept_ids = [ami.id
+                        for kept, _ in splits.values()
+                        for ami in kept if ami.id not in verified]
+            if not kept_ids:
+                return splits
+
+            missing = set(self.store.verify(
+                self.get_store_scope(), self.client('ec2'), kept_ids, self.owner_id
+            ))
+            verified.update(kept_ids)
+
+            for group_name, (kept, _) in list(splits.items()):
+                if any(ami.id in missing for ami in kept):
+                    amis = [ami for ami in mapped_amis[group_name] if ami.id not in missing]
+                    mapped_amis[group_name] = amis
+                    splits[group_name] = cleaner.split_candidates(
+                        amis, self.keep_previous, self.ami_min_days, now
+                    )
+
+    def get_fetcher(self):
+
+        """ Returns a Fetcher for this App target """
+
+        return Fetcher(
+            ec2=self.client('ec2'),
+            autoscaling=self.client('autoscaling'),
+            page_size=self.page_size,
+            inventory=self.get_inventory()
+        )
+
+    def get_images_filters(self):
+
+        """ Returns the describe_images Filters of the run, if enabled """
+
+        if not self.server_filters:
+            return None
+
+        return get_images_filters(self.mapping_strategy, self.ami_min_days)
+
     def fetch_candidates(self, available_amis=None, excluded_amis=None):
 
         """
         Collects created AMIs,
-        AMIs from ec2 instances, launch configurations, autoscaling groups
-        and returns unused AMIs.
+        AMIs from ec2 instances, launch configurations, launch templates,
+        autoscaling groups and returns unused AMIs.
+        Excluded AMIs are kept in `excluded` with their reasons in `exclusions`
         """
-        f = Fetcher()
-
-        available_amis = available_amis or f.fetch_available_amis(self.owner_id)
-        excluded_amis = excluded_amis or []
+        if isinstance(excluded_amis, AMIExclusions):
+            exclusions = excluded_amis
+        else:
+            exclusions = AMIExclusions().add(excluded_amis, "provided")
+
+        if not exclusions or not available_amis:
+            f = self.get_fetcher()
+
+        if not exclusions:
+            exclusions.add(f.fetch_unattached_lc(), "launch-configuration")
+            exclusions.add(f.fetch_zeroed_asg(), "zeroed-asg")
+            exclusions.add(f.fetch_launch_templates(), "launch-template")
+            exclusions.add(f.fetch_instances(), "instance")
+
+        # AMIs are streamed page by page from aws when not provided
+        if not available_amis and self.store:
+            available_amis = self.fetch_stored_amis()
+        elif not available_amis:
+            available_amis = f.iter_available_amis(
+                self.owner_id, self.get_images_filters()
+            )
+        elif isinstance(available_amis, dict):
+            available_amis = available_amis.values()
 
-        if not excluded_amis:
-            excluded_amis += f.fetch_unattached_lc()
-            excluded_amis += f.fetch_zeroed_asg()
-            excluded_amis += f.fetch_instances()
+        candidates = []
+        excluded = []
+        for ami in available_amis:
+            if ami.id in exclusions:
+                excluded.append(ami)
+            else:
+                candidates.append(ami)
 
-        candidates = [v
-                      for k, v
-                      in available_amis.items()
-                      if k not in excluded_amis]
+        self.exclusions = exclusions
+        self.excluded = excluded
         return candidates
 
     def prepare_candidates(self, candidates_amis=None):
 
         """ From an AMI list apply mapping strategy and filters """
 
-        candidates_amis = candidates_amis or self.fetch_candidates()
+        writer = self.get_report_writer()
+        try:
+            report = self.build_report(candidates_amis, writer)
+
+            if report is None:
+                return None
+
+            writer.exclusions(self.excluded, self.exclusions)
+        finally:
+            writer.close()
+
+        return self.report_candidates(report)
+
+    def get_report_writer(self):
+
+        """ Returns the writer of the report format of the run """
+
+        return get_report_writer(
+            self.report_format, self.report_output, self.full_report,
+            self.report_stream
+        )
+
+    def build_report(self, candidates_amis=None, writer=None):
+
+        """
+        From an AMI list apply mapping strategy and filters
+        and returns the AMIs to clean by group name,
+        AMIs kept by group name are stored in `kept`.
+        Groups are written to the report writer as they are reduced
+        """
+
+        if not candidates_amis:
+            with self.metrics.phase("fetch"):
+                candidates_amis = self.fetch_candidates()
 
         if not candidates_amis:
             return None
 
-        c = AMICleaner()
+        c = AMICleaner(ec2=self.client('ec2'))
 
-        mapped_amis = c.map_candidates(
-            candidates_amis=candidates_amis,
-            mapping_strategy=self.mapping_strategy,
-        )
+        with self.metrics.phase("map"):
+            mapped_amis = c.map_candidates(
+                candidates_amis=candidates_amis,
+                mapping_strategy=self.mapping_strategy,
+            )
 
         if not mapped_amis:
             return None
 
-        candidates = []
         report = dict()
+        now = time.time()
+
+        with self.metrics.phase("reduce"):
+            splits = dict(
+                (group_name, c.split_candidates(amis, self.keep_previous, self.ami_min_days, now))
+                for group_name, amis in mapped_amis.items() if group_name
+            )
+            if self.store:
+                splits = self.verify_kept(c, mapped_amis, splits, now)
+
+            for group_name, amis in mapped_amis.items():
+                group_name = group_name or ""
+
+                if not group_name:
+                    report[NO_TAGS_GROUP] = amis
+                    if writer:
+                        writer.group(NO_TAGS_GROUP, amis, excluded=True)
+                else:
+                    kept, reduced = splits[group_name]
+                    if kept:
+                        self.kept[group_name] = kept
+                    if reduced:
+                        report[group_name] = reduced
+                        if writer:
+                            writer.group(group_name, reduced, kept)
 
-        for group_name, amis in mapped_amis.items():
-            group_name = group_name or ""
+        return report
 
-            if not group_name:
-                report["no-tags (excluded)"] = amis
-            else:
-                reduced = c.reduce_candidates(amis, self.keep_previous, self.ami_min_days)
-                if reduced:
-                    report[group_name] = reduced
-                    candidates.extend(reduced)
+    @staticmethod
+    def report_candidates(report):
 
-        Printer.print_report(report, self.full_report)
+        """ Returns the AMIs to delete from a report """
 
-        return candidates
+        return [ami
+                for group_name, amis in report.items()
+                if group_name != NO_TAGS_GROUP
+                for ami in amis]
 
     def prepare_delete_amis(self, candidates, from_ids=False):
 
         """ Prepare deletion of candidates AMIs"""
 
         failed = []
+        cleaner = AMICleaner(
+            ec2=self.client('ec2'), workers=self.workers,
+            journal=self.journal, scope=self.label,
+            snapshot_workers=self.snapshot_workers
+        )
 
         if from_ids:
             if self.dry_run:
@@ -111,24 +422,70 @@ class App(object):
                 print(TERM.bold("\nCleaning {} from AMI id(s) ...".format(
                     len(candidates))
                 ))
-                failed = AMICleaner().remove_amis_from_ids(candidates, self.owner_id)
+                with self.metrics.phase("delete"):
+                    failed = cleaner.remove_amis_from_ids(candidates, self.owner_id)
         else:
             if self.dry_run:
                 print(TERM.bold("\n[dry-run] Would clean {} AMIs ...".format(len(candidates))))
             else:
                 print(TERM.bold("\nCleaning {} AMIs ...".format(len(candidates))))
-                failed = AMICleaner().remove_amis(candidates)
+                with self.metrics.phase("delete"):
+                    failed = cleaner.remove_amis(candidates)
+
+        self.results = cleaner.results
+        self.print_deletion(cleaner, failed)
+
+    def print_deletion(self, cleaner, failed):
+
+        """ Prints the results of a cleaner deletions """
+
+        if cleaner.results:
+            self.invalidate_cache([r.ami_id for r in cleaner.results if r.deregistered])
+            Printer.print_deletion_results(cleaner.results, self.full_report)
+            if self.full_report:
+                Printer.print_stages(cleaner.progress)
 
         if failed:
             print(TERM.red("\n{0} failed snapshots".format(len(failed))))
             Printer.print_failed_snapshots(failed)
 
+    def resume_deletion(self):
+
+        """ Finishes the deletions of the last run from the journal """
+
+        cleaner = AMICleaner(
+            ec2=self.client('ec2'), workers=self.workers,
+            journal=self.journal, scope=self.label,
+            snapshot_workers=self.snapshot_workers
+        )
+
+        if self.dry_run:
+            pending = self.journal.pending(self.label)
+            print(TERM.bold("\n[dry-run] Would resume {0} AMIs deletion".format(len(pending))))
+            return self
+
+        print(TERM.bold("\nResuming deletions of {0} ...".format(
+            self.journal.path + (" in " + self.label if self.label else ""))))
+        with self.metrics.phase("delete"):
+            failed = cleaner.resume()
+
+        if not cleaner.results:
+            print(TERM.bold("Nothing left to delete"))
+
+        self.print_deletion(cleaner, failed)
+        return self
+
     def clean_orphans(self, owner_id):
 
         """ Find and removes orphan snapshots """
 
-        cleaner = OrphanSnapshotCleaner()
-        snaps = cleaner.fetch(owner_id)
+        cleaner = OrphanSnapshotCleaner(
+            ec2=self.client('ec2'),
+            inventory=self.get_inventory(),
+            page_size=self.page_size
+        )
+        with self.metrics.phase("orphans"):
+            snaps = cleaner.fetch(owner_id)
 
         if not snaps:
             return
@@ -145,7 +502,9 @@ class App(object):
 
         if confirm:
             print("Removing orphan snapshots... ")
-            count = cleaner.clean(snaps)
+            with self.metrics.phase("delete"):
+                count = cleaner.clean(snaps)
+            self.invalidate_cache()
             print("\n{0} orphan snapshots successfully removed !".format(count))
 
     def print_defaults(self):
@@ -154,16 +513,297 @@ class App(object):
         print(TERM.green("owner_id : {0}".format(self.owner_id)))
         print(TERM.green("mapping_key : {0}".format(self.mapping_key)))
         print(TERM.green("mapping_values : {0}".format(self.mapping_values)))
+        if self.mapping_key == "name":
+            print(TERM.green("mapping_match : {0}".format(self.mapping_match)))
         print(TERM.green("excluded_mapping_values : {0}".format(self.excluded_mapping_values)))
         print(TERM.green("keep_previous : {0}".format(self.keep_previous)))
         print(TERM.green("ami_min_days : {0}".format(self.ami_min_days)))
+        print(TERM.green("workers : {0}".format(self.workers)))
+        if self.snapshot_workers:
+            print(TERM.green("snapshot_workers : {0}".format(self.snapshot_workers)))
+        print(TERM.green("max_api_rate : {0}/s".format(self.limiter.max_rate)))
+        if self.cache:
+            print(TERM.green("cache : {0} (ttl {1}s)".format(self.cache.path, self.cache.ttl)))
+        if self.store:
+            print(TERM.green("incremental inventory : {0}".format(self.store.path)))
+        if self.regions:
+            print(TERM.green("regions : {0}".format(self.regions)))
+        if self.role_arns:
+            print(TERM.green("role_arns : {0}".format(len(self.role_arns))))
+            print(TERM.green("concurrency : {0}".format(self.concurrency)))
 
     @staticmethod
     def print_version():
         print(__version__)
 
+    def confirm_deletion(self, count):
+
+        """ Asks for confirmation before removing count AMIs """
+
+        if self.dry_run:
+            return False
+
+        if self.force_delete:
+            return True
+
+        answer = input(
+            "Do you want to continue and remove {} AMIs "
+            "[y/N] ? : ".format(count))
+        return answer.lower() == "y"
+
+    def plan(self):
+
+        """ Runs fetch, map and reduce on this App target """
+
+        start = time.time()
+        try:
+            self.report = self.build_report() or dict()
+        except (BotoCoreError, ClientError) as e:
+            self.error = str(e)
+        self.timings["plan"] = time.time() - start
+
+        return self
+
+    def delete(self):
+
+        """ Removes the AMIs planned on this App target """
+
+        candidates = self.report_candidates(self.report)
+
+        start = time.time()
+        if candidates:
+            try:
+                self.prepare_delete_amis(candidates)
+            except (BotoCoreError, ClientError) as e:
+                self.error = str(e)
+        self.timings["delete"] = time.time() - start
+
+        return self
+
+    def check_report(self):
+
+        """
+        Checks the plan of this App target on aws before deleting it,
+        see check_plan : stale groups are left out and the AMIs used
+        since the plan are dropped
+        """
+
+        try:
+            checked, stale = check_plan(self.client('ec2'), {
+                "owner_id": self.owner_id, "groups": dump_groups(self)
+            })
+        except (BotoCoreError, ClientError) as e:
+            self.error = str(e)
+            self.report = dict()
+            return self
+
+        # the planned AMIs are kept, with their details
+        checked_ids = set(ami.id for amis in checked.values() for ami in amis)
+        self.report = dict(
+            (group_name, [ami for ami in self.report[group_name] if ami.id in checked_ids])
+            for group_name in checked
+        )
+        if stale:
+            self.error = "stale groups {0}".format(", ".join(stale))
+
+        return self
+
+    def get_targets(self):
+
+        """ Returns an App per account and region to clean """
+
+        regions = self.regions or [None]
+        if "all" in regions:
+            regions = get_enabled_regions(self.session)
+
+        role_arns = self.role_arns or [None]
+
+        targets = []
+        for role_arn in role_arns:
+            for region in regions:
+                label = "/".join(
+                    p for p in (get_account_id(role_arn), region) if p
+                )
+                targets.append(self.for_target(region, role_arn, label))
+
+        return targets
+
+    def plan_targets(self, targets):
+
+        """
+        Plans every target concurrently, prints a merged report
+        and returns the number of AMIs to remove
+        """
+
+        print(TERM.bold("\nRetrieving AMIs to clean in {0} target(s) ...".format(len(targets))))
+        fan_out(lambda target: target.plan(), targets, self.concurrency)
+
+        writer = self.get_report_writer()
+        try:
+            for target in targets:
+                for group_name, amis in target.report.items():
+                    writer.group(
+                        "/".join(p for p in (target.label, group_name) if p), amis,
+                        target.kept.get(group_name), group_name == NO_TAGS_GROUP
+                    )
+            for target in targets:
+                writer.exclusions(target.excluded, target.exclusions, target.label)
+        finally:
+            writer.close()
+
+        return sum(len(target.report_candidates(target.report)) for target in targets)
+
+    def delete_targets(self, targets, count):
+
+        """ Deletes the AMIs of every target after a single confirmation """
+
+        if count and self.confirm_deletion(count):
+            fan_out(lambda target: target.delete(), targets, self.concurrency)
+        else:
+            print(TERM.bold("Found {} AMIs to remove".format(count)))
+
+        Printer.print_targets(targets)
+
+    def run_targets(self, targets):
+
+        """
+        Runs the whole pipeline on every target concurrently,
+        prints a merged report and deletes after a single confirmation
+        """
+
+        if self.check_orphans:
+            for target in targets:
+                print(TERM.bold("\nOrphan snapshots in {0}".format(target.label)))
+                target.clean_orphans(target.owner_id)
+
+        self.delete_targets(targets, self.plan_targets(targets))
+
+    def write_plan_file(self):
+
+        """ Plans every target and writes the plan file to apply later """
+
+        targets = [self]
+        if self.regions or self.role_arns:
+            targets = self.get_targets()
+
+        count = self.plan_targets(targets)
+        write_plan(self.plan_file, dump_plan(targets))
+        Printer.print_targets(targets)
+        print(TERM.bold("Planned {0} AMIs to remove in {1}".format(count, self.plan_file)))
+
+    def load_plan(self, target_plan):
+
+        """
+        Loads the AMIs to delete on this App target from its plan,
+        checked on aws first with check_stale. Plans of another
+        account or region than the current credentials are refused
+        """
+
+        start = time.time()
+        try:
+            scope = self.get_scope()
+        except (BotoCoreError, ClientError) as e:
+            self.error = str(e)
+            return self
+
+        if scope != target_plan["scope"]:
+            self.error = "plan of {0}, credentials of {1}".format(target_plan["scope"], scope)
+        elif not self.check_stale:
+            self.report = load_report(target_plan)
+        else:
+            try:
+                self.report, stale = check_plan(self.client('ec2'), target_plan)
+            except (BotoCoreError, ClientError) as e:
+                self.error = str(e)
+            else:
+                if stale:
+                    self.error = "stale groups {0}".format(", ".join(stale))
+        self.timings["plan"] = time.time() - start
+
+        return self
+
+    def apply_plan_file(self):
+
+        """
+        Deletes the AMIs of a plan file on its targets,
+        without fetching the inventory again
+        """
+
+        try:
+            plan = read_plan(self.plan_file)
+        except (IOError, ValueError) as e:
+            print(TERM.red("Invalid plan {0} : {1}".format(self.plan_file, e)))
+            sys.exit(1)
+
+        targets = []
+        for target_plan in plan["targets"]:
+            # a single target plan is applied with the default region
+            target = self
+            if target_plan["label"]:
+                target = self.for_target(
+                    target_plan["region"], target_plan["role_arn"], target_plan["label"]
+                )
+            targets.append((target, target_plan))
+
+        print(TERM.bold("\nApplying {0} planned at {1} ...".format(
+            self.plan_file, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(plan["generated"])))))
+        fan_out(lambda pair: pair[0].load_plan(pair[1]), targets, self.concurrency)
+
+        targets = [target for target, _ in targets]
+        count = sum(len(target.report_candidates(target.report)) for target in targets)
+        self.delete_targets(targets, count)
+
     def run_cli(self):
 
+        # a machine readable report on stdout is kept apart
+        # from the messages and prompts, printed to stderr
+        if self.report_format != "table" and not self.report_output:
+            self.report_stream = sys.stdout
+            sys.stdout = sys.stderr
+
+        try:
+            self.run()
+        finally:
+            if self.report_stream:
+                sys.stdout = self.report_stream
+            if self.journal:
+                self.journal.close()
+            if self.cache:
+                Printer.print_cache_stats(self.cache.stats())
+            if self.metrics_json:
+                self.metrics.write_json(self.metrics_json)
+            if self.metrics_prom:
+                self.metrics.write_prometheus(self.metrics_prom)
+
+    def run(self):
+
+        if self.command == "plan":
+            self.print_defaults()
+            self.write_plan_file()
+            return
+
+        if self.command == "apply":
+            self.apply_plan_file()
+            return
+
+        if self.serve:
+            self.print_defaults()
+            serve(self, self.serve_address, self.serve_port, self.serve_interval)
+            return
+
+        if self.resume:
+            targets = [self]
+            if self.regions or self.role_arns:
+                targets = self.get_targets()
+            for target in targets:
+                target.resume_deletion()
+            return
+
+        if (self.regions or self.role_arns) and not self.from_ids:
+            self.print_defaults()
+            self.run_targets(self.get_targets())
+            return
+
         if self.check_orphans:
             self.clean_orphans(self.owner_id)
 
@@ -179,18 +819,7 @@ class App(object):
             if not candidates:
                 sys.exit(0)
 
-            if self.dry_run:
-                delete = False
-            else:
-                if not self.force_delete:
-                    answer = input(
-                        "Do you want to continue and remove {} AMIs "
-                        "[y/N] ? : ".format(len(candidates)))
-                    delete = (answer.lower() == "y")
-                else:
-                    delete = True
-
-            if delete:
+            if self.confirm_deletion(len(candidates)):
                 self.prepare_delete_amis(candidates)
             else:
                 print(TERM.bold("Found {} AMIs to remove".format(len(candidates))))
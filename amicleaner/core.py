@@ -4,22 +4,30 @@
 from __future__ import print_function
 from __future__ import absolute_import
 from builtins import object
-import boto3
-from botocore.exceptions import ClientError
-from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import threading
+import time
 
-from .resources.config import BOTO3_RETRIES
-from .resources.models import AMI
+from .inventory import Inventory
+from .limiter import get_limited_client
+from .matcher import NameMatcher
+from .resources.config import GONE_ERRORS, PAGE_SIZE, WORKERS
+from .resources.models import AMI, AMIDeletionResult
 
-from datetime import datetime
+# messages of the deletion threads are printed whole, one at a time
+_print_lock = threading.Lock()
 
 
 class OrphanSnapshotCleaner(object):
 
     """ Finds and removes ebs snapshots left orphaned """
 
-    def __init__(self, ec2=None):
-        self.ec2 = ec2 or boto3.client('ec2', config=Config(retries={'max_attempts': BOTO3_RETRIES}))
+    def __init__(self, ec2=None, inventory=None, page_size=PAGE_SIZE):
+        self.ec2 = ec2 or get_limited_client('ec2')
+        self.inventory = inventory or Inventory(ec2=self.ec2)
+        self.page_size = page_size
 
     def get_snapshots_filter(self):
 
@@ -34,41 +42,76 @@ class OrphanSnapshotCleaner(object):
             ]
         }]
 
-    def get_owner_id(self, images_json):
+    @staticmethod
+    def get_snapshot_key(snapshot_id):
 
-        """ Return AWS owner id from a ami json list """
+        """
+        Return a compact key for a snapshot id, an int built from its
+        hexadecimal part and length, ex: snap-4e8fae6b
+        """
 
-        images = images_json or []
+        try:
+            digits = snapshot_id[len("snap-"):]
+            return int(digits, 16) | (len(digits) << 72)
+        except (TypeError, ValueError):
+            return snapshot_id
 
-        if not images:
-            return None
+    def get_used_snapshots(self, owner_id):
 
-        return images[0].get("OwnerId", "")
+        """
+        Return the keys of the snapshots used by the owner AMIs
+        and the aws account id owning them
+        """
 
-    def fetch(self, owner_id):
+        used_snaps = set()
+        account_id = None
 
-        """ retrieve orphan snapshots """
+        pages = self.inventory.pages(
+            self.ec2.describe_images,
+            page_size=self.page_size,
+            exclusion=True,
+            Owners=[owner_id]
+        )
+        for page in pages:
+            for image in page.get("Images", []):
+                account_id = account_id or image.get("OwnerId")
+                for ebs in image.get("BlockDeviceMappings", []):
+                    snapshot_id = ebs.get("Ebs", {}).get("SnapshotId")
+                    if snapshot_id:
+                        used_snaps.add(self.get_snapshot_key(snapshot_id))
+
+        return used_snaps, account_id
 
-        resp = self.ec2.describe_images(Owners=[owner_id])
+    def iter_orphans(self, owner_id='self'):
+
+        """
+        Yields orphan snapshots ids, snapshots are streamed page by page
+        and checked against the index of snapshots used by AMIs
+        """
 
-        used_snaps = [
-            ebs.get("Ebs", {}).get("SnapshotId")
-            for image in resp.get("Images")
-            for ebs in image.get("BlockDeviceMappings")
-        ]
-        snap_filter = self.get_snapshots_filter()
-        owner_id = self.get_owner_id(resp.get("Images"))
+        used_snaps, account_id = self.get_used_snapshots(owner_id)
 
-        if not owner_id:
-            return []
+        if not account_id:
+            return
 
         # all snapshots created for AMIs
-        resp = self.ec2.describe_snapshots(
-            Filters=snap_filter, OwnerIds=[owner_id]
+        pages = self.inventory.pages(
+            self.ec2.describe_snapshots,
+            page_size=self.page_size,
+            Filters=self.get_snapshots_filter(),
+            OwnerIds=[account_id]
         )
+        for page in pages:
+            for snap in page.get("Snapshots", []):
+                snapshot_id = snap.get("SnapshotId")
+                if self.get_snapshot_key(snapshot_id) not in used_snaps:
+                    yield snapshot_id
+
+    def fetch(self, owner_id='self'):
+
+        """ retrieve orphan snapshots """
 
-        all_snaps = [snap.get("SnapshotId") for snap in resp["Snapshots"]]
-        return list(set(all_snaps) - set(used_snaps))
+        return list(self.iter_orphans(owner_id))
 
     def clean(self, snapshots):
 
@@ -93,42 +136,213 @@ class OrphanSnapshotCleaner(object):
         print(msg)
 
 
+class StageProgress(object):
+
+    """ Thread safe progress counters of a deletion stage """
+
+    def __init__(self):
+        self.queued = 0
+        self.done = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def add(self, counter, count=1):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + count)
+
+    def to_dict(self):
+        with self.lock:
+            return {"queued": self.queued, "done": self.done, "failed": self.failed}
+
+
 class AMICleaner(object):
 
-    def __init__(self, ec2=None):
-        self.ec2 = ec2 or boto3.client('ec2', config=Config(retries={'max_attempts': BOTO3_RETRIES}))
+    def __init__(self, ec2=None, workers=WORKERS, journal=None, scope="", snapshot_workers=None):
+        self.ec2 = ec2 or get_limited_client('ec2')
+        self.workers = max(workers or 1, 1)
+        self.snapshot_workers = max(snapshot_workers or self.workers, 1)
+        self.results = []
+        # deregistrations and snapshot deletions are pipelined stages
+        self.progress = {"deregister": StageProgress(), "snapshots": StageProgress()}
+        self.journal = journal
+        self.scope = scope
+        # resources deleted by an interrupted run are not errors on resume
+        self.resuming = False
 
     @staticmethod
     def get_ami_sorting_key(ami):
 
         """ return a key for sorting array of AMIs """
 
-        return ami.creation_date
+        return ami.creation_timestamp or 0
+
+    def is_gone(self, error):
+
+        """ Returns whether a resume failed on a resource already deleted """
+
+        if not isinstance(error, ClientError):
+            return False
+        code = error.response.get("Error", {}).get("Code")
+        return self.resuming and code in GONE_ERRORS
+
+    def deregister_ami(self, ami, result, deregistered=False):
+
+        """
+        deregister an AMI, first stage of its removal
+        :param deregistered: the AMI is already deregistered
+        :return: whether its snapshots can be removed
+        """
+
+        progress = self.progress["deregister"]
+
+        if not deregistered:
+            progress.add("queued")
+            try:
+                self.ec2.deregister_image(ImageId=ami.id)
+            # errors the rate limiter gave up on fail this AMI only
+            except (BotoCoreError, ClientError) as e:
+                if not self.is_gone(e):
+                    progress.add("failed")
+                    result.error = str(e)
+                    self.log("{0} deregistration failed : {1}".format(ami.id, e))
+                    return False
+            if self.journal:
+                self.journal.deregistered(ami.id, self.scope)
+            progress.add("done")
+            self.log("{0} deregistered".format(ami.id))
+
+        result.deregistered = True
+        return True
+
+    def delete_snapshot(self, snapshot_id, result):
+
+        """ deletes a snapshot of a deregistered AMI, second stage of its removal """
+
+        progress = self.progress["snapshots"]
+
+        try:
+            self.ec2.delete_snapshot(SnapshotId=snapshot_id)
+        except (BotoCoreError, ClientError) as e:
+            if not self.is_gone(e):
+                progress.add("failed")
+                result.failed_snapshots.append(snapshot_id)
+                return
+        if self.journal:
+            self.journal.snapshot_deleted(snapshot_id, self.scope)
+        progress.add("done")
+        result.deleted_snapshots.append(snapshot_id)
+        self.log("{0} deleted".format(snapshot_id))
+
+    @staticmethod
+    def log(msg):
+        with _print_lock:
+            print(msg)
+
+    @staticmethod
+    def get_snapshot_ids(ami):
+        return [block_device.snapshot_id
+                for block_device in ami.block_device_mappings
+                if block_device.snapshot_id is not None]
+
+    def remove_ami(self, ami, deregistered=False):
+
+        """
+        deregister an AMI and removes its snapshots
+        :param ami: AMI object
+        :param deregistered: only removes the snapshots of the AMI
+        :return: AMIDeletionResult
+        """
+
+        result = AMIDeletionResult(ami.id)
+
+        if self.deregister_ami(ami, result, deregistered):
+            snapshot_ids = self.get_snapshot_ids(ami)
+            self.progress["snapshots"].add("queued", len(snapshot_ids))
+            for snapshot_id in snapshot_ids:
+                self.delete_snapshot(snapshot_id, result)
+
+        return result
+
+    def remove_pipelined(self, pending):
+
+        """
+        removes (AMI, deregistered) pairs in two stages : `workers`
+        threads deregister AMIs and queue their snapshots to a pool
+        of `snapshot_workers` threads deleting them, deregistrations
+        never wait for snapshot deletions
+        :return: AMIDeletionResult list, in the pending order
+        """
+
+        results = [AMIDeletionResult(ami.id) for ami, _ in pending]
+        snapshots = []
+
+        with ThreadPoolExecutor(max_workers=self.snapshot_workers) as snapshot_executor:
+
+            def deregister(i):
+                ami, deregistered = pending[i]
+                if self.deregister_ami(ami, results[i], deregistered):
+                    for snapshot_id in self.get_snapshot_ids(ami):
+                        self.progress["snapshots"].add("queued")
+                        snapshots.append(snapshot_executor.submit(
+                            self.delete_snapshot, snapshot_id, results[i]
+                        ))
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(deregister, range(len(pending))))
+
+            # every snapshot is queued once the deregistrations are done
+            for future in snapshots:
+                future.result()
+
+        return results
 
     def remove_amis(self, amis):
 
         """
-        deregister AMIs (array) and removes related snapshots
+        deregister AMIs (array) and removes related snapshots,
+        up to `workers` AMIs are processed in parallel.
+        Per AMI results are kept in `results`
         :param amis: array of AMI objects
+        :return: array of snapshots ids which failed to be deleted
         """
 
-        failed_snapshots = []
-
         amis = amis or []
-        for ami in amis:
-            self.ec2.deregister_image(ImageId=ami.id)
-            print("{0} deregistered".format(ami.id))
-            for block_device in ami.block_device_mappings:
-                if block_device.snapshot_id is not None:
-                    try:
-                            self.ec2.delete_snapshot(
-                                SnapshotId=block_device.snapshot_id
-                            )
-                    except ClientError:
-                        failed_snapshots.append(block_device.snapshot_id)
-                    print("{0} deleted\n".format(block_device.snapshot_id))
-
-        return failed_snapshots
+
+        if self.journal and amis:
+            self.journal.plan(amis, self.scope)
+
+        return self.remove_pending([(ami, False) for ami in amis])
+
+    def remove_pending(self, pending):
+
+        """
+        removes (AMI, deregistered) pairs, AMIs already
+        deregistered only have their snapshots removed
+        :return: array of snapshots ids which failed to be deleted
+        """
+
+        if self.workers == self.snapshot_workers == 1 or len(pending) < 2:
+            self.results = [self.remove_ami(*p) for p in pending]
+        else:
+            self.results = self.remove_pipelined(pending)
+
+        return [snapshot_id
+                for result in self.results
+                for snapshot_id in result.failed_snapshots]
+
+    def resume(self):
+
+        """
+        finishes the deletions of the last run recorded in the journal,
+        without fetching the inventory again
+        :return: array of snapshots ids which failed to be deleted
+        """
+
+        self.resuming = True
+        try:
+            return self.remove_pending(self.journal.pending(self.scope))
+        finally:
+            self.resuming = False
 
     def remove_amis_from_ids(self, ami_ids, owner_id):
 
@@ -162,6 +376,8 @@ class AMICleaner(object):
         example :
         mapping_strategy = {"key": "name", "values": ["ubuntu", "debian"]}
         or
+        mapping_strategy = {"key": "name", "values": ["ubuntu-1", "ubuntu-2"], "match": "prefix"}
+        or
         mapping_strategy = {"key": "tags", "values": ["env", "role"], "excluded": ["master", "develop"]}
 
         print map_candidates(candidates_amis, mapping_strategy)
@@ -188,15 +404,21 @@ class AMICleaner(object):
         if not mapping_strategy:
             return candidates_amis
 
+        matcher = None
+        if mapping_strategy.get("key") == "name":
+            matcher = NameMatcher(
+                mapping_strategy.get("values"),
+                mapping_strategy.get("match") or "substring"
+            )
+
         candidates_map = dict()
         for ami in candidates_amis:
             # case : grouping on name
-            if mapping_strategy.get("key") == "name":
-                for mapping_value in mapping_strategy.get("values"):
-                    if mapping_value in ami.name:
-                        mapping_list = candidates_map.get(mapping_value) or []
-                        mapping_list.append(ami)
-                        candidates_map[mapping_value] = mapping_list
+            if matcher:
+                for mapping_value in matcher.match(ami.name):
+                    mapping_list = candidates_map.get(mapping_value) or []
+                    mapping_list.append(ami)
+                    candidates_map[mapping_value] = mapping_list
             # case : grouping on tags
             elif mapping_strategy.get("key") == "tags":
                 mapping_value = self.tags_values_to_string(
@@ -239,37 +461,48 @@ class AMICleaner(object):
 
         return ".".join(sorted(tag_values))
 
-    def reduce_candidates(self, mapped_candidates_ami, keep_previous=0, ami_min_days=-1):
+    def split_candidates(self, mapped_candidates_ami, keep_previous=0, ami_min_days=-1, now=None):
 
         """
-        Given a array of AMIs to clean this function return a subsequent
-        list by preserving a given number of them (history) based on creation
-        time and rotation_strategy param
+        Given a array of AMIs to clean this function returns the AMIs kept,
+        the keep_previous most recent ones, and the AMIs to delete, in their
+        original order. AMIs younger than ami_min_days are never deleted
+        :param now: epoch seconds the AMIs age is computed from, once per run
         """
 
-        result_amis = []
-        result_amis.extend(mapped_candidates_ami)
-
         if ami_min_days > 0:
-            for ami in mapped_candidates_ami:
-                f_date = datetime.strptime(ami.creation_date, '%Y-%m-%dT%H:%M:%S.%fZ')
-                present = datetime.now()
-                delta = present - f_date
-                if delta.days < ami_min_days:
-                    result_amis.remove(ami)
-
-        mapped_candidates_ami = result_amis
-
-        if not keep_previous:
-            return mapped_candidates_ami
+            cutoff = (now or time.time()) - ami_min_days * 86400
+            # AMIs without creation date are too recent to be removed
+            mapped_candidates_ami = [
+                ami for ami in mapped_candidates_ami
+                if ami.creation_timestamp is not None and
+                ami.creation_timestamp <= cutoff
+            ]
+        else:
+            mapped_candidates_ami = list(mapped_candidates_ami)
 
-        if not mapped_candidates_ami:
-            return mapped_candidates_ami
+        if not keep_previous or not mapped_candidates_ami:
+            return [], mapped_candidates_ami
 
-        amis = sorted(
+        # partial selection of the most recent AMIs, O(n log k)
+        kept = heapq.nlargest(
+            keep_previous,
             mapped_candidates_ami,
-            key=self.get_ami_sorting_key,
-            reverse=True
+            key=self.get_ami_sorting_key
         )
+        kept_ids = set(id(ami) for ami in kept)
+
+        return kept, [ami for ami in mapped_candidates_ami
+                      if id(ami) not in kept_ids]
+
+    def reduce_candidates(self, mapped_candidates_ami, keep_previous=0, ami_min_days=-1, now=None):
+
+        """
+        Given a array of AMIs to clean this function return a subsequent
+        list by preserving a given number of them (history) based on creation
+        time and rotation_strategy param
+        """
 
-        return amis[keep_previous:]
+        return self.split_candidates(
+            mapped_candidates_ami, keep_previous, ami_min_days, now
+        )[1]
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+In process fake of the ec2 and autoscaling apis used by amicleaner,
+with configurable latency, page sizes and throttling, to measure
+throughput offline. Clients plug in through the ec2= and autoscaling=
+arguments of Fetcher, AMICleaner and OrphanSnapshotCleaner.
+
+    backend = FakeBackend(latency=0.05, page_size=100, throttle_rate=0.01)
+    backend.add_images(images_json)
+    fetcher = Fetcher(ec2=FakeEC2(backend), autoscaling=FakeAutoscaling(backend))
+"""
+
+from __future__ import absolute_import
+from builtins import object
+import fnmatch
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+THROTTLING_ERROR = "RequestLimitExceeded"
+
+
+def client_error(code, operation, message=""):
+
+    """ Return a botocore ClientError as raised by a boto3 client """
+
+    return ClientError(
+        {"Error": {"Code": code, "Message": message or code}}, operation
+    )
+
+
+class FakeBackend(object):
+
+    """
+    In memory state of an account shared by fake clients
+    :param latency: seconds each call takes, or dict of seconds by action
+    :param page_size: maximum number of items returned per page
+    :param throttle_rate: probability of a call to be throttled
+    :param rate_limit: calls per second per action above which calls
+    are throttled, None for unlimited
+    """
+
+    def __init__(self, latency=0, page_size=1000, throttle_rate=0, rate_limit=None,
+                 owner_id="123456789012", seed=42):
+        self.latency = latency
+        self.page_size = page_size
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self.owner_id = owner_id
+        self.random = random.Random(seed)
+
+        self.images = dict()
+        self.snapshots = dict()
+        self.instances = []
+        self.auto_scaling_groups = []
+        self.launch_configurations = []
+        self.launch_template_versions = []
+
+        self.calls = dict()
+        self.throttles = dict()
+        self.buckets = dict()
+        self.lock = threading.Lock()
+
+    def add_images(self, images):
+
+        """ Registers describe_images images and their snapshots """
+
+        with self.lock:
+            for image in images:
+                image.setdefault("OwnerId", self.owner_id)
+                image.setdefault("State", "available")
+                self.images[image["ImageId"]] = image
+                for device in image.get("BlockDeviceMappings", []):
+                    snapshot_id = device.get("Ebs", {}).get("SnapshotId")
+                    if snapshot_id:
+                        self.snapshots[snapshot_id] = {
+                            "SnapshotId": snapshot_id,
+                            "OwnerId": image["OwnerId"],
+                            "State": "completed",
+                            "Description": "Created by CreateImage(i-00000000) for {0}".format(
+                                image["ImageId"]),
+                        }
+
+    def add_snapshots(self, snapshots):
+
+        """ Registers describe_snapshots snapshots, ex: orphans """
+
+        with self.lock:
+            for snapshot in snapshots:
+                snapshot.setdefault("OwnerId", self.owner_id)
+                snapshot.setdefault("State", "completed")
+                self.snapshots[snapshot["SnapshotId"]] = snapshot
+
+    def add_instances(self, instances):
+
+        """ Registers describe_instances instances """
+
+        with self.lock:
+            for instance in instances:
+                instance.setdefault("State", {"Name": "running"})
+                self.instances.append(instance)
+
+    def add_auto_scaling_groups(self, groups, launch_configurations=None, launch_template_versions=None):
+
+        """ Registers autoscaling groups and their launch configurations or templates """
+
+        with self.lock:
+            self.auto_scaling_groups.extend(groups)
+            self.launch_configurations.extend(launch_configurations or [])
+            self.launch_template_versions.extend(launch_template_versions or [])
+
+    def is_throttled(self, action):
+        if self.throttle_rate and self.random.random() < self.throttle_rate:
+            return True
+
+        if not self.rate_limit:
+            return False
+
+        # server side token bucket, one per action
+        now = time.time()
+        tokens, last = self.buckets.get(action, (self.rate_limit, now))
+        tokens = min(self.rate_limit, tokens + (now - last) * self.rate_limit)
+        if tokens < 1:
+            self.buckets[action] = (tokens, now)
+            return True
+        self.buckets[action] = (tokens - 1, now)
+        return False
+
+    def call(self, action, func):
+
+        """
+        Runs an api action : counts it, waits for its latency and
+        raises a throttling error when the action is throttled
+        """
+
+        latency = self.latency
+        if isinstance(latency, dict):
+            latency = latency.get(action, 0)
+        if latency:
+            time.sleep(latency)
+
+        with self.lock:
+            self.calls[action] = self.calls.get(action, 0) + 1
+            if self.is_throttled(action):
+                self.throttles[action] = self.throttles.get(action, 0) + 1
+                raise client_error(THROTTLING_ERROR, action, "Request limit exceeded.")
+            resp = func()
+
+        resp["ResponseMetadata"] = {"HTTPStatusCode": 200, "RetryAttempts": 0}
+        return resp
+
+    def page(self, items, key, kwargs, size_param="MaxResults"):
+
+        """ Returns a page of items with the NextToken of the next one """
+
+        start = int(kwargs.get("NextToken") or 0)
+        end = start + min(kwargs.get(size_param) or self.page_size, self.page_size)
+        resp = {key: items[start:end]}
+        if end < len(items):
+            resp["NextToken"] = str(end)
+        return resp
+
+
+def get_tag_keys(item):
+    return [tag.get("Key") for tag in item.get("Tags", [])]
+
+
+# values a describe filter is matched against, by filter name
+FILTERS = {
+    "image-id": lambda item: [item.get("ImageId")],
+    "name": lambda item: [item.get("Name")],
+    "state": lambda item: [item.get("State")],
+    "status": lambda item: [item.get("State")],
+    "description": lambda item: [item.get("Description")],
+    "creation-date": lambda item: [item.get("CreationDate")],
+    "tag-key": get_tag_keys,
+    "instance-state-name": lambda item: [item.get("State", {}).get("Name")],
+}
+
+
+def match_filters(item, filters):
+
+    """ Returns whether an item matches every describe filter """
+
+    for f in filters or []:
+        values = FILTERS[f["Name"]](item)
+        if not any(fnmatch.fnmatchcase(str(value), pattern)
+                   for value in values if value is not None
+                   for pattern in f["Values"]):
+            return False
+    return True
+
+
+class FakeClientMeta(object):
+
+    def __init__(self, region_name):
+        self.region_name = region_name
+
+
+class FakeEC2(object):
+
+    """ Fake boto3 ec2 client """
+
+    def __init__(self, backend, region_name="us-east-1"):
+        self.backend = backend
+        self.meta = FakeClientMeta(region_name)
+
+    def describe_images(self, **kwargs):
+        def describe():
+            ids = kwargs.get("ImageIds")
+            owners = kwargs.get("Owners")
+            images = [
+                image for image in self.backend.images.values()
+                if (not ids or image["ImageId"] in ids) and
+                (not owners or "self" in owners or image["OwnerId"] in owners) and
+                match_filters(image, kwargs.get("Filters"))
+            ]
+            if ids and len(images) < len(set(ids)):
+                raise client_error("InvalidAMIID.NotFound", "DescribeImages")
+            return self.backend.page(images, "Images", kwargs)
+        return self.backend.call("DescribeImages", describe)
+
+    def deregister_image(self, ImageId):
+        def deregister():
+            if self.backend.images.pop(ImageId, None) is None:
+                raise client_error("InvalidAMIID.Unavailable", "DeregisterImage")
+            return {}
+        return self.backend.call("DeregisterImage", deregister)
+
+    def describe_snapshots(self, **kwargs):
+        def describe():
+            owners = kwargs.get("OwnerIds")
+            snapshots = [
+                snapshot for snapshot in self.backend.snapshots.values()
+                if (not owners or snapshot["OwnerId"] in owners) and
+                match_filters(snapshot, kwargs.get("Filters"))
+            ]
+            return self.backend.page(snapshots, "Snapshots", kwargs)
+        return self.backend.call("DescribeSnapshots", describe)
+
+    def delete_snapshot(self, SnapshotId):
+        def delete():
+            if SnapshotId not in self.backend.snapshots:
+                raise client_error("InvalidSnapshot.NotFound", "DeleteSnapshot")
+            for image in self.backend.images.values():
+                for device in image.get("BlockDeviceMappings", []):
+                    if device.get("Ebs", {}).get("SnapshotId") == SnapshotId:
+                        raise client_error("InvalidSnapshot.InUse", "DeleteSnapshot")
+            del self.backend.snapshots[SnapshotId]
+            return {}
+        return self.backend.call("DeleteSnapshot", delete)
+
+    def describe_instances(self, **kwargs):
+        def describe():
+            instances = [
+                instance for instance in self.backend.instances
+                if match_filters(instance, kwargs.get("Filters"))
+            ]
+            resp = self.backend.page(instances, "Instances", kwargs)
+            resp["Reservations"] = [{"Instances": resp.pop("Instances")}]
+            return resp
+        return self.backend.call("DescribeInstances", describe)
+
+    def describe_launch_template_versions(self, **kwargs):
+        def describe():
+            template_id = kwargs.get("LaunchTemplateId")
+            template_name = kwargs.get("LaunchTemplateName")
+            versions = [
+                version for version in self.backend.launch_template_versions
+                if (version.get("LaunchTemplateId") == template_id or
+                    version.get("LaunchTemplateName") == template_name) and
+                str(version.get("VersionNumber")) in kwargs.get("Versions", [])
+            ]
+            return self.backend.page(versions, "LaunchTemplateVersions", kwargs)
+        return self.backend.call("DescribeLaunchTemplateVersions", describe)
+
+    def describe_regions(self, **kwargs):
+        return self.backend.call(
+            "DescribeRegions",
+            lambda: {"Regions": [{"RegionName": self.meta.region_name}]}
+        )
+
+
+class FakeAutoscaling(object):
+
+    """ Fake boto3 autoscaling client """
+
+    def __init__(self, backend, region_name="us-east-1"):
+        self.backend = backend
+        self.meta = FakeClientMeta(region_name)
+
+    def describe_auto_scaling_groups(self, **kwargs):
+        return self.backend.call(
+            "DescribeAutoScalingGroups",
+            lambda: self.backend.page(
+                self.backend.auto_scaling_groups, "AutoScalingGroups",
+                kwargs, "MaxRecords"
+            )
+        )
+
+    def describe_launch_configurations(self, **kwargs):
+        def describe():
+            names = kwargs.get("LaunchConfigurationNames")
+            if names and len(names) > 50:
+                raise client_error("ValidationError", "DescribeLaunchConfigurations")
+            lcs = [lc for lc in self.backend.launch_configurations
+                   if not names or lc["LaunchConfigurationName"] in names]
+            return self.backend.page(lcs, "LaunchConfigurations", kwargs, "MaxRecords")
+        return self.backend.call("DescribeLaunchConfigurations", describe)
+
+
+class FakeSTS(object):
+
+    """ Fake boto3 sts client, credentials of the backend owner """
+
+    def __init__(self, backend, region_name="us-east-1"):
+        self.backend = backend
+        self.meta = FakeClientMeta(region_name)
+
+    def get_caller_identity(self):
+        return self.backend.call(
+            "GetCallerIdentity", lambda: {"Account": self.backend.owner_id}
+        )
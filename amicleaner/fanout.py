@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from concurrent.futures import ThreadPoolExecutor
+
+
+def fan_out(func, items, max_workers=None):
+
+    """
+    Calls func on every item from a bounded thread pool
+    and returns the results in the items order
+    :param max_workers: concurrency limit, None for one thread per item
+    """
+
+    items = list(items)
+
+    if not items:
+        return []
+
+    max_workers = min(max_workers or len(items), len(items))
+
+    if max_workers == 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(func, items))
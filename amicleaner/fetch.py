@@ -3,9 +3,9 @@
 
 from __future__ import absolute_import
 from builtins import object
-import boto3
-from botocore.config import Config
-from .resources.config import BOTO3_RETRIES
+from .inventory import Inventory
+from .limiter import get_limited_client
+from .resources.config import ACTIVE_INSTANCE_STATES, PAGE_SIZE
 from .resources.models import AMI
 
 
@@ -13,22 +13,43 @@ class Fetcher(object):
 
     """ Fetches function for AMI candidates to deletion """
 
-    def __init__(self, ec2=None, autoscaling=None):
+    def __init__(self, ec2=None, autoscaling=None, page_size=PAGE_SIZE, inventory=None):
 
-        """ Initializes aws sdk clients """
+        """ Initializes aws sdk clients and the run inventory """
 
-        self.ec2 = ec2 or boto3.client('ec2', config=Config(retries={'max_attempts': BOTO3_RETRIES}))
-        self.asg = autoscaling or boto3.client('autoscaling')
+        self.ec2 = ec2 or get_limited_client('ec2')
+        self.asg = autoscaling or get_limited_client('autoscaling')
+        self.page_size = page_size
+        self.inventory = inventory or Inventory(ec2=self.ec2, autoscaling=self.asg)
 
-    def fetch_available_amis(self, owner_id='self'):
+    def iter_available_amis(self, owner_id='self', filters=None):
+
+        """
+        Yields your custom AMIs one by one, fetching them page by page
+        so that the whole inventory never has to be held in memory
+        :param filters: describe_images Filters, see planner.py
+        """
+
+        kwargs = {"Filters": filters} if filters else {}
+        # AMIs kept by keep_previous protect the older ones
+        pages = self.inventory.pages(
+            self.ec2.describe_images,
+            page_size=self.page_size,
+            exclusion=True,
+            Owners=[owner_id],
+            **kwargs
+        )
+        for page in pages:
+            for image_json in page.get('Images', []):
+                yield AMI.object_with_json(image_json)
+
+    def fetch_available_amis(self, owner_id='self', filters=None):
 
         """ Retrieve from your aws account your custom AMIs"""
 
         available_amis = dict()
 
-        my_custom_images = self.ec2.describe_images(Owners=[owner_id])
-        for image_json in my_custom_images.get('Images'):
-            ami = AMI.object_with_json(image_json)
+        for ami in self.iter_available_amis(owner_id, filters):
             available_amis[ami.id] = ami
 
         return available_amis
@@ -40,21 +61,12 @@ class Fetcher(object):
         to autoscaling groups
         """
 
-        resp = self.asg.describe_auto_scaling_groups()
-        used_lc = (asg.get("LaunchConfigurationName", "")
-                   for asg in resp.get("AutoScalingGroups", []))
-
-        resp = self.asg.describe_launch_configurations()
-        all_lcs = (lc.get("LaunchConfigurationName", "")
-                   for lc in resp.get("LaunchConfigurations", []))
-
-        unused_lcs = list(set(all_lcs) - set(used_lc))
+        used_lc = set(asg.get("LaunchConfigurationName", "")
+                      for asg in self.inventory.auto_scaling_groups())
 
-        resp = self.asg.describe_launch_configurations(
-            LaunchConfigurationNames=unused_lcs
-        )
         amis = [lc.get("ImageId")
-                for lc in resp.get("LaunchConfigurations", [])]
+                for lc in self.inventory.launch_configurations()
+                if lc.get("LaunchConfigurationName", "") not in used_lc]
 
         return amis
 
@@ -64,40 +76,58 @@ class Fetcher(object):
         Find AMIs for autoscaling groups who's desired capacity is set to 0
         """
 
-        resp = self.asg.describe_auto_scaling_groups()
-        zeroed_lcs = [asg.get("LaunchConfigurationName", "")
-                      for asg in resp.get("AutoScalingGroups", [])
-                      if asg.get("DesiredCapacity", 0) == 0]
-
-        resp = self.asg.describe_launch_configurations(
-            LaunchConfigurationNames=zeroed_lcs
-        )
+        zeroed_lcs = [asg.get("LaunchConfigurationName")
+                      for asg in self.inventory.auto_scaling_groups()
+                      if asg.get("DesiredCapacity", 0) == 0 and
+                      asg.get("LaunchConfigurationName")]
 
         amis = [lc.get("ImageId", "")
-                for lc in resp.get("LaunchConfigurations", [])]
+                for lc in self.inventory.launch_configurations(zeroed_lcs)]
 
         return amis
 
+    def fetch_launch_templates(self):
+
+        """
+        Find AMIs for launch template versions used by autoscaling groups,
+        directly or through a mixed instances policy
+        """
+
+        specifications = []
+        for asg in self.inventory.auto_scaling_groups():
+            specifications.append(asg.get("LaunchTemplate") or {})
+
+            policy = asg.get("MixedInstancesPolicy", {}).get("LaunchTemplate", {})
+            specifications.append(policy.get("LaunchTemplateSpecification") or {})
+            specifications.extend(
+                override.get("LaunchTemplateSpecification") or {}
+                for override in policy.get("Overrides", [])
+            )
+
+        versions = self.inventory.launch_template_versions(specifications)
+
+        amis = [v.get("LaunchTemplateData", {}).get("ImageId")
+                for v in versions]
+
+        return [ami for ami in amis if ami and ami.startswith("ami-")]
+
     def fetch_instances(self):
 
         """ Find AMIs for not terminated EC2 instances """
 
-        resp = self.ec2.describe_instances(
+        instances = self.inventory.pages(
+            self.ec2.describe_instances,
+            exclusion=True,
             Filters=[
                 {
                     'Name': 'instance-state-name',
-                    'Values': [
-                        'pending',
-                        'running',
-                        'shutting-down',
-                        'stopping',
-                        'stopped'
-                    ]
+                    'Values': ACTIVE_INSTANCE_STATES
                 }
             ]
         )
         amis = [i.get("ImageId", None)
-                for r in resp.get("Reservations", [])
+                for page in instances
+                for r in page.get("Reservations", [])
                 for i in r.get("Instances", [])]
 
         return amis
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from builtins import object
+import threading
+
+from botocore.exceptions import ClientError
+
+from .aws import paginate
+from .fanout import fan_out
+from .resources.config import AUTOSCALING_PAGE_SIZE, LC_NAMES_CHUNK, WORKERS
+
+
+def chunks(items, size):
+
+    """ Splits a list in lists of at most size items """
+
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class Inventory(object):
+
+    """
+    Per run snapshot of aws collections, each collection is fetched
+    once and served from memory to every fetcher method
+    :param cache_exclusions: serve the resources protecting AMIs and
+    snapshots from deletion (instances, autoscaling groups, launch
+    configurations and templates, the AMIs listing whose kept AMIs
+    protect the older ones) from the cache, only safe when nothing
+    is deleted
+    """
+
+    def __init__(self, ec2=None, autoscaling=None, cache=None, scope=None, workers=WORKERS,
+                 cache_exclusions=True):
+        self.ec2 = ec2
+        self.asg = autoscaling
+        self.cache = cache
+        self.scope = scope
+        self.cache_exclusions = cache_exclusions
+        self.workers = workers
+        self.collections = dict()
+        self.launch_configurations_by_name = dict()
+        self.lock = threading.Lock()
+        self.locks = dict()
+
+    def pages(self, method, page_size=None, page_size_param='MaxResults', exclusion=False, **kwargs):
+
+        """
+        Yields the pages of an api call, from the on disk cache
+        when there is one, see aws.paginate
+        :param exclusion: the call lists resources protecting AMIs or snapshots
+        """
+
+        if self.cache is None or (exclusion and not self.cache_exclusions):
+            return paginate(method, page_size, page_size_param, **kwargs)
+
+        return self.cache.paginate(
+            self.scope, method, page_size, page_size_param, **kwargs
+        )
+
+    def collect(self, method, key, **kwargs):
+
+        """ Returns the items listed under key in every page of an api call """
+
+        return [item
+                for page in self.pages(method, exclusion=True, **kwargs)
+                for item in page.get(key, [])]
+
+    def memoize(self, name, fetch):
+
+        """
+        Returns a collection, fetching it on the first call only
+        :param name: collection name
+        :param fetch: function fetching the collection
+        """
+
+        with self.lock:
+            lock = self.locks.setdefault(name, threading.Lock())
+
+        with lock:
+            if name not in self.collections:
+                self.collections[name] = fetch()
+            return self.collections[name]
+
+    def auto_scaling_groups(self):
+
+        """ Returns every autoscaling group """
+
+        return self.memoize(
+            "auto_scaling_groups",
+            lambda: self.collect(
+                self.asg.describe_auto_scaling_groups, "AutoScalingGroups",
+                page_size=AUTOSCALING_PAGE_SIZE, page_size_param="MaxRecords"
+            )
+        )
+
+    def fetch_launch_configurations(self):
+
+        """ Fetches every launch configuration and indexes them by name """
+
+        lcs = self.collect(
+            self.asg.describe_launch_configurations, "LaunchConfigurations",
+            page_size=AUTOSCALING_PAGE_SIZE, page_size_param="MaxRecords"
+        )
+        with self.lock:
+            for lc in lcs:
+                self.launch_configurations_by_name[
+                    lc.get("LaunchConfigurationName")] = lc
+        return lcs
+
+    def fetch_named_launch_configurations(self, names):
+
+        """
+        Fetches launch configurations by name, in chunks of the
+        maximum number of names accepted by the api, concurrently
+        """
+
+        def fetch_chunk(chunk):
+            return self.collect(
+                self.asg.describe_launch_configurations,
+                "LaunchConfigurations",
+                LaunchConfigurationNames=chunk
+            )
+
+        results = fan_out(
+            fetch_chunk, chunks(sorted(names), LC_NAMES_CHUNK), self.workers
+        )
+        return [lc for lcs in results for lc in lcs]
+
+    def launch_configurations(self, names=None):
+
+        """
+        Returns every launch configuration or the ones named in names,
+        named launch configurations are only fetched when missing
+        from the inventory
+        """
+
+        if names is None:
+            return self.memoize(
+                "launch_configurations", self.fetch_launch_configurations
+            )
+
+        names = set(names)
+        with self.lock:
+            missing = [name for name in names
+                       if name not in self.launch_configurations_by_name]
+
+        if missing and "launch_configurations" not in self.collections:
+            lcs = self.fetch_named_launch_configurations(missing)
+            with self.lock:
+                for lc in lcs:
+                    self.launch_configurations_by_name[
+                        lc.get("LaunchConfigurationName")] = lc
+
+        with self.lock:
+            return [self.launch_configurations_by_name[name]
+                    for name in sorted(names)
+                    if name in self.launch_configurations_by_name]
+
+    def launch_template_versions(self, specifications):
+
+        """
+        Returns the launch template versions of a list of launch template
+        specifications, every version of a template is resolved in one
+        call and templates are resolved concurrently
+        :param specifications: array of dicts with LaunchTemplateId or
+        LaunchTemplateName and Version keys
+        """
+
+        versions = dict()
+        for spec in specifications:
+            if spec.get("LaunchTemplateId"):
+                template = ("LaunchTemplateId", spec.get("LaunchTemplateId"))
+            elif spec.get("LaunchTemplateName"):
+                template = ("LaunchTemplateName", spec.get("LaunchTemplateName"))
+            else:
+                continue
+            versions.setdefault(template, set()).add(
+                str(spec.get("Version") or "$Default")
+            )
+
+        def fetch_versions(template, numbers):
+            try:
+                return self.collect(
+                    self.ec2.describe_launch_template_versions,
+                    "LaunchTemplateVersions",
+                    Versions=numbers,
+                    **dict([template])
+                )
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code", "")
+                # a single deleted version fails the call of every version
+                if "VersionNotFound" in code and len(numbers) > 1:
+                    return [version
+                            for number in numbers
+                            for version in fetch_versions(template, [number])]
+                # templates or versions deleted since the groups were listed
+                if "NotFound" in code:
+                    return []
+                raise
+
+        def fetch_template(template):
+            return fetch_versions(template, sorted(versions[template]))
+
+        results = fan_out(fetch_template, sorted(versions), self.workers)
+        return [version for template in results for version in template]
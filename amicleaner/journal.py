@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from builtins import object
+import json
+import os
+import threading
+import time
+
+from .resources.models import AMI
+
+
+class DeletionJournal(object):
+
+    """
+    Append only json lines journal of AMI deletions : the AMIs planned
+    for deletion, then every deregistration and snapshot deletion as
+    it completes, so that an interrupted run can be resumed.
+    Each record is flushed and synced to disk before the next one
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+        self.started = False
+
+    def write(self, records, start=False):
+        with self.lock:
+            if start and not self.started:
+                self.started = True
+                records = [{"event": "run"}] + records
+            if self.file is None:
+                self.file = open(self.path, "a")
+            for record in records:
+                record["time"] = time.time()
+                self.file.write(json.dumps(record, sort_keys=True) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def plan(self, amis, scope=""):
+
+        """
+        Records AMIs about to be deleted with their snapshots,
+        the first plan of a journal starts a new run : resume
+        only finishes the deletions of the last run
+        """
+
+        self.write([{
+            "event": "planned",
+            "scope": scope,
+            "ami": ami.id,
+            "snapshots": [device.snapshot_id
+                          for device in ami.block_device_mappings
+                          if device.snapshot_id is not None],
+        } for ami in amis], start=True)
+
+    def deregistered(self, ami_id, scope=""):
+        self.write([{"event": "deregistered", "scope": scope, "ami": ami_id}])
+
+    def snapshot_deleted(self, snapshot_id, scope=""):
+        self.write([{"event": "snapshot_deleted", "scope": scope, "snapshot": snapshot_id}])
+
+    def read(self):
+
+        """ Yields the records of the journal, skipping a truncated last line """
+
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def pending(self, scope=""):
+
+        """
+        Returns the outstanding work of the last run on a scope, as
+        (AMI, deregistered) pairs : AMIs left to deregister and
+        deregistered AMIs with snapshots left to delete
+        """
+
+        planned = dict()
+        deregistered = set()
+        deleted = set()
+
+        for record in self.read():
+            event = record.get("event")
+            if event == "run":
+                planned, deregistered, deleted = dict(), set(), set()
+            elif record.get("scope", "") != scope:
+                continue
+            elif event == "planned":
+                planned[record["ami"]] = record.get("snapshots", [])
+            elif event == "deregistered":
+                deregistered.add(record["ami"])
+            elif event == "snapshot_deleted":
+                deleted.add(record["snapshot"])
+
+        pending = []
+        for ami_id, snapshots in planned.items():
+            snapshots = [s for s in snapshots if s not in deleted]
+            if ami_id in deregistered and not snapshots:
+                continue
+
+            ami = AMI.object_with_snapshots(ami_id, snapshots)
+            pending.append((ami, ami_id in deregistered))
+
+        return pending
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
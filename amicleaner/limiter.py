@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from builtins import object
+import functools
+import threading
+import time
+
+from botocore.exceptions import ClientError, ConnectionClosedError, ReadTimeoutError
+from botocore.exceptions import ConnectionError as AWSConnectionError
+
+from .aws import get_client, is_api_call
+from .metrics import get_action
+from .resources.config import API_RATE, API_MAX_RATE, API_MIN_RATE, API_RETRIES
+from .resources.config import DELETE_ACTIONS, GONE_ERRORS, THROTTLING_ERRORS, TRANSIENT_ERRORS
+
+# errors of api calls retried by the limiter, errors without an error
+# code are connection failures of calls which may have completed
+RETRIED_ERRORS = (ClientError, AWSConnectionError, ConnectionClosedError, ReadTimeoutError)
+
+
+class TokenBucket(object):
+
+    """
+    Token bucket of an api action whose rate adapts to throttling :
+    doubled every second until a first call is throttled (slow start),
+    then halved when a call is throttled and increased by about one
+    call per second every second while calls succeed (AIMD)
+    """
+
+    def __init__(self, rate=API_RATE, max_rate=API_MAX_RATE, min_rate=API_MIN_RATE):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max(min(rate, max_rate), self.min_rate)
+        self.tokens = 1.0
+        self.last = time.time()
+        self.last_decrease = 0
+        self.slow_start = True
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self):
+
+        """
+        Waits for a token, tokens are reserved in calls order
+        :return: seconds waited
+        """
+
+        with self.lock:
+            self.refill(time.time())
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def on_success(self):
+        with self.lock:
+            increase = 1.0 if self.slow_start else 1.0 / self.rate
+            self.rate = min(self.max_rate, self.rate + increase)
+
+    def on_throttle(self):
+        with self.lock:
+            now = time.time()
+            self.slow_start = False
+            # concurrent calls throttled by a same burst decrease the rate once
+            if now - self.last_decrease > 1.0 / self.rate:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.last_decrease = now
+            self.tokens = min(self.tokens, 0)
+
+
+class RateLimiter(object):
+
+    """
+    Client side rate limiter shared by every client of a run,
+    with a token bucket per aws target and api action.
+    Throttled and transient errors are retried up to `retries` times,
+    retries and waits are recorded in `metrics` when there is one
+    """
+
+    def __init__(self, rate=API_RATE, max_rate=API_MAX_RATE, retries=API_RETRIES, metrics=None):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.retries = retries
+        self.metrics = metrics
+        self.buckets = dict()
+        self.lock = threading.Lock()
+
+    def bucket(self, scope, action):
+        with self.lock:
+            bucket = self.buckets.get((scope, action))
+            if bucket is None:
+                bucket = self.buckets[(scope, action)] = TokenBucket(
+                    self.rate, self.max_rate
+                )
+            return bucket
+
+    def rates(self):
+
+        """ Returns the current rate of every bucket by scope and action """
+
+        with self.lock:
+            return dict((key, bucket.rate) for key, bucket in self.buckets.items())
+
+    def call(self, scope, action, func, *args, **kwargs):
+
+        """ Calls func once a token of its action is available """
+
+        return self.call_service(None, scope, action, func, args, kwargs)
+
+    def call_service(self, service, scope, action, func, args, kwargs):
+
+        """
+        Calls func once a token of its action is available, retries and
+        waits are recorded as calls of a service action in metrics.
+        A delete retried after a failure the first attempt may have
+        completed succeeds when the resource is gone
+        """
+
+        bucket = self.bucket(scope, action)
+        attempt = 0
+        waited = 0
+        ambiguous = False
+
+        try:
+            while True:
+                waited += bucket.acquire()
+                try:
+                    resp = func(*args, **kwargs)
+                except RETRIED_ERRORS as e:
+                    code = None
+                    if isinstance(e, ClientError):
+                        code = e.response.get("Error", {}).get("Code")
+                    if ambiguous and code in GONE_ERRORS and action in DELETE_ACTIONS:
+                        bucket.on_success()
+                        return {}
+                    if code in THROTTLING_ERRORS:
+                        bucket.on_throttle()
+                    elif code is None or code in TRANSIENT_ERRORS:
+                        ambiguous = True
+                        backoff = min(2 ** attempt * 0.1, 5)
+                        time.sleep(backoff)
+                        waited += backoff
+                    else:
+                        raise
+                    attempt += 1
+                    if attempt > self.retries:
+                        raise
+                    continue
+
+                bucket.on_success()
+                return resp
+        finally:
+            if self.metrics is not None and (attempt or waited):
+                self.metrics.record_limiter(service, get_action(action), attempt, waited)
+
+
+class LimitedClient(object):
+
+    """
+    Proxy of a boto3 client whose api calls go through a rate limiter,
+    other attributes (ex: meta) are served by the client
+    :param scope: aws target of the client, ex: account/region
+    :param service: service of the client in metrics, ex: ec2
+    """
+
+    def __init__(self, client, limiter, scope=None, service=None):
+        self.client = client
+        self.limiter = limiter
+        self.scope = scope or client.meta.region_name
+        self.service = service
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not is_api_call(name, attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            return self.limiter.call_service(self.service, self.scope, name, attr, args, kwargs)
+
+        # api methods are wrapped once per client
+        self.__dict__[name] = call
+        return call
+
+
+# rate limiter of clients created without one, ex: Fetcher()
+DEFAULT_LIMITER = RateLimiter()
+
+
+def get_limited_client(service, region=None, session=None, limiter=None):
+
+    """ Returns a boto3 client whose api calls go through a rate limiter """
+
+    return LimitedClient(
+        get_client(service, region, session), limiter or DEFAULT_LIMITER
+    )
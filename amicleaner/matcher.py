@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from builtins import object
+from collections import deque
+import re
+
+MATCH_MODES = ["substring", "prefix", "regex"]
+
+
+class NameMatcher(object):
+
+    """
+    Matches a name against every mapping value in a single scan of the
+    name, built once per run from the mapping values.
+    substring : values found anywhere in the name (aho-corasick automaton)
+    prefix : values the name starts with (trie)
+    regex : values are regular expressions searched in the name
+    """
+
+    def __init__(self, values, mode="substring"):
+        if mode not in MATCH_MODES:
+            raise ValueError("unknown match mode {0}".format(mode))
+
+        # duplicated values would group an AMI twice
+        self.values = []
+        for value in values or []:
+            if value not in self.values:
+                self.values.append(value)
+        self.mode = mode
+
+        if mode == "regex":
+            self.patterns = [re.compile(value) for value in self.values]
+        else:
+            self.build_trie()
+            if mode == "substring":
+                self.build_failure_links()
+
+    def build_trie(self):
+
+        """ Trie of the values, outputs are the values index """
+
+        self.goto = [dict()]
+        self.outputs = [set()]
+
+        for index, value in enumerate(self.values):
+            node = 0
+            for char in value:
+                if char not in self.goto[node]:
+                    self.goto.append(dict())
+                    self.outputs.append(set())
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            self.outputs[node].add(index)
+
+    def build_failure_links(self):
+
+        """ Aho-corasick failure links, breadth first over the trie """
+
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(char, 0)
+                if self.fail[child] == child:
+                    self.fail[child] = 0
+                self.outputs[child] |= self.outputs[self.fail[child]]
+
+    def match(self, name):
+
+        """ Return the values matching a name, in the values order """
+
+        name = name or ""
+
+        if self.mode == "regex":
+            return [value
+                    for value, pattern in zip(self.values, self.patterns)
+                    if pattern.search(name)]
+
+        found = set(self.outputs[0])
+        node = 0
+
+        for char in name:
+            if self.mode == "prefix":
+                node = self.goto[node].get(char)
+                if node is None:
+                    break
+            else:
+                while node and char not in self.goto[node]:
+                    node = self.fail[node]
+                node = self.goto[node].get(char, 0)
+            found |= self.outputs[node]
+
+        return [self.values[index] for index in sorted(found)]
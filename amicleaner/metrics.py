@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from builtins import object
+import bisect
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from .aws import is_api_call
+from .resources.config import LATENCY_BUCKETS, THROTTLING_ERRORS
+
+
+def get_action(method_name):
+
+    """ Returns the api action of a boto3 method, ex: DescribeImages """
+
+    return "".join(part.title() for part in method_name.split("_"))
+
+
+def get_error_code(error):
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code")
+    return type(error).__name__
+
+
+class Metrics(object):
+
+    """
+    Thread safe counters of a run : api calls (count, errors, throttles,
+    retries, rate limiter waits and latency histogram) by service and
+    action, and durations of the run phases, ex: fetch, map, reduce, delete
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.calls = dict()
+        self.phases = dict()
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def get_call(self, service, action):
+        call = self.calls.get((service, action))
+        if call is None:
+            call = self.calls[(service, action)] = {
+                "count": 0, "errors": 0, "throttles": 0, "retries": 0,
+                "seconds": 0.0, "wait_seconds": 0.0,
+                "buckets": [0] * (len(self.buckets) + 1),
+            }
+        return call
+
+    def record_call(self, service, action, seconds, retries=0, error=None):
+
+        """ Records an api call, error is its error code if it failed """
+
+        with self.lock:
+            call = self.get_call(service, action)
+            call["count"] += 1
+            call["retries"] += retries
+            call["seconds"] += seconds
+            call["buckets"][bisect.bisect_left(self.buckets, seconds)] += 1
+            if error:
+                call["errors"] += 1
+                if error in THROTTLING_ERRORS:
+                    call["throttles"] += 1
+
+    def record_limiter(self, service, action, retries, wait_seconds):
+
+        """ Records the retries and waits of the rate limiter for an api call """
+
+        with self.lock:
+            call = self.get_call(service, action)
+            call["retries"] += retries
+            call["wait_seconds"] += wait_seconds
+
+    def record_phase(self, name, seconds):
+        with self.lock:
+            phase = self.phases.setdefault(name, {"count": 0, "seconds": 0.0})
+            phase["count"] += 1
+            phase["seconds"] += seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+
+        """ Times a phase of the run, phases of concurrent targets add up """
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.time() - start)
+
+    def to_dict(self):
+
+        """ Returns the run profile as a json serializable dict """
+
+        with self.lock:
+            calls = []
+            for (service, action), call in sorted(self.calls.items()):
+                call = dict(call)
+                buckets, cumulated = call.pop("buckets"), 0
+                call["latency"] = dict()
+                for le, count in zip(self.buckets, buckets):
+                    cumulated += count
+                    call["latency"][str(le)] = cumulated
+                call.update(service=service, action=action)
+                calls.append(call)
+
+            return {
+                "started": self.started,
+                "duration": time.time() - self.started,
+                "calls": calls,
+                "phases": dict((name, dict(phase)) for name, phase in self.phases.items()),
+            }
+
+    def to_prometheus(self):
+
+        """ Returns the run profile in the prometheus text format """
+
+        profile = self.to_dict()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append("# HELP amicleaner_{0} {1}".format(name, help_text))
+            lines.append("# TYPE amicleaner_{0} {1}".format(name, kind))
+            for suffix, labels, value in samples:
+                lines.append("amicleaner_{0}{1}{{{2}}} {3}".format(
+                    name, suffix,
+                    ",".join('{0}="{1}"'.format(k, v) for k, v in labels),
+                    value
+                ))
+
+        def call_labels(call):
+            return [("service", call["service"]), ("action", call["action"])]
+
+        for name, key, help_text in (
+                ("api_calls_total", "count", "Aws api calls"),
+                ("api_errors_total", "errors", "Failed aws api calls"),
+                ("api_throttles_total", "throttles", "Throttled aws api calls"),
+                ("api_retries_total", "retries", "Retries of aws api calls"),
+                ("api_wait_seconds_total", "wait_seconds",
+                 "Seconds aws api calls waited for the rate limiter")):
+            metric(name, "counter", help_text,
+                   [("", call_labels(call), call[key]) for call in profile["calls"]])
+
+        samples = []
+        for call in profile["calls"]:
+            for le in self.buckets:
+                samples.append(("_bucket", call_labels(call) + [("le", le)],
+                                call["latency"][str(le)]))
+            samples.append(("_bucket", call_labels(call) + [("le", "+Inf")], call["count"]))
+            samples.append(("_sum", call_labels(call), call["seconds"]))
+            samples.append(("_count", call_labels(call), call["count"]))
+        metric("api_call_duration_seconds", "histogram", "Latency of aws api calls", samples)
+
+        metric("phase_duration_seconds", "gauge", "Duration of the run phases",
+               [("", [("phase", name)], phase["seconds"])
+                for name, phase in sorted(profile["phases"].items())])
+        metric("run_duration_seconds", "gauge", "Duration of the run",
+               [("", [], profile["duration"])])
+        metric("last_run_timestamp_seconds", "gauge", "Start time of the last run",
+               [("", [], profile["started"])])
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def write(path, content):
+
+        """ Writes a file atomically, for collectors reading it meanwhile """
+
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.rename(tmp_path, path)
+
+    def write_json(self, path):
+        self.write(path, json.dumps(self.to_dict(), indent=2, sort_keys=True))
+
+    def write_prometheus(self, path):
+        self.write(path, self.to_prometheus())
+
+
+class InstrumentedClient(object):
+
+    """
+    Proxy of a boto3 client recording every api call in metrics,
+    other attributes (ex: meta) are served by the client
+    """
+
+    def __init__(self, client, metrics, service):
+        self.client = client
+        self.metrics = metrics
+        self.service = service
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not is_api_call(name, attr):
+            return attr
+
+        action = get_action(name)
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            start = time.time()
+            try:
+                resp = attr(*args, **kwargs)
+            except Exception as e:
+                retries = 0
+                if isinstance(e, ClientError):
+                    retries = e.response.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+                self.metrics.record_call(
+                    self.service, action, time.time() - start, retries, get_error_code(e)
+                )
+                raise
+            self.metrics.record_call(
+                self.service, action, time.time() - start,
+                resp.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+            )
+            return resp
+
+        # api methods are wrapped once per client
+        self.__dict__[name] = call
+        return call
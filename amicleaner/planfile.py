@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Plan files : the AMIs `amicleaner --plan` would delete, written as compact
+json (gzipped for .gz paths) to be reviewed, then deleted by
+`amicleaner --apply` later or on another host, without fetching again
+
+    {"version": 2, "generated": 1500000000, "targets": [{
+        "label": "123456789012/eu-west-1", "scope": "123456789012/eu-west-1",
+        "region": "eu-west-1", "role_arn": null, "owner_id": "self",
+        "groups": {"web": {"delete": [["ami-1", ["snap-1"]]], "keep": ["ami-2"]}}
+    }]}
+"""
+
+from __future__ import absolute_import
+import gzip
+import json
+import os
+import time
+
+from .aws import find_image_ids, find_used_image_ids
+from .resources.config import NO_TAGS_GROUP, PLAN_VERSION
+from .resources.models import AMI
+
+
+def open_plan(path, mode="rb", gzipped=None):
+
+    """ Opens a plan file in binary mode, gzip text mode is python 3 only """
+
+    if gzipped is None:
+        gzipped = path.endswith(".gz")
+    if gzipped:
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def dump_plan(targets, generated=None):
+
+    """
+    Returns the plan of the reports of App targets, with the account
+    and region they were planned on, targets which failed are left out
+    """
+
+    return {
+        "version": PLAN_VERSION,
+        "generated": int(generated or time.time()),
+        "targets": [{
+            "label": target.label,
+            "scope": target.get_scope(),
+            "region": target.client('ec2').meta.region_name,
+            "role_arn": target.role_arn,
+            "owner_id": target.owner_id,
+            "groups": dump_groups(target),
+        } for target in targets if not target.error],
+    }
+
+
+def dump_groups(target):
+
+    """ Returns the AMIs to delete and to keep by group name of an App target """
+
+    return dict((group_name, {
+        "delete": [[ami.id, [device.snapshot_id
+                             for device in ami.block_device_mappings
+                             if device.snapshot_id is not None]]
+                   for ami in amis],
+        "keep": [ami.id for ami in target.kept.get(group_name, [])],
+    }) for group_name, amis in target.report.items() if group_name != NO_TAGS_GROUP)
+
+
+def write_plan(path, plan):
+
+    """ Writes a plan file atomically """
+
+    tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+    with open_plan(tmp_path, "wb", path.endswith(".gz")) as f:
+        f.write(json.dumps(plan, separators=(",", ":"), sort_keys=True).encode("utf-8"))
+    os.rename(tmp_path, path)
+
+
+def read_plan(path):
+
+    """ Reads a plan file, ValueError for plans of another version """
+
+    with open_plan(path) as f:
+        plan = json.loads(f.read().decode("utf-8"))
+
+    if plan.get("version") != PLAN_VERSION:
+        raise ValueError("unsupported plan version {0}, expected {1}".format(
+            plan.get("version"), PLAN_VERSION))
+    return plan
+
+
+def load_report(target_plan):
+
+    """ Returns the AMIs to delete by group name of a target plan """
+
+    return dict(
+        (group_name, [AMI.object_with_snapshots(ami_id, snapshot_ids)
+                      for ami_id, snapshot_ids in group["delete"]])
+        for group_name, group in target_plan["groups"].items()
+    )
+
+
+def check_plan(ec2, target_plan):
+
+    """
+    Fast staleness check of a target plan, a describe_images and a
+    describe_instances of its AMIs ids : groups which lost kept AMIs
+    since the plan are stale and left out, AMIs already deregistered
+    or used by instances launched since the plan are dropped
+    :return: (AMIs to delete by group name, stale group names)
+    """
+
+    groups = target_plan["groups"]
+    planned_ids = [ami[0] for group in groups.values() for ami in group["delete"]]
+    found = find_image_ids(ec2, planned_ids + [
+        ami_id for group in groups.values() for ami_id in group["keep"]
+    ], target_plan.get("owner_id") or "self")
+    found.difference_update(find_used_image_ids(ec2, planned_ids))
+
+    report = dict()
+    stale = []
+    for group_name, amis in load_report(target_plan).items():
+        if not all(ami_id in found for ami_id in groups[group_name]["keep"]):
+            stale.append(group_name)
+            continue
+        amis = [ami for ami in amis if ami.id in found]
+        if amis:
+            report[group_name] = amis
+
+    return report, sorted(stale)
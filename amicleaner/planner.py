@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from datetime import datetime
+import time
+
+from .resources.config import FIRST_AMI_YEAR
+
+
+def escape_filter_value(value):
+
+    """ Escapes the wildcards of an ec2 filter value """
+
+    return value.replace("\\", "\\\\").replace("*", "\\*").replace("?", "\\?")
+
+
+def get_creation_date_values(cutoff):
+
+    """
+    Returns creation-date filter wildcards matching the AMIs created
+    before the day following cutoff (epoch seconds) : every previous
+    year, month of the year and day of the month. AMIs of the cutoff
+    day are filtered locally
+    """
+
+    date = datetime.utcfromtimestamp(cutoff)
+
+    values = ["{0}-*".format(year) for year in range(FIRST_AMI_YEAR, date.year)]
+    values += ["{0}-{1:02d}-*".format(date.year, month)
+               for month in range(1, date.month)]
+    values += ["{0}-{1:02d}-{2:02d}T*".format(date.year, date.month, day)
+               for day in range(1, date.day + 1)]
+
+    return values
+
+
+def get_name_values(values, match):
+
+    """ Returns name filter wildcards of name mapping values """
+
+    if match == "regex" or not all(values):
+        return None
+    if match == "prefix":
+        return ["{0}*".format(escape_filter_value(v)) for v in values]
+    return ["*{0}*".format(escape_filter_value(v)) for v in values]
+
+
+def get_images_filters(mapping_strategy=None, ami_min_days=-1, now=None):
+
+    """
+    Query planner of describe_images : returns the Filters selecting
+    on the server side the only AMIs a mapping strategy and age limit
+    can delete, they are also filtered locally by map_candidates and
+    split_candidates
+    """
+
+    mapping_strategy = mapping_strategy or {}
+    values = mapping_strategy.get("values")
+
+    filters = [{"Name": "state", "Values": ["available"]}]
+
+    if mapping_strategy.get("key") == "tags" and values:
+        # AMIs without any of the tags are never deleted
+        filters.append({"Name": "tag-key", "Values": list(values)})
+
+    if mapping_strategy.get("key") == "name" and values:
+        name_values = get_name_values(values, mapping_strategy.get("match"))
+        if name_values:
+            filters.append({"Name": "name", "Values": name_values})
+
+    if ami_min_days > 0:
+        cutoff = (now or time.time()) - ami_min_days * 86400
+        filters.append({
+            "Name": "creation-date", "Values": get_creation_date_values(cutoff)
+        })
+
+    return filters
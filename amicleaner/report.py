@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from builtins import object
+import csv
+import json
+import sys
+
+from .utils import Printer
+
+
+class TableReportWriter(object):
+
+    """
+    Human readable report : a table of groups counts printed once
+    every group is written, tables of AMIs are only built for the
+    full report
+    """
+
+    def __init__(self, full_report=False):
+        self.full_report = full_report
+        self.groups = []
+
+    def group(self, group_name, amis, kept=None, excluded=False):
+        self.groups.append((group_name, len(amis), len(kept or [])))
+        if self.full_report:
+            Printer.print_group(group_name, amis, kept)
+
+    def exclusions(self, amis, exclusions, label=None):
+        if self.full_report:
+            Printer.print_exclusions(amis, exclusions, label)
+
+    def close(self):
+        if self.groups:
+            Printer.print_groups(self.groups)
+
+
+class StreamReportWriter(object):
+
+    """ Report written record by record to a file, stdout by default """
+
+    def __init__(self, output=None, stream=None):
+        self.output = output
+        self.file = open(output, "w") if output else stream or sys.stdout
+
+    def write_ami(self, group_name, ami, action, reasons=None):
+        raise NotImplementedError()
+
+    def group(self, group_name, amis, kept=None, excluded=False):
+
+        """ Writes the AMIs removed and kept in a group """
+
+        action = "excluded" if excluded else "delete"
+        for ami in amis:
+            self.write_ami(group_name, ami, action)
+        for ami in kept or []:
+            self.write_ami(group_name, ami, "keep")
+
+    def exclusions(self, amis, exclusions, label=None):
+
+        """ Writes excluded AMIs with the reasons of their exclusion """
+
+        for ami in amis:
+            self.write_ami(label or "", ami, "excluded", exclusions.get(ami.id))
+
+    def close(self):
+        if self.output:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class JsonLinesReportWriter(StreamReportWriter):
+
+    """ Report as json lines : a group record followed by its AMIs """
+
+    def group(self, group_name, amis, kept=None, excluded=False):
+        self.write({
+            "type": "group",
+            "group": group_name,
+            "candidates": len(amis),
+            "kept": len(kept or []),
+            "excluded": excluded,
+        })
+        super(JsonLinesReportWriter, self).group(group_name, amis, kept, excluded)
+
+    def write_ami(self, group_name, ami, action, reasons=None):
+        record = {
+            "type": "ami",
+            "group": group_name,
+            "action": action,
+            "id": ami.id,
+            "name": ami.name,
+            "creation_date": ami.creation_date,
+        }
+        if reasons:
+            record["reasons"] = list(reasons)
+        self.write(record)
+
+    def write(self, record):
+        self.file.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+class CsvReportWriter(StreamReportWriter):
+
+    """ Report as csv : an AMI per row """
+
+    HEADER = ["group", "action", "ami_id", "ami_name", "creation_date", "reasons"]
+
+    def __init__(self, output=None, stream=None):
+        super(CsvReportWriter, self).__init__(output, stream)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.HEADER)
+
+    def write_ami(self, group_name, ami, action, reasons=None):
+        self.writer.writerow([
+            group_name, action, ami.id, ami.name or "", ami.creation_date or "",
+            ";".join(reasons or [])
+        ])
+
+
+def get_report_writer(report_format="table", output=None, full_report=False, stream=None):
+
+    """
+    Returns the writer of a report format
+    :param output: file path of json lines and csv reports, None for stream
+    :param stream: stream of json lines and csv reports, stdout by default
+    """
+
+    if report_format == "jsonl":
+        return JsonLinesReportWriter(output, stream)
+    if report_format == "csv":
+        return CsvReportWriter(output, stream)
+    return TableReportWriter(full_report)
@@ -28,9 +28,94 @@ MAPPING_VALUES = ["environment", "role"]
 
 EXCLUDED_MAPPING_VALUES = []
 
+# report group of AMIs which could not be mapped, never deleted
+NO_TAGS_GROUP = "no-tags (excluded)"
+
 
 # Number of days amis to keep based on creation date and grouping strategy
 # not including the ami currently running by an ec2 instance
 AMI_MIN_DAYS = -1
 
-BOTO3_RETRIES = 10
+# Retries of the aws sdk, throttled and transient errors are retried
+# by the client side rate limiter instead (limiter.py)
+BOTO3_RETRIES = 0
+
+# Retries of the aws sdk on the calls which do not go through the rate
+# limiter : assumed roles, their credentials refreshes and enabled regions
+BOTO3_DIRECT_RETRIES = 10
+
+# Aws api calls per second per target and api action : initial rate of
+# the adaptive rate limiter, its maximum and minimum, and the retries
+# of a throttled or failed call
+API_RATE = 20.0
+API_MAX_RATE = 100.0
+API_MIN_RATE = 0.5
+API_RETRIES = 10
+
+# Number of AMIs requested per describe_images page (between 5 and 1000)
+PAGE_SIZE = 1000
+
+# Number of AMIs deregistered (with their snapshots) in parallel,
+# also the number of concurrent api calls when fetching in chunks
+WORKERS = 10
+
+# Number of aws targets (account and region) cleaned in parallel
+CONCURRENCY = 10
+
+# Session name and duration (seconds) of assumed roles
+ROLE_SESSION_NAME = "amicleaner"
+ROLE_SESSION_DURATION = 3600
+
+# Seconds an aws response is served from the on disk cache (--cache-dir)
+CACHE_TTL = 3600
+
+# Autoscaling api limits : records per page and launch configuration
+# names per describe_launch_configurations call
+AUTOSCALING_PAGE_SIZE = 100
+LC_NAMES_CHUNK = 50
+
+# Upper bounds (seconds) of the aws api calls latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Error codes of throttled aws api calls
+THROTTLING_ERRORS = ("RequestLimitExceeded", "Throttling", "ThrottlingException",
+                     "RequestThrottled", "TooManyRequestsException")
+
+# Error codes of aws api calls failing temporarily
+TRANSIENT_ERRORS = ("InternalError", "InternalFailure", "ServiceUnavailable",
+                    "Unavailable", "RequestTimeout")
+
+# Error codes of aws api calls on resources which no longer exist
+GONE_ERRORS = ("InvalidAMIID.NotFound", "InvalidAMIID.Unavailable",
+               "InvalidSnapshot.NotFound")
+
+# Api calls deleting a resource : retried after a connection or transient
+# error, which the first attempt may have completed, GONE_ERRORS succeed
+DELETE_ACTIONS = ("deregister_image", "delete_snapshot")
+
+# Formats of the report of AMIs to remove (--report-format)
+REPORT_FORMATS = ("table", "jsonl", "csv")
+
+# Year of the first AMIs, lower bound of the creation-date filters
+# pushed down to describe_images (planner.py)
+FIRST_AMI_YEAR = 2006
+
+# Incremental inventory (--incremental) : seconds between full listings
+# of the AMIs, and maximum days fetched from the creation date watermark
+INVENTORY_FULL_REFRESH = 86400
+INVENTORY_MAX_DELTA_DAYS = 90
+
+# AMI ids per describe_images image-id filter
+IMAGE_IDS_CHUNK = 200
+
+# states of the instances whose AMIs are never deleted
+ACTIVE_INSTANCE_STATES = ['pending', 'running', 'shutting-down', 'stopping', 'stopped']
+
+# Service mode (--serve) : default port of the local api and seconds
+# between two plans
+SERVE_PORT = 8080
+SERVE_INTERVAL = 900
+
+# Version of the plan files written by `amicleaner plan`, apply refuses
+# plans of another version
+PLAN_VERSION = 2
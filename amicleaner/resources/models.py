@@ -4,25 +4,103 @@
 
 from builtins import str
 from builtins import object
+import calendar
+from datetime import datetime
+
+try:
+    from sys import intern
+except ImportError:  # python 2, intern is a builtin
+    pass
+
+
+def intern_string(value):
+
+    """ Return the interned copy of a string, values are shared in memory """
+
+    try:
+        return intern(value)
+    except TypeError:
+        return value
+
+
+def parse_creation_date(value):
+
+    """
+    Return the epoch seconds of an AMI creation date,
+    ex: 2015-11-04T01:35:31.000Z, naive datetimes are considered utc
+    """
+
+    if value is None:
+        return None
+
+    if isinstance(value, datetime):
+        return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+
+    try:
+        return calendar.timegm((
+            int(value[0:4]), int(value[5:7]), int(value[8:10]),
+            int(value[11:13]), int(value[14:16]), int(value[17:19])
+        ))
+    except (TypeError, ValueError):
+        return None
+
+
+# AMI fields never read when cleaning, kept unparsed in a tuple
+AMI_COLD_FIELDS = ('Hypervisor', 'ImageType', 'ImageLocation', 'Public',
+                   'RootDeviceName', 'RootDeviceType')
+
+
+def cold_field(field):
+
+    """ Property of an AMI field kept in the AMI cold fields tuple """
+
+    index = AMI_COLD_FIELDS.index(field)
+
+    def get(self):
+        return self._cold[index] if self._cold else None
+
+    def set(self, value):
+        cold = list(self._cold or (None,) * len(AMI_COLD_FIELDS))
+        cold[index] = value
+        self._cold = tuple(cold)
+
+    return property(get, set)
 
 
 class AMI(object):
+
+    __slots__ = ('id', 'architecture', 'block_device_mappings',
+                 '_creation_date', 'creation_timestamp', 'name', 'owner_id',
+                 'state', 'tags', 'virtualization_type', '_cold')
+
+    hypervisor = cold_field('Hypervisor')
+    image_type = cold_field('ImageType')
+    location = cold_field('ImageLocation')
+    public = cold_field('Public')
+    root_device_name = cold_field('RootDeviceName')
+    root_device_type = cold_field('RootDeviceType')
+
     def __init__(self):
         self.id = None
         self.architecture = None
         self.block_device_mappings = []
         self.creation_date = None
-        self.hypervisor = None
-        self.image_type = None
-        self.location = None
         self.name = None
         self.owner_id = None
-        self.public = None
-        self.root_device_name = None
-        self.root_device_type = None
         self.state = None
         self.tags = []
         self.virtualization_type = None
+        self._cold = None
+
+    @property
+    def creation_date(self):
+        return self._creation_date
+
+    @creation_date.setter
+    def creation_date(self, value):
+        # parsed once, reduction only compares epoch seconds
+        self._creation_date = value
+        self.creation_timestamp = parse_creation_date(value)
 
     def __str__(self):
         return str({
@@ -39,17 +117,12 @@ class AMI(object):
         o = AMI()
         o.id = json.get('ImageId')
         o.name = json.get('Name')
-        o.architecture = json.get('Architecture')
+        o.architecture = intern_string(json.get('Architecture'))
         o.creation_date = json.get('CreationDate')
-        o.hypervisor = json.get('Hypervisor')
-        o.image_type = json.get('ImageType')
-        o.location = json.get('ImageLocation')
-        o.owner_id = json.get('OwnerId')
-        o.public = json.get('ImageLocation')
-        o.root_device_name = json.get('RootDeviceName')
-        o.root_device_type = json.get('RootDeviceType')
-        o.state = json.get('State')
-        o.virtualization_type = json.get('VirtualizationType')
+        o.owner_id = intern_string(json.get('OwnerId'))
+        o.state = intern_string(json.get('State'))
+        o.virtualization_type = intern_string(json.get('VirtualizationType'))
+        o._cold = tuple(json.get(field) for field in AMI_COLD_FIELDS)
 
         o.tags = [AWSTag.object_with_json(tag) for tag in json.get('Tags', [])]
         ebs_snapshots = [
@@ -60,6 +133,20 @@ class AMI(object):
 
         return o
 
+    @staticmethod
+    def object_with_snapshots(ami_id, snapshot_ids):
+
+        """ AMI known by its id and snapshots only, ex: from a journal or a plan """
+
+        o = AMI()
+        o.id = ami_id
+        for snapshot_id in snapshot_ids:
+            device = AWSBlockDevice()
+            device.snapshot_id = snapshot_id
+            o.block_device_mappings.append(device)
+
+        return o
+
     def __repr__(self):
         return '{0}: {1} {2}'.format(self.__class__.__name__,
                                      self.id,
@@ -67,6 +154,12 @@ class AMI(object):
 
 
 class AWSEC2Instance(object):
+
+    __slots__ = ('id', 'name', 'launch_time', 'private_ip_address',
+                 'public_ip_address', 'vpc_id', 'image_id',
+                 'private_dns_name', 'key_name', 'subnet_id',
+                 'instance_type', 'availability_zone', 'asg_name', 'tags')
+
     def __init__(self):
         self.id = None
         self.name = None
@@ -102,19 +195,23 @@ class AWSEC2Instance(object):
         o.launch_time = json.get('LaunchTime')
         o.private_ip_address = json.get('PrivateIpAddress')
         o.public_ip_address = json.get('PublicIpAddress')
-        o.vpc_id = json.get('VpcId')
-        o.image_id = json.get('ImageId')
+        o.vpc_id = intern_string(json.get('VpcId'))
+        o.image_id = intern_string(json.get('ImageId'))
         o.private_dns_name = json.get('PrivateDnsName')
-        o.key_name = json.get('KeyName')
-        o.subnet_id = json.get('SubnetId')
-        o.instance_type = json.get('InstanceType')
-        o.availability_zone = json.get('Placement').get('AvailabilityZone')
+        o.key_name = intern_string(json.get('KeyName'))
+        o.subnet_id = intern_string(json.get('SubnetId'))
+        o.instance_type = intern_string(json.get('InstanceType'))
+        o.availability_zone = intern_string(json.get('Placement').get('AvailabilityZone'))
         o.tags = [AWSTag.object_with_json(tag) for tag in json.get('Tags', [])]
 
         return o
 
 
 class AWSBlockDevice(object):
+
+    __slots__ = ('device_name', 'snapshot_id', 'volume_size', 'volume_type',
+                 'encrypted')
+
     def __init__(self):
         self.device_name = None
         self.snapshot_id = None
@@ -141,16 +238,19 @@ class AWSBlockDevice(object):
             return None
 
         o = AWSBlockDevice()
-        o.device_name = json.get('DeviceName')
+        o.device_name = intern_string(json.get('DeviceName'))
         o.snapshot_id = ebs.get('SnapshotId')
         o.volume_size = ebs.get('VolumeSize')
-        o.volume_type = ebs.get('VolumeType')
+        o.volume_type = intern_string(ebs.get('VolumeType'))
         o.encrypted = ebs.get('Encrypted')
 
         return o
 
 
 class AWSTag(object):
+
+    __slots__ = ('key', 'value')
+
     def __init__(self):
         self.key = None
         self.value = None
@@ -167,6 +267,59 @@ class AWSTag(object):
             return None
 
         o = AWSTag()
-        o.key = json.get('Key')
-        o.value = json.get('Value')
+        o.key = intern_string(json.get('Key'))
+        o.value = intern_string(json.get('Value'))
         return o
+
+
+class AMIExclusions(object):
+
+    """ Index of AMI ids excluded from cleaning with their reasons """
+
+    def __init__(self):
+        self.reasons = dict()
+
+    def __str__(self):
+        return str(self.reasons)
+
+    def __contains__(self, ami_id):
+        return ami_id in self.reasons
+
+    def __iter__(self):
+        return iter(self.reasons)
+
+    def __len__(self):
+        return len(self.reasons)
+
+    def add(self, ami_ids, reason):
+
+        """ Excludes AMI ids for a reason, ex: instance """
+
+        for ami_id in ami_ids or []:
+            if ami_id:
+                self.reasons.setdefault(ami_id, set()).add(reason)
+        return self
+
+    def get(self, ami_id):
+
+        """ Returns the sorted reasons why an AMI is excluded """
+
+        return sorted(self.reasons.get(ami_id, []))
+
+
+class AMIDeletionResult(object):
+    def __init__(self, ami_id=None):
+        self.ami_id = ami_id
+        self.deregistered = False
+        self.error = None
+        self.deleted_snapshots = []
+        self.failed_snapshots = []
+
+    def __str__(self):
+        return str({
+            'ami_id': self.ami_id,
+            'deregistered': self.deregistered,
+            'error': self.error,
+            'deleted_snapshots': self.deleted_snapshots,
+            'failed_snapshots': self.failed_snapshots,
+        })
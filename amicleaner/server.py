@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Service mode : plans are refreshed on a schedule by a long running App,
+which keeps its aws clients, sessions, rate limiter and inventory store
+warm, and served over a local http json api
+
+    GET  /health              service status and current plan id
+    GET  /plan                candidates and kept counts by target and group
+    GET  /candidates          AMIs of every group, ?target= and ?group= filter
+    GET  /exclusions          excluded AMIs with the reasons of their exclusion
+    GET  /dry-run             AMIs a deletion of the current plan would remove
+    POST /refresh             refreshes the plan now
+    POST /delete?plan=<id>    deletes the AMIs of the current plan, local clients only
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+from builtins import object
+from future.moves.http.server import BaseHTTPRequestHandler, HTTPServer
+from future.moves.socketserver import ThreadingMixIn
+from future.moves.urllib.parse import parse_qs, urlparse
+import json
+import threading
+import time
+
+from .fanout import fan_out
+from .resources.config import NO_TAGS_GROUP, SERVE_INTERVAL
+
+LOCAL_ADDRESSES = ("127.0.0.1", "::1", "::ffff:127.0.0.1")
+
+
+def ami_summary(ami):
+    return {"id": ami.id, "name": ami.name, "creation_date": ami.creation_date}
+
+
+def is_local_address(address):
+
+    """ Returns whether a client address is the local host """
+
+    return address in LOCAL_ADDRESSES
+
+
+class PlanService(object):
+
+    """
+    Plans of an App targets, refreshed every `interval` seconds
+    in the background, each plan is an immutable json snapshot
+    :param targets: Apps to plan, the App targets by default
+    """
+
+    def __init__(self, app, interval=SERVE_INTERVAL, targets=None):
+        self.app = app
+        self.interval = interval
+        self.targets = targets
+        self.plan = None
+        self.error = None
+        self.lock = threading.Lock()
+        # refreshes and deletions never overlap
+        self.run_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def get_targets(self):
+        if self.targets is None:
+            self.targets = self.app.get_targets()
+        return self.targets
+
+    def refresh(self):
+
+        """
+        Plans every target and publishes the new plan, before a
+        deletion can run on the reports of the targets
+        """
+
+        with self.run_lock:
+            start = time.time()
+            targets = self.get_targets()
+            for target in targets:
+                target.reset()
+            fan_out(lambda target: target.plan(), targets, self.app.concurrency)
+            plan = self.snapshot(targets, start)
+
+            with self.lock:
+                self.plan = plan
+                self.error = None
+        return plan
+
+    @staticmethod
+    def snapshot(targets, start):
+
+        """ Returns the json snapshot of the plan of every target """
+
+        return {
+            "id": "{0:d}".format(int(start * 1000)),
+            "generated": start,
+            "duration": time.time() - start,
+            "targets": [{
+                "target": target.label,
+                "error": target.error,
+                "groups": [{
+                    "group": group_name,
+                    "excluded": group_name == NO_TAGS_GROUP,
+                    "candidates": [ami_summary(ami) for ami in amis],
+                    "kept": [ami_summary(ami) for ami in target.kept.get(group_name, [])],
+                } for group_name, amis in sorted(target.report.items())],
+                "exclusions": [dict(ami_summary(ami), reasons=target.exclusions.get(ami.id))
+                               for ami in target.excluded],
+            } for target in targets],
+        }
+
+    def get_plan(self):
+        with self.lock:
+            return self.plan
+
+    def delete(self, plan_id):
+
+        """
+        Deletes the AMIs of the current plan, which must be the plan
+        the caller saw, checked on aws first as it can be as old as
+        the refresh interval, then refreshes the plan in the background.
+        The plan is dropped meanwhile, it is never deleted twice
+        :return: deletion results by target, None for an outdated plan
+        """
+
+        with self.run_lock:
+            plan = self.get_plan()
+            if plan is None or plan["id"] != plan_id:
+                return None
+
+            targets = self.get_targets()
+            fan_out(lambda target: target.check_report().delete(), targets, self.app.concurrency)
+            results = [{
+                "target": target.label,
+                "error": target.error,
+                "deregistered": [r.ami_id for r in target.results if r.deregistered],
+                "failed": [r.ami_id for r in target.results if not r.deregistered],
+                "deleted_snapshots": sum(len(r.deleted_snapshots) for r in target.results),
+                "failed_snapshots": sum(len(r.failed_snapshots) for r in target.results),
+            } for target in targets]
+
+            with self.lock:
+                self.plan = None
+
+        self.wake.set()
+        return results
+
+    def run(self):
+
+        """ Refreshes the plan every interval, or when woken up """
+
+        while not self.stopped.is_set():
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            if self.stopped.is_set():
+                return
+            try:
+                self.refresh()
+            except Exception as e:
+                with self.lock:
+                    self.error = str(e)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+
+
+class PlanRequestHandler(BaseHTTPRequestHandler):
+
+    """ Json api of the plans of a PlanService """
+
+    def send_json(self, status, body):
+        content = json.dumps(body, sort_keys=True).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def get_query(self):
+        return dict((k, v[0]) for k, v in parse_qs(urlparse(self.path).query).items())
+
+    def get_groups(self, plan):
+
+        """ Yields (target, group) pairs of a plan, filtered by the query """
+
+        query = self.get_query()
+        for target in plan["targets"]:
+            if query.get("target", target["target"]) != target["target"]:
+                continue
+            for group in target["groups"]:
+                if query.get("group", group["group"]) == group["group"]:
+                    yield target, group
+
+    def do_GET(self):
+        service = self.server.service
+        path = urlparse(self.path).path.rstrip("/")
+        plan = service.get_plan()
+
+        if path == "/health":
+            return self.send_json(200, {
+                "status": "ok" if plan else "starting",
+                "plan": plan and plan["id"],
+                "error": service.error,
+            })
+
+        if plan is None:
+            return self.send_json(503, {"error": "no plan yet"})
+
+        if path == "/plan":
+            return self.send_json(200, {
+                "id": plan["id"],
+                "generated": plan["generated"],
+                "duration": plan["duration"],
+                "targets": [{
+                    "target": target["target"],
+                    "error": target["error"],
+                    "excluded": len(target["exclusions"]),
+                    "groups": dict((group["group"], {
+                        "candidates": len(group["candidates"]),
+                        "kept": len(group["kept"]),
+                    }) for group in target["groups"]),
+                } for target in plan["targets"]],
+            })
+
+        if path == "/candidates":
+            return self.send_json(200, {
+                "plan": plan["id"],
+                "groups": [dict(group, target=target["target"])
+                           for target, group in self.get_groups(plan)],
+            })
+
+        if path == "/exclusions":
+            return self.send_json(200, {
+                "plan": plan["id"],
+                "exclusions": [dict(ami, target=target["target"])
+                               for target in plan["targets"]
+                               for ami in target["exclusions"]],
+            })
+
+        if path == "/dry-run":
+            amis = [dict(ami, target=target["target"], group=group["group"])
+                    for target, group in self.get_groups(plan)
+                    if not group["excluded"]
+                    for ami in group["candidates"]]
+            return self.send_json(200, {"plan": plan["id"], "count": len(amis), "amis": amis})
+
+        self.send_json(404, {"error": "unknown path {0}".format(path)})
+
+    def do_POST(self):
+        service = self.server.service
+        path = urlparse(self.path).path.rstrip("/")
+
+        if path == "/refresh":
+            plan = service.refresh()
+            return self.send_json(200, {"plan": plan["id"]})
+
+        if path == "/delete":
+            if not is_local_address(self.client_address[0]):
+                return self.send_json(403, {"error": "deletions are only allowed from the local host"})
+            if service.app.dry_run:
+                return self.send_json(403, {"error": "dry-run service"})
+
+            results = service.delete(self.get_query().get("plan"))
+            if results is None:
+                return self.send_json(409, {"error": "outdated plan, see /plan"})
+            return self.send_json(200, {"results": results})
+
+        self.send_json(404, {"error": "unknown path {0}".format(path)})
+
+
+class PlanServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        HTTPServer.__init__(self, address, PlanRequestHandler)
+        self.service = service
+
+
+def serve(app, address, port, interval=SERVE_INTERVAL):
+
+    """ Serves the plans of an App until interrupted """
+
+    service = PlanService(app, interval)
+    service.refresh()
+    service.start()
+
+    server = PlanServer((address, port), service)
+    print("Serving plans on http://{0}:{1}/plan".format(address, server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
@@ -8,40 +8,165 @@ import argparse
 
 from prettytable import PrettyTable
 
-from .resources.config import KEEP_PREVIOUS, AMI_MIN_DAYS
+from .matcher import MATCH_MODES
+from .resources.config import KEEP_PREVIOUS, AMI_MIN_DAYS, PAGE_SIZE, WORKERS
+from .resources.config import CONCURRENCY, CACHE_TTL, API_MAX_RATE, REPORT_FORMATS
+from .resources.config import SERVE_PORT, SERVE_INTERVAL
 
 
 class Printer(object):
 
     """ Pretty table prints methods """
     @staticmethod
-    def print_report(candidates, full_report=False):
+    def print_report(candidates, full_report=False, kept=None):
 
-        """ Print AMI collection results """
+        """
+        Print AMI collection results, the full report also
+        lists the AMIs kept in each group
+        """
 
         if not candidates:
             return
 
-        groups_table = PrettyTable(["Group name", "candidates"])
+        kept = kept or {}
+        groups = []
 
         for group_name, amis in candidates.items():
-            groups_table.add_row([group_name, len(amis)])
-            eligible_amis_table = PrettyTable(
-                ["AMI ID", "AMI Name", "Creation Date"]
-            )
-            for ami in amis:
-                eligible_amis_table.add_row([
-                    ami.id,
-                    ami.name,
-                    ami.creation_date
-                ])
+            groups.append((group_name, len(amis), len(kept.get(group_name, []))))
             if full_report:
-                print(group_name)
-                print(eligible_amis_table.get_string(sortby="AMI Name"), "\n\n")
+                Printer.print_group(group_name, amis, kept.get(group_name))
+
+        Printer.print_groups(groups)
+
+    @staticmethod
+    def print_group(group_name, amis, kept=None):
+
+        """ Print the tables of AMIs removed and kept in a group """
+
+        print(group_name)
+        print(Printer.amis_table(amis).get_string(sortby="AMI Name"), "\n")
+        if kept:
+            print("{0} (kept)".format(group_name))
+            print(Printer.amis_table(kept).get_string(sortby="AMI Name"), "\n")
+        print()
+
+    @staticmethod
+    def print_groups(groups):
+
+        """ Print a table of (group name, candidates, kept) counts """
+
+        groups_table = PrettyTable(["Group name", "candidates", "kept"])
+        for group in groups:
+            groups_table.add_row(list(group))
 
         print("\nAMIs to be removed:")
         print(groups_table.get_string(sortby="Group name"))
 
+    @staticmethod
+    def amis_table(amis):
+
+        """ Return a table of AMIs """
+
+        amis_table = PrettyTable(["AMI ID", "AMI Name", "Creation Date"])
+        for ami in amis:
+            amis_table.add_row([
+                ami.id,
+                ami.name,
+                ami.creation_date
+            ])
+        return amis_table
+
+    @staticmethod
+    def print_exclusions(amis, exclusions, label=None):
+
+        """ Print excluded AMIs with the reasons of their exclusion """
+
+        if not amis:
+            return
+
+        exclusions_table = PrettyTable(["AMI ID", "AMI Name", "Excluded by"])
+        for ami in amis:
+            exclusions_table.add_row([
+                ami.id,
+                ami.name,
+                ", ".join(exclusions.get(ami.id))
+            ])
+
+        print("\nAMIs excluded{0}:".format(
+            " in {0}".format(label) if label else ""
+        ))
+        print(exclusions_table.get_string(sortby="AMI ID"))
+
+    @staticmethod
+    def print_deletion_results(results, full_report=False):
+
+        """ Print AMI deletion results """
+
+        if not results:
+            return
+
+        deregistered = [r for r in results if r.deregistered]
+        print("\n{0}/{1} AMIs deregistered, {2} snapshots deleted".format(
+            len(deregistered),
+            len(results),
+            sum(len(r.deleted_snapshots) for r in results)
+        ))
+
+        if not full_report:
+            return
+
+        results_table = PrettyTable(
+            ["AMI ID", "Deregistered", "Deleted Snapshots", "Failed Snapshots"]
+        )
+        for r in results:
+            results_table.add_row([
+                r.ami_id,
+                r.deregistered,
+                len(r.deleted_snapshots),
+                len(r.failed_snapshots)
+            ])
+        print(results_table.get_string(sortby="AMI ID"))
+
+    @staticmethod
+    def print_stages(progress):
+
+        """ Print progress counters of the deletion stages """
+
+        stages_table = PrettyTable(["Stage", "Queued", "Done", "Failed"])
+        for stage, counters in sorted(progress.items()):
+            counters = counters.to_dict()
+            stages_table.add_row([
+                stage, counters["queued"], counters["done"], counters["failed"]
+            ])
+        print(stages_table)
+
+    @staticmethod
+    def print_targets(targets):
+
+        """ Print candidates, timings and errors of each aws target """
+
+        targets_table = PrettyTable(
+            ["Target", "candidates", "Plan (s)", "Delete (s)", "Error"]
+        )
+        for target in targets:
+            targets_table.add_row([
+                target.label,
+                len(target.report_candidates(target.report)),
+                "{0:.2f}".format(target.timings.get("plan", 0)),
+                "{0:.2f}".format(target.timings.get("delete", 0)),
+                target.error or ""
+            ])
+        print(targets_table.get_string(sortby="Target"))
+
+    @staticmethod
+    def print_cache_stats(stats):
+
+        """ Print cache hits and misses counters """
+
+        print("\nCache: {0} hits, {1} misses".format(
+            stats.get("hits", 0), stats.get("misses", 0)
+        ))
+
     @staticmethod
     def print_failed_snapshots(snapshots):
 
@@ -90,6 +215,19 @@ def parse_args(args):
                         action="store_true",
                         help="Prints a full report of what to be cleaned")
 
+    parser.add_argument("--report-format",
+                        dest='report_format',
+                        choices=REPORT_FORMATS,
+                        default="table",
+                        help="Format of the report of AMIs to remove, json "
+                             "lines and csv reports list every AMI and are "
+                             "written group by group")
+
+    parser.add_argument("--report-output",
+                        dest='report_output',
+                        help="File of the json lines or csv report, "
+                             "stdout by default")
+
     parser.add_argument("--mapping-key",
                         dest='mapping_key',
                         help="How to regroup AMIs : [name|tags]")
@@ -99,6 +237,21 @@ def parse_args(args):
                         nargs='+',
                         help="List of values for tags or name")
 
+    parser.add_argument("--mapping-match",
+                        dest='mapping_match',
+                        choices=MATCH_MODES,
+                        default="substring",
+                        help="How names are matched against mapping values "
+                             "when grouping on name")
+
+    parser.add_argument("--server-filters",
+                        dest='server_filters',
+                        action="store_true",
+                        help="Fetch only the available AMIs matching the "
+                             "mapping values and age limit, filtered on "
+                             "the aws side. AMIs without mapping tags are "
+                             "then left out of the report")
+
     parser.add_argument("--excluded-mapping-values",
                         dest='excluded_mapping_values',
                         nargs='+',
@@ -128,10 +281,161 @@ def parse_args(args):
                         help="Number of days AMI to keep excluding those "
                              "currently being running")
 
+    parser.add_argument("--page-size",
+                        dest='page_size',
+                        type=int,
+                        default=PAGE_SIZE,
+                        help="Number of AMIs fetched per api call while "
+                             "listing the inventory")
+
+    parser.add_argument("--workers",
+                        dest='workers',
+                        type=int,
+                        default=WORKERS,
+                        help="Number of AMIs deleted in parallel")
+
+    parser.add_argument("--snapshot-workers",
+                        dest='snapshot_workers',
+                        type=int,
+                        help="Number of snapshots deleted in parallel, "
+                             "while AMIs are deregistered, defaults to "
+                             "workers")
+
+    parser.add_argument("--max-api-rate",
+                        dest='max_api_rate',
+                        type=float,
+                        default=API_MAX_RATE,
+                        help="Maximum aws api calls per second per action "
+                             "and target, the rate adapts to throttling "
+                             "below it")
+
+    parser.add_argument("--regions",
+                        dest='regions',
+                        nargs='+',
+                        help="Regions to clean concurrently, "
+                             "'all' for every enabled region")
+
+    parser.add_argument("--role-arns",
+                        dest='role_arns',
+                        nargs='+',
+                        help="IAM roles to assume, one per account to clean")
+
+    parser.add_argument("--concurrency",
+                        dest='concurrency',
+                        type=int,
+                        default=CONCURRENCY,
+                        help="Number of accounts and regions cleaned "
+                             "in parallel")
+
+    parser.add_argument("--cache-dir",
+                        dest='cache_dir',
+                        help="Directory of an on disk cache of aws "
+                             "responses, disabled by default")
+
+    parser.add_argument("--cache-ttl",
+                        dest='cache_ttl',
+                        type=int,
+                        default=CACHE_TTL,
+                        help="Seconds a cached aws response stays valid")
+
+    parser.add_argument("--cache-clear",
+                        dest='cache_clear',
+                        action="store_true",
+                        help="Drop every cached aws response before running")
+
+    parser.add_argument("--metrics-json",
+                        dest='metrics_json',
+                        help="Write aws api calls metrics and phase "
+                             "durations of the run to a json file")
+
+    parser.add_argument("--metrics-prom",
+                        dest='metrics_prom',
+                        help="Write the run metrics to a prometheus "
+                             "textfile collector file (*.prom)")
+
+    parser.add_argument("--incremental",
+                        dest='incremental',
+                        action="store_true",
+                        help="Keep the AMIs inventory in --cache-dir and only "
+                             "fetch the AMIs created since the last run")
+
+    parser.add_argument("--journal",
+                        dest='journal',
+                        help="Append every deregistration and snapshot "
+                             "deletion to a journal file, see --resume")
+
+    parser.add_argument("--resume",
+                        dest='resume',
+                        action="store_true",
+                        help="Finish the deletions of an interrupted run "
+                             "recorded in --journal, without fetching the "
+                             "inventory again")
+
+    parser.add_argument("--serve",
+                        dest='serve',
+                        action="store_true",
+                        help="Run as a service refreshing the plan on a "
+                             "schedule and serving it over a local http "
+                             "json api, deletions are only allowed from "
+                             "the local host")
+
+    parser.add_argument("--serve-address",
+                        dest='serve_address',
+                        default="127.0.0.1",
+                        help="Address the service listens on")
+
+    parser.add_argument("--serve-port",
+                        dest='serve_port',
+                        type=int,
+                        default=SERVE_PORT,
+                        help="Port the service listens on")
+
+    parser.add_argument("--serve-interval",
+                        dest='serve_interval',
+                        type=int,
+                        default=SERVE_INTERVAL,
+                        help="Seconds between two plans of the service")
+
+    plan_group = parser.add_mutually_exclusive_group()
+
+    plan_group.add_argument("--plan",
+                            dest='plan_output',
+                            metavar="PLAN_FILE",
+                            help="Writes the AMIs to remove to a plan file, "
+                                 "gzipped when ending with .gz, without "
+                                 "deleting them")
+
+    plan_group.add_argument("--apply",
+                            dest='apply_input',
+                            metavar="PLAN_FILE",
+                            help="Removes the AMIs of a plan file written "
+                                 "by --plan, without fetching them")
+
+    parser.add_argument("--check-stale",
+                        dest='check_stale',
+                        action="store_true",
+                        help="Checks the AMIs of the applied plan on aws "
+                             "first, groups which lost kept AMIs are skipped")
+
     parsed_args = parser.parse_args(args)
     if parsed_args.mapping_key and not parsed_args.mapping_values:
         print("missing mapping-values\n")
         parser.print_help()
         return None
 
+    if parsed_args.incremental and not parsed_args.cache_dir:
+        print("missing cache-dir\n")
+        parser.print_help()
+        return None
+
+    if parsed_args.resume and not parsed_args.journal:
+        print("missing journal\n")
+        parser.print_help()
+        return None
+
+    if parsed_args.check_stale and not parsed_args.apply_input:
+        print("missing apply\n")
+        parser.print_help()
+        return None
+
     return parsed_args
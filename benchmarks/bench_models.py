@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Memory used by AMI models parsed from describe_images responses
+
+    python benchmarks/bench_models.py --count 100000
+"""
+
+from __future__ import print_function
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from amicleaner.resources.models import AMI  # noqa: E402
+from synthetic import make_images_json  # noqa: E402
+
+
+def measure(func):
+
+    """ Return the result of func and the memory it still holds """
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = func()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=100000)
+    count = parser.parse_args(args).count
+
+    # responses are decoded from json, like botocore does
+    raw = json.dumps(make_images_json(count))
+    images, images_size = measure(lambda: json.loads(raw))
+    del raw
+
+    amis, amis_size = measure(
+        lambda: [AMI.object_with_json(image) for image in images]
+    )
+
+    # models outliving the responses they were parsed from
+    del images
+    gc.collect()
+    tracemalloc.start()
+    amis_alone = [AMI.object_with_json(image)
+                  for image in json.loads(json.dumps(make_images_json(count)))]
+    gc.collect()
+    amis_alone_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    mb = 1024.0 * 1024.0
+    print("images               : {0}".format(count))
+    print("raw responses        : {0:8.1f} MB".format(images_size / mb))
+    print("models (with raw)    : {0:8.1f} MB".format(amis_size / mb))
+    print("models (raw freed)   : {0:8.1f} MB".format(amis_alone_size / mb))
+    print("bytes per AMI        : {0:8.0f}".format(amis_alone_size / float(count)))
+
+    return amis, amis_alone
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Time and peak memory of each planning stage on synthetic inventories
+
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --sizes 1000 10000 --output base.json
+    python benchmarks/bench_pipeline.py --sizes 1000 10000 --compare base.json
+"""
+
+from __future__ import print_function
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from amicleaner.cli import App  # noqa: E402
+from amicleaner.core import AMICleaner  # noqa: E402
+from amicleaner.utils import parse_args  # noqa: E402
+from synthetic import PRODUCTS, make_inventory  # noqa: E402
+
+SIZES = [1000, 10000, 100000, 1000000]
+
+
+def get_stages(amis, used):
+
+    """ Return the stages to measure, as (name, function) pairs """
+
+    cleaner = AMICleaner(ec2=object())
+    app = App(parse_args([]))
+    available = dict((ami.id, ami) for ami in amis)
+    by_name = {"key": "name", "values": PRODUCTS}
+    by_tags = {"key": "tags", "values": ["role", "env"]}
+    now = time.time()
+
+    def reduce_groups():
+        groups = cleaner.map_candidates(amis, by_tags)
+        return [cleaner.split_candidates(group, 4, 30, now)
+                for group in groups.values()]
+
+    return [
+        ("fetch_candidates", lambda: app.fetch_candidates(available, used)),
+        ("tags_values_to_string", lambda: [
+            AMICleaner.tags_values_to_string(ami.tags, ["role", "env"])
+            for ami in amis]),
+        ("map_candidates(name)", lambda: cleaner.map_candidates(amis, by_name)),
+        ("map_candidates(tags)", lambda: cleaner.map_candidates(amis, by_tags)),
+        ("map+reduce_candidates", reduce_groups),
+    ]
+
+
+def measure(func, memory=True):
+
+    """ Return seconds spent in func and its peak memory in bytes """
+
+    gc.collect()
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def run(sizes, memory=True):
+    results = []
+    for size in sizes:
+        amis, used = make_inventory(size)
+        for stage, func in get_stages(amis, used):
+            elapsed, peak = measure(func, memory)
+            results.append({
+                "size": size, "stage": stage, "seconds": elapsed, "peak": peak
+            })
+            print("{0:>8} {1:<24} {2:9.3f}s {3:>10}".format(
+                size, stage, elapsed,
+                "{0:.1f}MB".format(peak / 1048576.0) if peak is not None else "-"
+            ))
+        del amis, used
+    return results
+
+
+def compare(results, baseline, tolerance):
+
+    """ Return the stages slower than the baseline by more than tolerance """
+
+    base = dict(((r["size"], r["stage"]), r) for r in baseline)
+    regressions = []
+    for r in results:
+        b = base.get((r["size"], r["stage"]))
+        if b and r["seconds"] > b["seconds"] * (1 + tolerance) and r["seconds"] > 0.01:
+            regressions.append((r, b))
+    return regressions
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="Skip peak memory measures, twice faster")
+    parser.add_argument("--output", help="Write results to a json file")
+    parser.add_argument("--compare", help="Baseline json file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown against the baseline")
+    args = parser.parse_args(args)
+
+    results = run(args.sizes, args.memory)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        for r, b in regressions:
+            print("regression {0} {1}: {2:.3f}s, baseline {3:.3f}s".format(
+                r["size"], r["stage"], r["seconds"], b["seconds"]))
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
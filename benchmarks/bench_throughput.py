@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+End to end throughput of a fetch, reduce and delete run against the
+in process fake aws backend, with injected latency and throttling
+
+    python benchmarks/bench_throughput.py
+    python benchmarks/bench_throughput.py --images 5000 --latency 0.05 --workers 20
+    python benchmarks/bench_throughput.py --workers 10 --snapshot-workers 20
+    python benchmarks/bench_throughput.py --throttle-rate 0.05 --rate-limit 100
+    python benchmarks/bench_throughput.py --rate-limit 100 --no-limiter
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from amicleaner.core import AMICleaner, OrphanSnapshotCleaner  # noqa: E402
+from amicleaner.fake import FakeAutoscaling, FakeBackend, FakeEC2  # noqa: E402
+from amicleaner.fetch import Fetcher  # noqa: E402
+from amicleaner.limiter import LimitedClient, RateLimiter  # noqa: E402
+from synthetic import make_inventory_json  # noqa: E402
+
+
+def run(args):
+    backend = FakeBackend(
+        latency=args.latency, page_size=args.page_size,
+        throttle_rate=args.throttle_rate, rate_limit=args.rate_limit
+    )
+    backend.add_images(list(make_inventory_json(args.images)))
+    ec2, autoscaling = FakeEC2(backend), FakeAutoscaling(backend)
+    limiter = RateLimiter(max_rate=args.max_api_rate)
+    if args.limiter:
+        ec2, autoscaling = LimitedClient(ec2, limiter), LimitedClient(autoscaling, limiter)
+
+    stages = []
+
+    start = time.time()
+    fetcher = Fetcher(ec2=ec2, autoscaling=autoscaling, page_size=args.page_size)
+    amis = list(fetcher.fetch_available_amis().values())
+    stages.append(("fetch", len(amis), time.time() - start))
+
+    start = time.time()
+    cleaner = AMICleaner(ec2=ec2, workers=args.workers, snapshot_workers=args.snapshot_workers)
+    groups = cleaner.map_candidates(amis, {"key": "tags", "values": ["role", "env"]})
+    candidates = [ami for group in groups.values()
+                  for ami in cleaner.reduce_candidates(group, args.keep_previous)]
+    stages.append(("reduce", len(candidates), time.time() - start))
+
+    start = time.time()
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    try:
+        cleaner.remove_amis(candidates)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    deleted = sum(1 for result in cleaner.results if result.deregistered)
+    stages.append(("delete", deleted, time.time() - start))
+
+    start = time.time()
+    orphans = OrphanSnapshotCleaner(ec2=ec2, page_size=args.page_size).fetch()
+    stages.append(("orphans", len(orphans), time.time() - start))
+
+    for stage, count, elapsed in stages:
+        print("{0:<8} {1:>8} items {2:9.3f}s {3:>10.1f}/s".format(
+            stage, count, elapsed, count / elapsed if elapsed else 0))
+    for stage, progress in sorted(cleaner.progress.items()):
+        print("{0:<8} {1:>8} done {2:>6} failed".format(
+            stage, progress.done, progress.failed))
+    for action in sorted(backend.calls):
+        print("{0:<32} {1:>8} calls {2:>6} throttled".format(
+            action, backend.calls[action], backend.throttles.get(action, 0)))
+    for (scope, action), rate in sorted(limiter.rates().items()):
+        print("{0:<32} {1:>8.1f}/s limiter rate".format(action, rate))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=2000)
+    parser.add_argument("--keep-previous", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--snapshot-workers", type=int, default=None)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="Seconds each fake api call takes")
+    parser.add_argument("--throttle-rate", type=float, default=0,
+                        help="Probability of a call to be throttled")
+    parser.add_argument("--rate-limit", type=float, default=None,
+                        help="Calls per second per action before throttling")
+    parser.add_argument("--max-api-rate", type=float, default=100.0,
+                        help="Maximum rate of the client side rate limiter")
+    parser.add_argument("--no-limiter", dest="limiter", action="store_false",
+                        help="Call the fake backend without rate limiter")
+    run(parser.parse_args(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
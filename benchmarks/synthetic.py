@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Synthetic describe_images responses and inventories for benchmarks
+"""
+
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from amicleaner.resources.models import AMI  # noqa: E402
+
+START_DATE = datetime(2015, 1, 1)
+
+
+def make_image_json(i, owner_id="123456789012"):
+
+    """ Return a describe_images image, shaped like tests/mocks/ami.json """
+
+    creation_date = START_DATE + timedelta(minutes=37 * i)
+    name = "custom-debian-{0}".format(creation_date.strftime("%Y%m%d%H%M"))
+
+    return {
+        "VirtualizationType": "hvm",
+        "Name": name,
+        "Tags": [
+            {"Value": "prod", "Key": "env"},
+            {"Value": "web", "Key": "role"},
+        ],
+        "Hypervisor": "xen",
+        "ImageId": "ami-{0:08x}".format(i),
+        "State": "available",
+        "BlockDeviceMappings": [
+            {
+                "DeviceName": "/dev/xvda",
+                "Ebs": {
+                    "DeleteOnTermination": True,
+                    "SnapshotId": "snap-{0:08x}".format(2 * i),
+                    "VolumeSize": 8,
+                    "VolumeType": "gp2",
+                    "Encrypted": False
+                }
+            },
+            {
+                "DeviceName": "/dev/xvdb",
+                "Ebs": {
+                    "DeleteOnTermination": True,
+                    "SnapshotId": "snap-{0:08x}".format(2 * i + 1),
+                    "VolumeSize": 100,
+                    "VolumeType": "gp2",
+                    "Encrypted": False
+                }
+            },
+        ],
+        "Architecture": "x86_64",
+        "ImageLocation": "{0}/{1}".format(owner_id, name),
+        "RootDeviceType": "ebs",
+        "OwnerId": owner_id,
+        "RootDeviceName": "/dev/xvda",
+        "CreationDate": creation_date.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        "Public": False,
+        "ImageType": "machine"
+    }
+
+
+def make_images_json(count):
+
+    """ Return count synthetic describe_images images """
+
+    return [make_image_json(i) for i in range(count)]
+
+
+# product names and their weights, a few products own most of the images
+PRODUCTS = ["web", "api", "worker", "batch", "search", "cache", "proxy",
+            "billing", "auth", "gateway", "etl", "ml-training", "ml-serving",
+            "monitoring", "logging", "vpn", "bastion", "ci-runner", "db-tools",
+            "legacy"]
+ENVIRONMENTS = ["prod", "staging", "dev", "qa"]
+DISTRIBUTIONS = ["ubuntu", "debian", "amzn2", "centos"]
+
+
+def make_inventory_json(count, seed=42, owner_id="123456789012"):
+
+    """
+    Yields count describe_images images with a zipf like distribution of
+    products, environments and distributions over three years of builds,
+    about 2% of the images have no tags
+    """
+
+    rand = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(PRODUCTS))]
+
+    for i in range(count):
+        product = rand.choices(PRODUCTS, weights)[0]
+        environment = rand.choice(ENVIRONMENTS)
+        distribution = rand.choice(DISTRIBUTIONS)
+        creation_date = START_DATE + timedelta(seconds=rand.randint(0, 3 * 365 * 86400))
+
+        image = make_image_json(i, owner_id)
+        image["CreationDate"] = creation_date.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        image["Name"] = "{0}-{1}-{2}-{3}".format(
+            product, distribution, environment, creation_date.strftime("%Y%m%d%H%M%S")
+        )
+        image["Tags"] = [
+            {"Key": "role", "Value": product},
+            {"Key": "env", "Value": environment},
+            {"Key": "os", "Value": distribution},
+            {"Key": "build", "Value": str(i)},
+        ] if rand.random() > 0.02 else []
+
+        yield image
+
+
+def make_inventory(count, seed=42):
+
+    """
+    Return AMIs of a synthetic inventory and the ids of the AMIs
+    used by instances, about 5% of them
+    """
+
+    amis = [AMI.object_with_json(image)
+            for image in make_inventory_json(count, seed)]
+
+    rand = random.Random(seed)
+    used = [ami.id for ami in rand.sample(amis, count // 20)]
+
+    return amis, used
@@ -12,7 +12,8 @@ with open('HISTORY.rst') as history_file:
     history = history_file.read()
 
 install_requirements = ['awscli', 'argparse', 'boto',
-                        'boto3', 'prettytable', 'blessings']
+                        'boto3', 'prettytable', 'blessings',
+                        'futures; python_version < "3.0"']
 
 test_requirements = ['moto', 'pytest', 'pytest-pep8', 'pytest-cov']
 
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+import calendar
+from datetime import datetime, timedelta
+
+from moto import mock_ec2, mock_autoscaling, mock_sts
+
+from amicleaner.cache import InventoryCache, InventoryStore, get_delta_dates
+from amicleaner.cli import App
+from amicleaner.fake import FakeAutoscaling, FakeBackend, FakeEC2, FakeSTS
+from amicleaner.utils import parse_args
+from .test_fake import make_image
+
+
+def describe_images(**kwargs):
+    describe_images.calls += 1
+    if kwargs.get("NextToken"):
+        return {"Images": [{"ImageId": "ami-two"}]}
+    return {
+        "Images": [{"ImageId": "ami-one", "CreationDate": datetime.now()}],
+        "NextToken": "t1",
+        "ResponseMetadata": {"RequestId": "1"}
+    }
+
+
+describe_images.calls = 0
+
+
+def list_images(cache, scope="111111111111/eu-west-1", **kwargs):
+    return [image["ImageId"]
+            for page in cache.paginate(scope, describe_images, **kwargs)
+            for image in page["Images"]]
+
+
+def test_cache_hits_and_misses(tmpdir):
+    describe_images.calls = 0
+    cache = InventoryCache(str(tmpdir.join("cache")))
+
+    assert list_images(cache) == ["ami-one", "ami-two"]
+    assert list_images(cache) == ["ami-one", "ami-two"]
+    assert describe_images.calls == 2
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+    # keyed by scope and parameters
+    assert list_images(cache, "222222222222/eu-west-1") == ["ami-one", "ami-two"]
+    assert list_images(cache, Owners=["self"]) == ["ami-one", "ami-two"]
+    assert cache.stats() == {"hits": 1, "misses": 3}
+
+    # persisted on disk
+    cache = InventoryCache(str(tmpdir.join("cache")))
+    assert list_images(cache) == ["ami-one", "ami-two"]
+    assert cache.stats() == {"hits": 1, "misses": 0}
+
+
+def test_cache_ttl_and_invalidation(tmpdir):
+    cache = InventoryCache(str(tmpdir), ttl=0)
+    list_images(cache)
+    list_images(cache)
+    assert cache.stats() == {"hits": 0, "misses": 2}
+
+    cache = InventoryCache(str(tmpdir.join("ttl")), ttl=3600)
+    list_images(cache)
+    list_images(cache, "222222222222/eu-west-1")
+    cache.invalidate("111111111111/eu-west-1")
+    list_images(cache)
+    list_images(cache, "222222222222/eu-west-1")
+    assert cache.stats() == {"hits": 1, "misses": 3}
+
+    cache.invalidate()
+    list_images(cache, "222222222222/eu-west-1")
+    assert cache.stats() == {"hits": 1, "misses": 4}
+
+
+def test_partial_listing_not_cached(tmpdir):
+    cache = InventoryCache(str(tmpdir))
+    pages = cache.paginate("scope", describe_images)
+    next(pages)
+    pages.close()
+
+    list_images(cache, "scope")
+    assert cache.stats() == {"hits": 0, "misses": 2}
+
+
+@mock_ec2
+@mock_autoscaling
+@mock_sts
+def test_app_with_cache(tmpdir):
+    parser = parse_args(['--dry-run', '--cache-dir', str(tmpdir)])
+
+    App(parser).prepare_candidates()
+    app = App(parser)
+    app.prepare_candidates()
+    assert app.cache.stats()["misses"] == 0
+    assert app.cache.stats()["hits"] > 0
+
+    app = App(parse_args(['--cache-dir', str(tmpdir), '--cache-clear']))
+    app.prepare_candidates()
+    assert app.cache.stats()["hits"] == 0
+
+
+def test_app_cache_exclusions(tmpdir):
+    backend = FakeBackend()
+    backend.add_images([make_image(i) for i in range(4)])
+
+    def count_calls(args):
+        backend.calls.clear()
+        for _ in range(2):
+            app = App(parse_args(["--cache-dir", str(tmpdir)] + args))
+            app.clients = {"ec2": FakeEC2(backend), "autoscaling": FakeAutoscaling(backend),
+                           "sts": FakeSTS(backend)}
+            app.prepare_candidates()
+        return backend.calls.get("DescribeImages"), backend.calls.get("DescribeInstances")
+
+    assert count_calls(["--dry-run"]) == (1, 1)
+    # instances launched meanwhile protect their AMIs from deletion
+    assert count_calls([]) == (2, 2)
+
+
+def test_app_cache_kept_deregistered(tmpdir):
+    backend = FakeBackend()
+    backend.add_images([make_dated_image(i, 10 - i) for i in range(4)])
+
+    def prepare_candidates(args):
+        app = App(parse_args(["--cache-dir", str(tmpdir), "--keep-previous", "2",
+                              "--mapping-key", "name", "--mapping-values", "web"] + args))
+        app.clients = {"ec2": FakeEC2(backend), "autoscaling": FakeAutoscaling(backend),
+                       "sts": FakeSTS(backend)}
+        return sorted(ami.id for ami in app.prepare_candidates())
+
+    assert prepare_candidates(["--dry-run"]) == ["ami-00000000", "ami-00000001"]
+
+    # the kept AMIs are deregistered outside of amicleaner
+    backend.images.pop("ami-00000002")
+    backend.images.pop("ami-00000003")
+
+    assert prepare_candidates(["--dry-run"]) == ["ami-00000000", "ami-00000001"]
+    assert prepare_candidates(["-f"]) == []
+
+
+def make_dated_image(i, days_ago, name="web"):
+    image = make_image(i, name)
+    image["CreationDate"] = (datetime.utcnow() - timedelta(days=days_ago)).strftime(
+        "%Y-%m-%dT%H:%M:%S.000Z")
+    return image
+
+
+def test_delta_dates():
+    now = calendar.timegm(datetime(2020, 3, 2, 12).utctimetuple())
+
+    assert get_delta_dates("2020-02-28T10:00:00.000Z", now) == [
+        "2020-02-28T*", "2020-02-29T*", "2020-03-01T*", "2020-03-02T*"
+    ]
+
+
+def test_inventory_store_refresh(tmpdir):
+    backend = FakeBackend()
+    backend.add_images([make_dated_image(i, 10 - i) for i in range(4)])
+    ec2 = FakeEC2(backend)
+    store = InventoryStore(str(tmpdir))
+
+    assert store.refresh("scope", ec2) == "full"
+    assert len(list(store.iter_amis("scope"))) == 4
+
+    backend.add_images([make_dated_image(4, 0)])
+    backend.images.pop("ami-00000000")
+    backend.images.pop("ami-00000003")
+
+    assert store.refresh("scope", ec2) == "delta"
+    ids = sorted(ami.id for ami in store.iter_amis("scope"))
+    # deregistered before the watermark day, still stored until verified
+    assert ids == ["ami-00000000", "ami-00000001", "ami-00000002", "ami-00000004"]
+    assert store.verify("scope", ec2, ["ami-00000000", "ami-00000001"]) == ["ami-00000000"]
+
+    store.remove("scope", ["ami-00000001"])
+    assert sorted(ami.id for ami in store.iter_amis("scope")) == ["ami-00000002", "ami-00000004"]
+
+    store.full_refresh = 0
+    assert store.refresh("scope", ec2) == "full"
+    store.invalidate()
+    assert list(store.iter_amis("scope")) == []
+
+
+def test_app_incremental(tmpdir):
+    backend = FakeBackend()
+    backend.add_images([make_dated_image(i, 10 - i) for i in range(4)])
+    backend.add_images([make_dated_image(10 + i, 30 - i, "api") for i in range(2)])
+    args = parse_args(["-f", "--cache-dir", str(tmpdir), "--incremental", "--keep-previous", "1",
+                       "--mapping-key", "name", "--mapping-values", "web", "api"])
+
+    def prepare_candidates():
+        app = App(args)
+        app.clients = {"ec2": FakeEC2(backend), "autoscaling": FakeAutoscaling(backend),
+                       "sts": FakeSTS(backend)}
+        return app, sorted(app.prepare_candidates(), key=lambda ami: ami.id)
+
+    app, candidates = prepare_candidates()
+    assert [ami.id for ami in candidates] == [
+        "ami-00000000", "ami-00000001", "ami-00000002", "ami-0000000a"]
+    app.prepare_delete_amis(candidates[:1])
+
+    # the kept api AMI, older than the watermark, is deregistered outside of amicleaner
+    backend.images.pop("ami-0000000b")
+    calls = backend.calls["DescribeImages"]
+
+    app, candidates = prepare_candidates()
+    assert [ami.id for ami in candidates] == ["ami-00000001", "ami-00000002"]
+    assert app.kept["api"][0].id == "ami-0000000a"
+    # a delta listing and two verifications of the kept AMIs
+    assert backend.calls["DescribeImages"] == calls + 3
+    assert parse_args(["--incremental"]) is None
@@ -3,13 +3,21 @@
 import json
 
 import boto3
-from moto import mock_ec2, mock_autoscaling
+from botocore.exceptions import EndpointConnectionError
+from moto import mock_ec2, mock_autoscaling, mock_sts
 from datetime import datetime
 
+from amicleaner.aws import SessionCache, get_account_id
+from amicleaner.aws import get_enabled_regions, paginate
 from amicleaner.cli import App
+from amicleaner.fake import FakeAutoscaling, FakeEC2, client_error
+from amicleaner.fanout import fan_out
 from amicleaner.fetch import Fetcher
 from amicleaner.utils import parse_args, Printer
+from amicleaner.resources.config import BOTO3_DIRECT_RETRIES
 from amicleaner.resources.models import AMI, AWSEC2Instance
+from amicleaner.resources.models import AMIDeletionResult
+from .test_fake import make_backend
 
 
 @mock_ec2
@@ -66,6 +74,147 @@ def test_deletion():
     assert len(f.fetch_available_amis()) == 0
 
 
+@mock_ec2
+@mock_autoscaling
+def test_run_regions():
+    regions = ['eu-west-1', 'us-east-1']
+    for region in regions:
+        ec2 = boto3.client('ec2', region_name=region)
+        reservation = ec2.run_instances(
+            ImageId="ami-1234abcd", MinCount=1, MaxCount=1
+        )
+        instance = reservation["Instances"][0]
+        for i in range(3):
+            ec2.create_image(
+                InstanceId=instance.get("InstanceId"),
+                Name="test-ami-{0}".format(i)
+            )
+
+    parser = parse_args(
+        [
+            '-f',
+            '--keep-previous', '1',
+            '--mapping-key', 'name',
+            '--mapping-values', 'test-ami',
+            '--regions'] + regions
+    )
+    app = App(parser)
+    targets = app.get_targets()
+    assert [t.label for t in targets] == regions
+
+    app.run_targets(targets)
+    for target in targets:
+        assert target.error is None
+        assert len(target.report['test-ami']) == 2
+        assert len(target.kept['test-ami']) == 1
+        assert target.timings['delete'] >= 0
+
+    for region in regions:
+        ec2 = boto3.client('ec2', region_name=region)
+        assert len(ec2.describe_images(Owners=['self'])['Images']) == 1
+
+    assert 'eu-west-1' in get_enabled_regions()
+
+
+class UnreachableEC2(FakeEC2):
+
+    def describe_images(self, **kwargs):
+        raise EndpointConnectionError(endpoint_url="https://ec2.eu-wst-1.amazonaws.com/")
+
+
+def test_run_targets_unreachable_region():
+    backend = make_backend(3)
+    app = App(parse_args(['-f', '--keep-previous', '1', '--mapping-key', 'name',
+                          '--mapping-values', 'web']))
+    app.limiter.retries = 0
+
+    targets = []
+    for region, ec2 in (('us-east-1', FakeEC2(backend)), ('eu-wst-1', UnreachableEC2(backend))):
+        target = app.for_target(region)
+        target.clients = {"ec2": ec2, "autoscaling": FakeAutoscaling(backend)}
+        target.clients_session = target.session
+        targets.append(target)
+
+    app.run_targets(targets)
+    assert targets[0].error is None
+    assert len(targets[0].results) == 2
+    assert "Could not connect" in targets[1].error
+    assert targets[1].timings['plan'] >= 0
+
+
+@mock_sts
+def test_session_cache():
+    role_arn = "arn:aws:iam::111111111111:role/cleaner"
+    assert get_account_id(role_arn) == "111111111111"
+
+    sessions = SessionCache()
+    assume_role = sessions.assume_role
+
+    def counting_assume_role(arn):
+        counting_assume_role.calls += 1
+        return assume_role(arn)
+
+    counting_assume_role.calls = 0
+    sessions.assume_role = counting_assume_role
+
+    # concurrent targets of a role assume it once
+    session = sessions.get(role_arn)
+    assert fan_out(lambda i: sessions.get(role_arn), range(8), 8) == [session] * 8
+    assert counting_assume_role.calls == 1
+    # assume role calls are retried by the aws sdk, not by the rate limiter
+    retries = sessions.sts.meta.config.retries
+    assert retries.get("total_max_attempts", retries.get("max_attempts", 0) + 1) == BOTO3_DIRECT_RETRIES + 1
+
+    # expiring credentials are renewed by botocore, the session is kept
+    credentials = session.get_credentials()
+    access_key = credentials.get_frozen_credentials().access_key
+    credentials._expiry_time = credentials._time_fetcher()
+    assert credentials.get_frozen_credentials().access_key != access_key
+    assert counting_assume_role.calls == 2
+
+
+@mock_ec2
+@mock_autoscaling
+@mock_sts
+def test_run_accounts():
+    role_arns = [
+        "arn:aws:iam::111111111111:role/cleaner",
+        "arn:aws:iam::222222222222:role/cleaner",
+    ]
+    sessions = SessionCache()
+    for role_arn in role_arns:
+        ec2 = sessions.get(role_arn).client('ec2')
+        reservation = ec2.run_instances(
+            ImageId="ami-1234abcd", MinCount=1, MaxCount=1
+        )
+        instance = reservation["Instances"][0]
+        for i in range(2):
+            ec2.create_image(
+                InstanceId=instance.get("InstanceId"),
+                Name="test-ami-{0}".format(i)
+            )
+
+    parser = parse_args(
+        [
+            '-f',
+            '--keep-previous', '0',
+            '--mapping-key', 'name',
+            '--mapping-values', 'test-ami',
+            '--concurrency', '2',
+            '--role-arns'] + role_arns
+    )
+    app = App(parser)
+    targets = app.get_targets()
+    assert [t.label for t in targets] == ["111111111111", "222222222222"]
+
+    app.run_targets(targets)
+    for target in targets:
+        assert target.error is None
+        assert len(target.report['test-ami']) == 2
+        ec2 = target.client('ec2')
+        assert ec2.describe_images(Owners=['self'])['Images'] == []
+
+
 @mock_ec2
 @mock_autoscaling
 def test_deletion_ami_min_days():
@@ -102,6 +251,7 @@ def test_deletion_ami_min_days():
     candidates_tobedeleted = app.prepare_candidates(candidates)
     assert len(candidates) == 2
     assert len(candidates_tobedeleted) == 2
+    assert app.kept == {}
 
     parser = parse_args(
         [
@@ -117,6 +267,234 @@ def test_deletion_ami_min_days():
     assert len(candidates_tobedeleted2) == 0
 
 
+@mock_ec2
+@mock_autoscaling
+def test_iter_available_amis():
+    ec2 = boto3.client('ec2')
+    reservation = ec2.run_instances(
+        ImageId="ami-1234abcd", MinCount=1, MaxCount=1
+    )
+    instance = reservation["Instances"][0]
+
+    for i in range(7):
+        ec2.create_image(
+            InstanceId=instance.get("InstanceId"),
+            Name="test-ami-{0}".format(i)
+        )
+
+    f = Fetcher(ec2=ec2, autoscaling=boto3.client('autoscaling'), page_size=5)
+    amis = f.iter_available_amis()
+    assert not isinstance(amis, (list, dict))
+    assert len([ami.id for ami in amis]) == 7
+
+
+def test_paginate():
+    pages = {
+        None: {"Images": [1, 2], "NextToken": "t1"},
+        "t1": {"Images": [3, 4], "NextToken": "t2"},
+        "t2": {"Images": [5]},
+    }
+    calls = []
+
+    def describe_images(**kwargs):
+        calls.append(kwargs)
+        return pages[kwargs.get("NextToken")]
+
+    resps = list(paginate(describe_images, page_size=2, Owners=["self"]))
+    assert [len(r["Images"]) for r in resps] == [2, 2, 1]
+    assert calls[0] == {"MaxResults": 2, "Owners": ["self"]}
+    assert calls[2]["NextToken"] == "t2"
+
+
+class CountingAutoscaling(object):
+
+    def __init__(self, groups=None, lcs=None):
+        self.calls = []
+        self.groups = groups or [
+            {"AutoScalingGroupName": "web", "DesiredCapacity": 2,
+             "LaunchConfigurationName": "web-lc"},
+            {"AutoScalingGroupName": "batch", "DesiredCapacity": 0,
+             "LaunchConfigurationName": "batch-lc"},
+        ]
+        self.lcs = lcs or [
+            {"LaunchConfigurationName": "web-lc", "ImageId": "ami-web"},
+            {"LaunchConfigurationName": "batch-lc", "ImageId": "ami-batch"},
+            {"LaunchConfigurationName": "old-lc", "ImageId": "ami-old"},
+        ]
+
+    @staticmethod
+    def page(items, key, kwargs):
+        start = int(kwargs.get("NextToken") or 0)
+        end = start + kwargs.get("MaxRecords", 50)
+        resp = {key: items[start:end]}
+        if end < len(items):
+            resp["NextToken"] = str(end)
+        return resp
+
+    def describe_auto_scaling_groups(self, **kwargs):
+        self.calls.append(("describe_auto_scaling_groups", kwargs))
+        return self.page(self.groups, "AutoScalingGroups", kwargs)
+
+    def describe_launch_configurations(self, **kwargs):
+        self.calls.append(("describe_launch_configurations", kwargs))
+        names = kwargs.get("LaunchConfigurationNames")
+        assert names is None or len(names) <= 50
+        lcs = [lc for lc in self.lcs
+               if not names or lc["LaunchConfigurationName"] in names]
+        return self.page(lcs, "LaunchConfigurations", kwargs)
+
+
+def test_fetch_autoscaling_from_inventory():
+    asg = CountingAutoscaling()
+    f = Fetcher(ec2=object(), autoscaling=asg)
+
+    assert f.fetch_unattached_lc() == ["ami-old"]
+    assert f.fetch_zeroed_asg() == ["ami-batch"]
+    assert len(asg.calls) == 2
+
+    # zeroed groups resolved by name when the listing is not loaded
+    asg = CountingAutoscaling()
+    f = Fetcher(ec2=object(), autoscaling=asg)
+    assert f.fetch_zeroed_asg() == ["ami-batch"]
+    assert f.fetch_zeroed_asg() == ["ami-batch"]
+    assert asg.calls[1] == (
+        "describe_launch_configurations",
+        {"LaunchConfigurationNames": ["batch-lc"]}
+    )
+    assert len(asg.calls) == 2
+
+
+def test_fetch_autoscaling_paginated_and_chunked():
+    groups = [{"AutoScalingGroupName": "asg-{0:03}".format(i),
+               "DesiredCapacity": 0,
+               "LaunchConfigurationName": "lc-{0:03}".format(i)}
+              for i in range(120)]
+    lcs = [{"LaunchConfigurationName": "lc-{0:03}".format(i),
+            "ImageId": "ami-{0:03}".format(i)}
+           for i in range(130)]
+    asg = CountingAutoscaling(groups, lcs)
+    f = Fetcher(ec2=object(), autoscaling=asg)
+
+    assert len(f.fetch_zeroed_asg()) == 120
+    calls = [c[0] for c in asg.calls]
+    # 2 pages of groups and 3 chunks of names
+    assert calls.count("describe_auto_scaling_groups") == 2
+    assert calls.count("describe_launch_configurations") == 3
+
+    assert len(f.fetch_unattached_lc()) == 10
+    assert len(asg.calls) == 7
+
+
+@mock_ec2
+@mock_autoscaling
+def test_fetch_launch_templates():
+    ec2 = boto3.client('ec2')
+    asg = boto3.client('autoscaling')
+    reservation = ec2.run_instances(
+        ImageId="ami-1234abcd", MinCount=1, MaxCount=1
+    )
+    instance = reservation["Instances"][0]
+    image_ids = [
+        ec2.create_image(
+            InstanceId=instance.get("InstanceId"),
+            Name="test-ami-{0}".format(i)
+        ).get("ImageId")
+        for i in range(3)
+    ]
+
+    template = ec2.create_launch_template(
+        LaunchTemplateName="web",
+        LaunchTemplateData={"ImageId": image_ids[0]}
+    ).get("LaunchTemplate")
+    ec2.create_launch_template_version(
+        LaunchTemplateId=template.get("LaunchTemplateId"),
+        LaunchTemplateData={"ImageId": image_ids[1]}
+    )
+
+    subnet = ec2.describe_subnets()["Subnets"][0]["SubnetId"]
+    for name, version in [("web-v1", "1"), ("web-v2", "2"), ("web-latest", "$Latest")]:
+        asg.create_auto_scaling_group(
+            AutoScalingGroupName=name,
+            LaunchTemplate={
+                "LaunchTemplateId": template.get("LaunchTemplateId"),
+                "Version": version
+            },
+            MinSize=0, MaxSize=0, DesiredCapacity=0,
+            VPCZoneIdentifier=subnet
+        )
+
+    f = Fetcher(ec2=ec2, autoscaling=asg)
+    assert sorted(set(f.fetch_launch_templates())) == sorted(image_ids[:2])
+
+    app = App(parse_args([]))
+    candidates = app.fetch_candidates()
+    assert [ami.id for ami in candidates] == [image_ids[2]]
+    assert app.exclusions.get(image_ids[0]) == ["launch-template"]
+
+
+def test_launch_template_versions_batched():
+    class CountingEC2(object):
+        calls = []
+
+        def describe_launch_template_versions(self, **kwargs):
+            self.calls.append(kwargs)
+            return {"LaunchTemplateVersions": [
+                {"LaunchTemplateData": {"ImageId": "ami-{0}".format(v)}}
+                for v in kwargs["Versions"]
+            ]}
+
+    ec2 = CountingEC2()
+    asg = CountingAutoscaling(groups=[
+        {"AutoScalingGroupName": "a",
+         "LaunchTemplate": {"LaunchTemplateId": "lt-1", "Version": "1"}},
+        {"AutoScalingGroupName": "b",
+         "LaunchTemplate": {"LaunchTemplateId": "lt-1", "Version": "2"}},
+        {"AutoScalingGroupName": "c",
+         "MixedInstancesPolicy": {"LaunchTemplate": {
+             "LaunchTemplateSpecification": {"LaunchTemplateName": "batch"},
+             "Overrides": [{"LaunchTemplateSpecification": {
+                 "LaunchTemplateId": "lt-1", "Version": "1"}}]
+         }}},
+    ])
+    f = Fetcher(ec2=ec2, autoscaling=asg)
+
+    assert sorted(f.fetch_launch_templates()) == ["ami-$Default", "ami-1", "ami-2"]
+    assert len(ec2.calls) == 2
+    assert {"LaunchTemplateId": "lt-1", "Versions": ["1", "2"]} in ec2.calls
+    assert {"LaunchTemplateName": "batch", "Versions": ["$Default"]} in ec2.calls
+
+
+def test_launch_template_version_not_found():
+    class DeletedVersionEC2(object):
+        calls = []
+
+        def describe_launch_template_versions(self, **kwargs):
+            self.calls.append(kwargs)
+            if kwargs.get("LaunchTemplateId") == "lt-gone":
+                raise client_error("InvalidLaunchTemplateId.NotFound", "DescribeLaunchTemplateVersions")
+            if "1" in kwargs["Versions"]:
+                raise client_error("InvalidLaunchTemplateId.VersionNotFound", "DescribeLaunchTemplateVersions")
+            return {"LaunchTemplateVersions": [
+                {"LaunchTemplateData": {"ImageId": "ami-{0}".format(v)}}
+                for v in kwargs["Versions"]
+            ]}
+
+    ec2 = DeletedVersionEC2()
+    asg = CountingAutoscaling(groups=[
+        {"AutoScalingGroupName": "a",
+         "LaunchTemplate": {"LaunchTemplateId": "lt-1", "Version": "1"}},
+        {"AutoScalingGroupName": "b",
+         "LaunchTemplate": {"LaunchTemplateId": "lt-1", "Version": "$Latest"}},
+        {"AutoScalingGroupName": "c",
+         "LaunchTemplate": {"LaunchTemplateId": "lt-gone", "Version": "1"}},
+    ])
+    f = Fetcher(ec2=ec2, autoscaling=asg)
+
+    # the AMIs of the other versions are still protected
+    assert f.fetch_launch_templates() == ["ami-$Latest"]
+    assert len(ec2.calls) == 4
+
+
 def test_fetch_candidates():
     # creating tests objects
     first_ami = AMI()
@@ -149,11 +527,36 @@ def test_fetch_candidates():
     instances_dict[second_instance.image_id] = second_instance
 
     # testing filter
-    unused_ami_dict = App(parse_args([])).fetch_candidates(
+    app = App(parse_args([]))
+    unused_ami_dict = app.fetch_candidates(
         amis_dict, list(instances_dict)
     )
     assert len(unused_ami_dict) == 1
     assert amis_dict.get('unused-ami') is not None
+    assert [ami.id for ami in app.excluded] == [first_ami.id]
+    assert app.exclusions.get(first_ami.id) == ["provided"]
+    assert Printer.print_exclusions(app.excluded, app.exclusions) is None
+
+
+@mock_ec2
+@mock_autoscaling
+def test_fetch_candidates_exclusions():
+    ec2 = boto3.client('ec2')
+    reservation = ec2.run_instances(
+        ImageId="ami-1234abcd", MinCount=1, MaxCount=1
+    )
+    instance = reservation["Instances"][0]
+    image_id = ec2.create_image(
+        InstanceId=instance.get("InstanceId"), Name="used-ami"
+    ).get("ImageId")
+    ec2.run_instances(ImageId=image_id, MinCount=1, MaxCount=1)
+    ec2.create_image(InstanceId=instance.get("InstanceId"), Name="unused-ami")
+
+    app = App(parse_args(['--full-report']))
+    candidates = app.fetch_candidates()
+    assert [ami.name for ami in candidates] == ["unused-ami"]
+    assert image_id in app.exclusions
+    assert app.exclusions.get(image_id) == ["instance"]
 
 
 def test_parse_args_no_args():
@@ -166,6 +569,11 @@ def test_parse_args_no_args():
     assert parser.mapping_values is None
     assert parser.keep_previous is 4
     assert parser.ami_min_days is -1
+    assert parser.page_size == 1000
+    assert parser.workers == 10
+    assert parser.concurrency == 10
+    assert parser.mapping_match == "substring"
+    assert parser.role_arns is None
 
 
 def test_parse_args():
@@ -181,6 +589,9 @@ def test_parse_args():
     assert parser.mapping_key == "tags"
     assert len(parser.mapping_values) == 2
 
+    parser = parse_args(['--regions', 'all'])
+    assert parser.regions == ['all']
+
     parser = parse_args(['--ami-min-days', '10', '--full-report'])
     assert parser.ami_min_days == 10
     assert parser.full_report is True
@@ -195,6 +606,21 @@ def test_print_report():
         candidates = {'test': [ami]}
         assert Printer.print_report(candidates) is None
         assert Printer.print_report(candidates, full_report=True) is None
+        assert Printer.print_report(candidates, True, {'test': [ami]}) is None
+
+
+def test_print_deletion_results():
+    assert Printer.print_deletion_results([]) is None
+
+    first_result = AMIDeletionResult("ami-one")
+    first_result.deregistered = True
+    first_result.deleted_snapshots = ["snap-one"]
+    second_result = AMIDeletionResult("ami-two")
+    second_result.error = "not found"
+    results = [first_result, second_result]
+
+    assert Printer.print_deletion_results(results) is None
+    assert Printer.print_deletion_results(results, full_report=True) is None
 
 
 def test_print_failed_snapshots():
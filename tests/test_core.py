@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*-
 
+import random
+import threading
+
+import boto3
+import pytest
+from botocore.exceptions import EndpointConnectionError
 from datetime import datetime
 from moto import mock_ec2
 
 from amicleaner.core import AMICleaner, OrphanSnapshotCleaner
+from amicleaner.fake import FakeEC2
+from amicleaner.matcher import NameMatcher
 from amicleaner.resources.models import AMI, AWSTag, AWSBlockDevice
+from .test_fake import make_backend, make_image
 
 
 def test_map_candidates_with_null_arguments():
@@ -90,6 +99,55 @@ def test_map_with_names():
     assert len(grouped_amis.get('debian')) == 1
 
 
+def test_map_with_name_prefixes():
+    first_ami = AMI()
+    first_ami.id = 'ami-28c2b348'
+    first_ami.name = "ubuntu-20160102"
+
+    second_ami = AMI()
+    second_ami.id = 'ami-28c2b349'
+    second_ami.name = "my-ubuntu-20160103"
+
+    candidates = [first_ami, second_ami]
+
+    grouping_strategy = {"key": "name", "values": ["ubuntu"], "match": "prefix"}
+    grouped_amis = AMICleaner().map_candidates(candidates, grouping_strategy)
+    assert grouped_amis == {"ubuntu": [first_ami]}
+
+    grouping_strategy = {"key": "name", "values": ["^my-", "2016"], "match": "regex"}
+    grouped_amis = AMICleaner().map_candidates(candidates, grouping_strategy)
+    assert grouped_amis == {"^my-": [second_ami], "2016": candidates}
+
+
+def test_name_matcher():
+    matcher = NameMatcher(["he", "she", "his", "hers", "she"])
+    assert matcher.match("ushers") == ["he", "she", "hers"]
+    assert matcher.match("history") == ["his"]
+    assert matcher.match(None) == []
+
+    matcher = NameMatcher(["ubuntu", "ubuntu-16", "debian"], "prefix")
+    assert matcher.match("ubuntu-16.04") == ["ubuntu", "ubuntu-16"]
+    assert matcher.match("my-ubuntu") == []
+
+    with pytest.raises(ValueError):
+        NameMatcher(["ubuntu"], "glob")
+
+
+def test_name_matcher_matches_substrings():
+    rand = random.Random(42)
+    values = ["".join(rand.choice("abc") for _ in range(rand.randint(1, 4)))
+              for _ in range(30)]
+    matcher = NameMatcher(values)
+
+    for _ in range(200):
+        name = "".join(rand.choice("abcd") for _ in range(rand.randint(0, 12)))
+        expected = []
+        for value in values:
+            if value in name and value not in expected:
+                expected.append(value)
+        assert matcher.match(name) == expected
+
+
 def test_map_with_tags():
     # tags
     stack_tag = AWSTag()
@@ -261,10 +319,171 @@ def test_reduce():
     assert len(left) == 0
 
 
+def test_reduce_with_min_days():
+    now = 1500000000
+    day = 86400
+
+    amis = []
+    for i, age in enumerate([1, 5, 10, 30]):
+        ami = AMI()
+        ami.id = 'ami-{0}'.format(i)
+        ami.creation_date = datetime.utcfromtimestamp(now - age * day - 1)
+        amis.append(ami)
+
+    # no creation date, never removed on age
+    undated_ami = AMI()
+    undated_ami.id = 'ami-undated'
+    amis.append(undated_ami)
+
+    cleaner = AMICleaner()
+    left = cleaner.reduce_candidates(amis, ami_min_days=5, now=now)
+    assert [ami.id for ami in left] == ['ami-1', 'ami-2', 'ami-3']
+
+    left = cleaner.reduce_candidates(amis, keep_previous=1, ami_min_days=5, now=now)
+    assert [ami.id for ami in left] == ['ami-2', 'ami-3']
+
+    left = cleaner.reduce_candidates(amis, keep_previous=2)
+    assert [ami.id for ami in left] == ['ami-2', 'ami-3', 'ami-undated']
+
+
+def test_split_candidates():
+    amis = []
+    for i in range(100):
+        ami = AMI()
+        ami.id = 'ami-{0}'.format(i)
+        # shuffled creation dates
+        ami.creation_date = datetime(2016, 1, 1 + (i * 7) % 100 // 4, i % 24)
+        amis.append(ami)
+
+    cleaner = AMICleaner()
+    kept, deleted = cleaner.split_candidates(amis, keep_previous=10)
+
+    by_date = sorted(amis, key=cleaner.get_ami_sorting_key, reverse=True)
+    assert kept == by_date[:10]
+    assert len(deleted) == 90
+    assert set(kept).isdisjoint(deleted)
+    assert deleted == [ami for ami in amis if ami not in kept]
+
+    kept, deleted = cleaner.split_candidates(amis)
+    assert kept == []
+    assert deleted == amis
+
+
 def test_remove_ami_from_none():
     assert AMICleaner().remove_amis(None) == []
 
 
+@mock_ec2
+def test_remove_amis_concurrently():
+    ec2 = boto3.client('ec2')
+    reservation = ec2.run_instances(
+        ImageId="ami-1234abcd", MinCount=1, MaxCount=1
+    )
+    instance = reservation["Instances"][0]
+
+    amis = []
+    for i in range(6):
+        image_id = ec2.create_image(
+            InstanceId=instance.get("InstanceId"),
+            Name="test-ami-{0}".format(i)
+        ).get("ImageId")
+        image = ec2.describe_images(ImageIds=[image_id])["Images"][0]
+        amis.append(AMI.object_with_json(image))
+
+    # unknown snapshot, its deletion fails
+    failing_device = AWSBlockDevice()
+    failing_device.snapshot_id = "snap-00000000"
+    amis[0].block_device_mappings.append(failing_device)
+
+    # unknown ami, its deregistration fails
+    unknown_ami = AMI()
+    unknown_ami.id = "ami-00000000"
+    amis.append(unknown_ami)
+
+    cleaner = AMICleaner(ec2=ec2, workers=4)
+    failed = cleaner.remove_amis(amis)
+
+    assert failed == ["snap-00000000"]
+    assert [r.ami_id for r in cleaner.results] == [a.id for a in amis]
+    assert len([r for r in cleaner.results if r.deregistered]) == 6
+    assert cleaner.results[-1].error is not None
+    assert ec2.describe_images(Owners=["self"])["Images"] == []
+
+
+class SlowSnapshotsEC2(FakeEC2):
+
+    """ Fake ec2 client deleting snapshots once every AMI is deregistered """
+
+    def __init__(self, backend, count):
+        super(SlowSnapshotsEC2, self).__init__(backend)
+        self.count = count
+        self.deregistered = threading.Event()
+        self.lock = threading.Lock()
+
+    def deregister_image(self, ImageId):
+        resp = super(SlowSnapshotsEC2, self).deregister_image(ImageId=ImageId)
+        with self.lock:
+            self.count -= 1
+            if not self.count:
+                self.deregistered.set()
+        return resp
+
+    def delete_snapshot(self, SnapshotId):
+        assert self.deregistered.wait(5)
+        return super(SlowSnapshotsEC2, self).delete_snapshot(SnapshotId=SnapshotId)
+
+
+def test_remove_amis_pipelined(capsys):
+    backend = make_backend(8)
+    amis = [AMI.object_with_json(make_image(i)) for i in range(8)]
+    amis[0].block_device_mappings.append(AWSBlockDevice())
+    amis[0].block_device_mappings[-1].snapshot_id = "snap-unknown"
+
+    # deregistrations never wait for the single snapshot worker
+    cleaner = AMICleaner(ec2=SlowSnapshotsEC2(backend, 8), workers=2, snapshot_workers=1)
+    assert cleaner.remove_amis(amis) == ["snap-unknown"]
+
+    assert [r.ami_id for r in cleaner.results] == [a.id for a in amis]
+    assert all(r.deregistered for r in cleaner.results)
+    assert backend.images == {}
+    assert cleaner.progress["deregister"].to_dict() == {"queued": 8, "done": 8, "failed": 0}
+    assert cleaner.progress["snapshots"].to_dict() == {"queued": 9, "done": 8, "failed": 1}
+
+    # messages of concurrent deletions are never interleaved
+    lines = capsys.readouterr().out.splitlines()
+    assert sorted(lines) == sorted(["ami-{0:08x} deregistered".format(i) for i in range(8)] +
+                                   ["snap-{0:08x} deleted".format(i) for i in range(8)])
+
+
+class UnreachableEC2(FakeEC2):
+
+    """ Fake ec2 client losing its connection on some AMIs and snapshots """
+
+    def deregister_image(self, ImageId):
+        if ImageId == "ami-00000001":
+            raise EndpointConnectionError(endpoint_url="https://ec2.eu-west-1.amazonaws.com/")
+        return super(UnreachableEC2, self).deregister_image(ImageId=ImageId)
+
+    def delete_snapshot(self, SnapshotId):
+        if SnapshotId == "snap-00000002":
+            raise EndpointConnectionError(endpoint_url="https://ec2.eu-west-1.amazonaws.com/")
+        return super(UnreachableEC2, self).delete_snapshot(SnapshotId=SnapshotId)
+
+
+def test_remove_amis_connection_errors():
+    backend = make_backend(4)
+    amis = [AMI.object_with_json(make_image(i)) for i in range(4)]
+
+    # every AMI has its result, the failed ones with their error
+    cleaner = AMICleaner(ec2=UnreachableEC2(backend), workers=2)
+    assert cleaner.remove_amis(amis) == ["snap-00000002"]
+
+    assert [r.ami_id for r in cleaner.results] == [a.id for a in amis]
+    assert [r.deregistered for r in cleaner.results] == [True, False, True, True]
+    assert "Could not connect" in cleaner.results[1].error
+    assert sorted(backend.images) == ["ami-00000001"]
+
+
 @mock_ec2
 def test_fetch_snapshots_from_none():
 
@@ -275,6 +494,65 @@ def test_fetch_snapshots_from_none():
     assert len(cleaner.fetch()) == 0
 
 
+def test_get_snapshot_key():
+    key = OrphanSnapshotCleaner.get_snapshot_key
+    assert key("snap-4e8fae6b") == key("snap-4e8fae6b")
+    assert key("snap-4e8fae6b") != key("snap-04e8fae6b")
+    assert key("snap-0123456789abcdef0") != key("snap-0123456789abcdef1")
+    assert key("not-a-snapshot") == "not-a-snapshot"
+    assert key(None) is None
+
+
+class PagedEC2(object):
+
+    def __init__(self, images, snapshots):
+        self.images = images
+        self.snapshots = snapshots
+        self.calls = []
+
+    @staticmethod
+    def page(items, key, kwargs):
+        start = int(kwargs.get("NextToken") or 0)
+        end = start + kwargs.get("MaxResults", 1000)
+        resp = {key: items[start:end]}
+        if end < len(items):
+            resp["NextToken"] = str(end)
+        return resp
+
+    def describe_images(self, **kwargs):
+        self.calls.append("describe_images")
+        return self.page(self.images, "Images", kwargs)
+
+    def describe_snapshots(self, **kwargs):
+        self.calls.append("describe_snapshots")
+        assert kwargs["OwnerIds"] == ["123456789012"]
+        return self.page(self.snapshots, "Snapshots", kwargs)
+
+
+def test_iter_orphans_paginated():
+    images = [{
+        "ImageId": "ami-{0:08x}".format(i),
+        "OwnerId": "123456789012",
+        "BlockDeviceMappings": [
+            {"DeviceName": "/dev/xvda",
+             "Ebs": {"SnapshotId": "snap-{0:08x}".format(i)}},
+            {"DeviceName": "/dev/xvdb", "VirtualName": "ephemeral0"},
+        ]
+    } for i in range(25)]
+    snapshots = [{"SnapshotId": "snap-{0:08x}".format(i)} for i in range(40)]
+    ec2 = PagedEC2(images, snapshots)
+
+    cleaner = OrphanSnapshotCleaner(ec2=ec2, page_size=10)
+    orphans = cleaner.iter_orphans()
+    assert not isinstance(orphans, list)
+    assert list(orphans) == ["snap-{0:08x}".format(i) for i in range(25, 40)]
+    assert ec2.calls.count("describe_images") == 3
+    assert ec2.calls.count("describe_snapshots") == 4
+
+    # unknown owner, no snapshot can be checked
+    assert OrphanSnapshotCleaner(ec2=PagedEC2([], snapshots)).fetch() == []
+
+
 """
 @mock_ec2
 def test_fetch_snapshots():
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from botocore.exceptions import ClientError
+
+from amicleaner.core import AMICleaner, OrphanSnapshotCleaner
+from amicleaner.fake import FakeAutoscaling, FakeBackend, FakeEC2
+from amicleaner.fetch import Fetcher
+from amicleaner.resources.models import AMI
+
+
+def make_image(i, name="web"):
+    return {
+        "ImageId": "ami-{0:08x}".format(i),
+        "Name": "{0}-{1}".format(name, i),
+        "CreationDate": "2020-01-{0:02d}T00:00:00.000Z".format(i + 1),
+        "BlockDeviceMappings": [
+            {"DeviceName": "/dev/xvda", "Ebs": {"SnapshotId": "snap-{0:08x}".format(i)}}
+        ],
+        "Tags": [{"Key": "role", "Value": name}],
+    }
+
+
+def make_backend(count=10, **kwargs):
+    backend = FakeBackend(**kwargs)
+    backend.add_images([make_image(i) for i in range(count)])
+    return backend
+
+
+def test_fake_pagination():
+    backend = make_backend(25, page_size=10)
+    fetcher = Fetcher(ec2=FakeEC2(backend), autoscaling=FakeAutoscaling(backend), page_size=1000)
+
+    assert len(fetcher.fetch_available_amis()) == 25
+    assert backend.calls == {"DescribeImages": 3}
+
+
+def test_fake_filters():
+    backend = make_backend(5)
+    backend.add_images([make_image(10, "api")])
+    resp = FakeEC2(backend).describe_images(
+        Owners=["self"], Filters=[{"Name": "name", "Values": ["api-*"]}]
+    )
+
+    assert [i["ImageId"] for i in resp["Images"]] == ["ami-0000000a"]
+
+
+def test_fake_throttling():
+    backend = make_backend(throttle_rate=1)
+
+    with pytest.raises(ClientError) as e:
+        FakeEC2(backend).describe_images(Owners=["self"])
+
+    assert e.value.response["Error"]["Code"] == "RequestLimitExceeded"
+    assert backend.throttles == {"DescribeImages": 1}
+
+
+def test_fake_rate_limit():
+    backend = make_backend(rate_limit=2)
+    ec2 = FakeEC2(backend)
+    ec2.describe_images()
+    ec2.describe_images()
+
+    with pytest.raises(ClientError):
+        ec2.describe_images()
+
+
+def test_fake_fetcher_autoscaling():
+    backend = make_backend(3)
+    backend.add_instances([{"ImageId": "ami-00000000"},
+                           {"ImageId": "ami-00000001", "State": {"Name": "terminated"}}])
+    backend.add_auto_scaling_groups(
+        [{"AutoScalingGroupName": "asg", "DesiredCapacity": 0, "LaunchConfigurationName": "lc-1"}],
+        [{"LaunchConfigurationName": "lc-1", "ImageId": "ami-00000001"},
+         {"LaunchConfigurationName": "lc-2", "ImageId": "ami-00000002"}]
+    )
+    fetcher = Fetcher(ec2=FakeEC2(backend), autoscaling=FakeAutoscaling(backend))
+
+    assert fetcher.fetch_instances() == ["ami-00000000"]
+    assert fetcher.fetch_zeroed_asg() == ["ami-00000001"]
+    assert fetcher.fetch_unattached_lc() == ["ami-00000002"]
+
+
+def test_fake_remove_amis_and_orphans():
+    backend = make_backend(4)
+    backend.add_snapshots([{"SnapshotId": "snap-orphan",
+                            "Description": "Created by CreateImage(i-1) for ami-gone"}])
+    ec2 = FakeEC2(backend)
+    amis = [AMI.object_with_json(make_image(i)) for i in range(2)]
+
+    cleaner = AMICleaner(ec2=ec2, workers=2)
+    assert cleaner.remove_amis(amis) == []
+    assert sorted(backend.images) == ["ami-00000002", "ami-00000003"]
+
+    orphans = OrphanSnapshotCleaner(ec2=ec2)
+    assert orphans.fetch() == ["snap-orphan"]
+    assert orphans.clean(["snap-orphan", "snap-00000002"]) == 1
+    assert orphans.fetch() == []
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from amicleaner.cli import App
+from amicleaner.core import AMICleaner
+from amicleaner.fake import FakeEC2
+from amicleaner.journal import DeletionJournal
+from amicleaner.resources.models import AMI
+from amicleaner.utils import parse_args
+from .test_fake import make_backend, make_image
+
+
+class InterruptedEC2(FakeEC2):
+
+    """ Fake ec2 client interrupted after a number of snapshot deletions """
+
+    def __init__(self, backend, deletions):
+        super(InterruptedEC2, self).__init__(backend)
+        self.deletions = deletions
+
+    def delete_snapshot(self, SnapshotId):
+        if not self.deletions:
+            raise KeyboardInterrupt()
+        self.deletions -= 1
+        return super(InterruptedEC2, self).delete_snapshot(SnapshotId=SnapshotId)
+
+
+def interrupted_run(backend, journal, count=4, deletions=1):
+    amis = [AMI.object_with_json(make_image(i)) for i in range(count)]
+    cleaner = AMICleaner(ec2=InterruptedEC2(backend, deletions), workers=1, journal=journal)
+    with pytest.raises(KeyboardInterrupt):
+        cleaner.remove_amis(amis)
+
+
+def test_journal_pending(tmpdir):
+    backend = make_backend(4)
+    journal = DeletionJournal(str(tmpdir.join("journal.jsonl")))
+    interrupted_run(backend, journal)
+
+    pending = journal.pending()
+    assert [(ami.id, deregistered) for ami, deregistered in pending] == [
+        ("ami-00000001", True), ("ami-00000002", False), ("ami-00000003", False)
+    ]
+    assert [d.snapshot_id for d in pending[0][0].block_device_mappings] == ["snap-00000001"]
+    assert journal.pending("eu-west-1/other") == []
+
+
+def test_journal_skips_truncated_records(tmpdir):
+    path = tmpdir.join("journal.jsonl")
+    journal = DeletionJournal(str(path))
+    journal.plan([AMI.object_with_json(make_image(0))])
+    journal.close()
+    path.write('{"event": "deregis', mode="a")
+
+    assert [ami.id for ami, _ in journal.pending()] == ["ami-00000000"]
+
+
+def test_journal_last_run_only(tmpdir):
+    path = str(tmpdir.join("journal.jsonl"))
+    DeletionJournal(path).plan([AMI.object_with_json(make_image(0))])
+    DeletionJournal(path).plan([AMI.object_with_json(make_image(1))])
+
+    assert [ami.id for ami, _ in DeletionJournal(path).pending()] == ["ami-00000001"]
+
+
+def test_resume(tmpdir):
+    backend = make_backend(5)
+    journal = DeletionJournal(str(tmpdir.join("journal.jsonl")))
+    interrupted_run(backend, journal)
+
+    # deleted meanwhile, not an error on resume
+    backend.images.pop("ami-00000003")
+
+    cleaner = AMICleaner(ec2=FakeEC2(backend), journal=journal)
+    assert cleaner.resume() == []
+    assert [r.ami_id for r in cleaner.results if r.deregistered] == [
+        "ami-00000001", "ami-00000002", "ami-00000003"
+    ]
+    assert sorted(backend.images) == ["ami-00000004"]
+    assert sorted(backend.snapshots) == ["snap-00000004"]
+    assert journal.pending() == []
+    assert "DescribeImages" not in backend.calls
+
+
+def test_app_resume(tmpdir):
+    path = str(tmpdir.join("journal.jsonl"))
+    backend = make_backend(3)
+    interrupted_run(backend, DeletionJournal(path), count=3)
+
+    assert parse_args(["--resume"]) is None
+    app = App(parse_args(["--journal", path, "--resume"]))
+    app.clients = {"ec2": FakeEC2(backend)}
+    app.run_cli()
+
+    assert backend.images == {}
+    assert backend.snapshots == {}
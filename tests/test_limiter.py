@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from botocore.exceptions import ClientError, ConnectionClosedError, ReadTimeoutError
+from botocore.exceptions import ConnectionError as AWSConnectionError
+
+from amicleaner.fake import FakeBackend, FakeEC2, client_error
+from amicleaner.fanout import fan_out
+from amicleaner.limiter import LimitedClient, RateLimiter, TokenBucket
+from amicleaner.metrics import Metrics
+from .test_fake import make_backend
+
+
+def failing(errors):
+    def call(**kwargs):
+        call.calls += 1
+        if errors:
+            raise client_error(errors.pop(0), "DescribeImages")
+        return {"Images": []}
+    call.calls = 0
+    return call
+
+
+def test_token_bucket_adapts_rate():
+    bucket = TokenBucket(rate=10, max_rate=20, min_rate=4)
+
+    bucket.on_throttle()
+    assert bucket.rate == 5
+    # throttles of a same burst decrease the rate once
+    bucket.on_throttle()
+    assert bucket.rate == 5
+
+    bucket.last_decrease = 0
+    bucket.on_throttle()
+    assert bucket.rate == 4
+
+    bucket.on_success()
+    assert bucket.rate == 4.25
+
+
+def test_token_bucket_slow_start():
+    bucket = TokenBucket(rate=10, max_rate=12)
+
+    bucket.on_success()
+    assert bucket.rate == 11
+    bucket.on_success()
+    bucket.on_success()
+    assert bucket.rate == 12
+
+
+def test_limiter_retries_throttled_calls():
+    limiter = RateLimiter(rate=50)
+    call = failing(["RequestLimitExceeded", "Throttling"])
+
+    assert limiter.call("eu-west-1", "describe_images", call) == {"Images": []}
+    assert call.calls == 3
+    assert limiter.rates()[("eu-west-1", "describe_images")] < 50
+
+
+def test_limiter_raises_other_errors():
+    limiter = RateLimiter()
+    call = failing(["InvalidAMIID.NotFound"])
+
+    with pytest.raises(ClientError):
+        limiter.call("eu-west-1", "describe_images", call)
+    assert call.calls == 1
+
+
+def test_limiter_gives_up_after_retries():
+    limiter = RateLimiter(rate=100, retries=2)
+    call = failing(["RequestLimitExceeded"] * 3)
+
+    with pytest.raises(ClientError):
+        limiter.call("eu-west-1", "describe_images", call)
+    assert call.calls == 3
+
+
+class DisconnectedEC2(FakeEC2):
+
+    """ Fake ec2 client losing the responses of completed deregistrations """
+
+    error = AWSConnectionError(error="connection reset")
+
+    def deregister_image(self, ImageId):
+        super(DisconnectedEC2, self).deregister_image(ImageId=ImageId)
+        raise self.error
+
+
+def test_limiter_retried_deletes_and_metrics():
+    backend = make_backend(2)
+    metrics = Metrics()
+    ec2 = LimitedClient(DisconnectedEC2(backend), RateLimiter(rate=100, metrics=metrics), service="ec2")
+
+    # the retry finds the AMI deregistered by the first attempt
+    assert ec2.deregister_image(ImageId="ami-00000000") == {}
+    assert "ami-00000000" not in backend.images
+
+    # a gone resource is an error on a first attempt
+    with pytest.raises(ClientError):
+        ec2.deregister_image(ImageId="ami-00000000")
+
+    call = [c for c in metrics.to_dict()["calls"] if c["action"] == "DeregisterImage"][0]
+    assert call["retries"] == 1
+    assert call["wait_seconds"] >= 0.1
+
+
+def test_limiter_retries_timeouts():
+    backend = make_backend(2)
+    ec2 = DisconnectedEC2(backend)
+    ec2.error = ReadTimeoutError(endpoint_url="https://ec2.eu-west-1.amazonaws.com/")
+    ec2 = LimitedClient(ec2, RateLimiter(rate=100), service="ec2")
+
+    assert ec2.deregister_image(ImageId="ami-00000001") == {}
+    assert "ami-00000001" not in backend.images
+
+    limiter = RateLimiter(rate=100)
+    errors = [ConnectionClosedError(endpoint_url="https://ec2.eu-west-1.amazonaws.com/")]
+
+    def call(**kwargs):
+        if errors:
+            raise errors.pop()
+        return {"Images": []}
+
+    assert limiter.call("eu-west-1", "describe_images", call) == {"Images": []}
+
+
+def test_limited_client_holds_the_backend_rate():
+    backend = FakeBackend(rate_limit=20)
+    ec2 = LimitedClient(FakeEC2(backend), RateLimiter(rate=80))
+
+    fan_out(lambda i: ec2.describe_images(Owners=["self"]), range(60), 6)
+
+    throttles = backend.throttles.get("DescribeImages", 0)
+    assert backend.calls["DescribeImages"] == 60 + throttles
+    assert throttles < 20
+    assert ec2.describe_images.__name__ == "describe_images"
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from amicleaner.cli import App
+from amicleaner.fake import FakeAutoscaling, FakeBackend, FakeEC2
+from amicleaner.metrics import InstrumentedClient, Metrics
+from amicleaner.utils import parse_args
+from .test_fake import make_backend
+
+
+def test_instrumented_client_records_calls():
+    metrics = Metrics()
+    ec2 = InstrumentedClient(FakeEC2(make_backend(3)), metrics, "ec2")
+
+    assert len(ec2.describe_images(Owners=["self"])["Images"]) == 3
+    assert ec2.describe_images.__name__ == "describe_images"
+    assert ec2.meta.region_name == "us-east-1"
+    with pytest.raises(ClientError):
+        ec2.deregister_image(ImageId="ami-unknown")
+
+    calls = dict((c["action"], c) for c in metrics.to_dict()["calls"])
+    assert calls["DescribeImages"]["count"] == 1
+    assert calls["DescribeImages"]["latency"]["10.0"] == 1
+    assert calls["DeregisterImage"]["errors"] == 1
+    assert calls["DeregisterImage"]["throttles"] == 0
+
+
+def test_instrumented_client_records_throttles():
+    metrics = Metrics()
+    ec2 = InstrumentedClient(FakeEC2(FakeBackend(throttle_rate=1)), metrics, "ec2")
+
+    with pytest.raises(ClientError):
+        ec2.describe_snapshots()
+
+    call = metrics.to_dict()["calls"][0]
+    assert (call["service"], call["action"]) == ("ec2", "DescribeSnapshots")
+    assert call["throttles"] == 1
+
+
+def test_metrics_prometheus():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    metrics.record_call("ec2", "DescribeImages", 0.05)
+    metrics.record_call("ec2", "DescribeImages", 0.5, retries=2)
+    metrics.record_phase("fetch", 1.5)
+
+    lines = metrics.to_prometheus().splitlines()
+    labels = 'service="ec2",action="DescribeImages"'
+    assert "# TYPE amicleaner_api_call_duration_seconds histogram" in lines
+    assert 'amicleaner_api_calls_total{' + labels + '} 2' in lines
+    assert 'amicleaner_api_retries_total{' + labels + '} 2' in lines
+    assert 'amicleaner_api_call_duration_seconds_bucket{' + labels + ',le="0.1"} 1' in lines
+    assert 'amicleaner_api_call_duration_seconds_bucket{' + labels + ',le="+Inf"} 2' in lines
+    assert 'amicleaner_phase_duration_seconds{phase="fetch"} 1.5' in lines
+
+
+def test_run_writes_metrics(tmpdir):
+    json_path, prom_path = str(tmpdir.join("run.json")), str(tmpdir.join("run.prom"))
+    app = App(parse_args([
+        "-f", "--keep-previous", "1", "--mapping-key", "tags", "--mapping-values", "role",
+        "--metrics-json", json_path, "--metrics-prom", prom_path
+    ]))
+    backend = make_backend(3)
+    app.clients = {
+        "ec2": InstrumentedClient(FakeEC2(backend), app.metrics, "ec2"),
+        "autoscaling": InstrumentedClient(FakeAutoscaling(backend), app.metrics, "autoscaling"),
+    }
+
+    app.run_cli()
+
+    assert len(backend.images) == 1
+    with open(json_path) as f:
+        profile = json.load(f)
+    assert sorted(profile["phases"]) == ["delete", "fetch", "map", "reduce"]
+    calls = dict((c["action"], c["count"]) for c in profile["calls"])
+    assert calls["DeregisterImage"] == 2
+    assert calls["DeleteSnapshot"] == 2
+    with open(prom_path) as f:
+        assert "amicleaner_phase_duration_seconds" in f.read()
@@ -3,7 +3,9 @@
 import json
 
 from amicleaner.resources.models import AMI, AWSBlockDevice, AWSEC2Instance
-from amicleaner.resources.models import AWSTag
+from amicleaner.resources.models import AWSTag, AMIExclusions
+from amicleaner.resources.models import parse_creation_date
+from datetime import datetime
 
 
 def test_get_awstag_from_none():
@@ -70,8 +72,72 @@ def test_get_ami_from_json():
         assert len(ami.block_device_mappings) == 2
 
 
+def test_parse_creation_date():
+    assert parse_creation_date("2015-11-04T01:35:31.000Z") == 1446600931
+    assert parse_creation_date(datetime(2015, 11, 4, 1, 35, 31)) == 1446600931
+    assert parse_creation_date(None) is None
+    assert parse_creation_date("not a date") is None
+
+    ami = AMI()
+    assert ami.creation_timestamp is None
+    ami.creation_date = "2015-11-04T01:35:31.000Z"
+    assert ami.creation_timestamp == 1446600931
+    assert ami.creation_date == "2015-11-04T01:35:31.000Z"
+
+
+def test_ami_cold_fields():
+    with open("tests/mocks/ami.json") as mock_file:
+        ami = AMI.object_with_json(json.load(mock_file))
+        assert ami.hypervisor == "xen"
+        assert ami.location == "awsaccount/custom-debian-201511040131"
+        assert ami.public is False
+        assert ami.root_device_name == "/dev/xvda"
+
+    ami.hypervisor = "nitro"
+    assert ami.hypervisor == "nitro"
+    assert ami.image_type == "machine"
+
+    ami = AMI()
+    assert ami.root_device_type is None
+    ami.root_device_type = "ebs"
+    assert ami.root_device_type == "ebs"
+    assert ami.hypervisor is None
+
+
+def test_models_are_compact():
+    with open("tests/mocks/ami.json") as mock_file:
+        json_to_parse = json.load(mock_file)
+        first_ami = AMI.object_with_json(json_to_parse)
+        second_ami = AMI.object_with_json(json.loads(json.dumps(json_to_parse)))
+
+    for o in [first_ami, first_ami.tags[0], first_ami.block_device_mappings[0],
+              AWSEC2Instance()]:
+        assert not hasattr(o, "__dict__")
+
+    # tags and enumerated values are shared between models
+    assert first_ami.tags[0].value is second_ami.tags[0].value
+    assert first_ami.virtualization_type is second_ami.virtualization_type
+    assert (first_ami.block_device_mappings[0].volume_type is
+            second_ami.block_device_mappings[0].volume_type)
+
+
+def test_ami_exclusions():
+    exclusions = AMIExclusions()
+    exclusions.add(["ami-one", "ami-two", None], "instance")
+    exclusions.add(["ami-one", "ami-one"], "launch-configuration")
+    exclusions.add(None, "zeroed-asg")
+
+    assert len(exclusions) == 2
+    assert "ami-one" in exclusions
+    assert "ami-three" not in exclusions
+    assert sorted(exclusions) == ["ami-one", "ami-two"]
+    assert exclusions.get("ami-one") == ["instance", "launch-configuration"]
+    assert exclusions.get("ami-three") == []
+
+
 def test_models_to_tring():
     assert str(AMI()) is not None
     assert str(AWSBlockDevice()) is not None
     assert str(AWSEC2Instance()) is not None
     assert str(AWSTag()) is not None
+    assert str(AMIExclusions()) is not None
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+
+import pytest
+
+from amicleaner.cli import App
+from amicleaner.fake import FakeAutoscaling, FakeBackend, FakeEC2, FakeSTS
+from amicleaner.planfile import check_plan, read_plan, write_plan
+from amicleaner.utils import parse_args
+from .test_fake import make_image
+
+OPTIONS = ["-f", "--keep-previous", "1", "--mapping-key", "name", "--mapping-values", "web", "api"]
+
+
+def make_app(backend, args, region_name="us-east-1"):
+    app = App(parse_args(OPTIONS + args))
+    app.clients = {"ec2": FakeEC2(backend, region_name), "autoscaling": FakeAutoscaling(backend),
+                   "sts": FakeSTS(backend)}
+    return app
+
+
+def make_plan_backend():
+    backend = FakeBackend()
+    backend.add_images([make_image(i) for i in range(4)])
+    backend.add_images([make_image(10 + i, "api") for i in range(2)])
+    return backend
+
+
+def test_plan_and_apply(tmpdir):
+    backend = make_plan_backend()
+    path = str(tmpdir.join("plan.json.gz"))
+
+    make_app(backend, ["--plan", path]).run()
+    with gzip.open(path, "rt") as f:
+        plan = json.load(f)
+    assert plan["version"] == 2
+    assert plan["targets"][0]["scope"] == "123456789012/us-east-1"
+    groups = plan["targets"][0]["groups"]
+    assert sorted(groups) == ["api", "web"]
+    assert len(groups["web"]["delete"]) == 3
+    assert groups["web"]["delete"][0][1]
+    assert groups["api"]["keep"] == ["ami-0000000b"]
+    assert len(backend.images) == 6
+
+    calls = backend.calls["DescribeImages"]
+    make_app(backend, ["--apply", path]).run()
+    assert sorted(backend.images) == ["ami-00000003", "ami-0000000b"]
+    # applied without fetching the inventory again
+    assert backend.calls["DescribeImages"] == calls
+
+
+def test_apply_check_stale(tmpdir):
+    backend = make_plan_backend()
+    path = str(tmpdir.join("plan.json"))
+    make_app(backend, ["--plan", path]).run()
+
+    # the kept api AMI and a web candidate are deregistered meanwhile
+    backend.images.pop("ami-0000000b")
+    backend.images.pop("ami-00000000")
+    # an instance is launched from another web candidate
+    backend.add_instances([{"ImageId": "ami-00000001"},
+                           {"ImageId": "ami-00000002", "State": {"Name": "terminated"}}])
+
+    plan = read_plan(path)
+    report, stale = check_plan(FakeEC2(backend), plan["targets"][0])
+    assert stale == ["api"]
+    assert [ami.id for ami in report["web"]] == ["ami-00000002"]
+
+    app = make_app(backend, ["--apply", path, "--check-stale"])
+    app.run()
+    assert app.error == "stale groups api"
+    assert sorted(backend.images) == ["ami-00000001", "ami-00000003", "ami-0000000a"]
+
+
+def test_apply_other_scope(tmpdir):
+    backend = make_plan_backend()
+    path = str(tmpdir.join("plan.json"))
+    make_app(backend, ["--plan", path]).run()
+
+    # default region of the applying host
+    app = make_app(backend, ["--apply", path], "eu-west-1")
+    app.run()
+    assert app.error == "plan of 123456789012/us-east-1, credentials of 123456789012/eu-west-1"
+    assert len(backend.images) == 6
+
+    # credentials of another account
+    backend.owner_id = "210987654321"
+    app = make_app(backend, ["--apply", path])
+    app.run()
+    assert app.error.startswith("plan of 123456789012/us-east-1, credentials of 210987654321")
+    assert len(backend.images) == 6
+
+
+def test_plan_version(tmpdir):
+    path = str(tmpdir.join("plan.json"))
+    write_plan(path, {"version": 0, "targets": []})
+    with pytest.raises(ValueError):
+        read_plan(path)
+
+
+def test_plan_options():
+    # list options never swallow the plan file
+    args = parse_args(["--mapping-key", "tags", "--mapping-values", "env", "role", "--plan", "out.json"])
+    assert (args.mapping_values, args.plan_output) == (["env", "role"], "out.json")
+    app = App(parse_args(["--regions", "eu-west-1", "us-east-1", "--apply", "out.json", "--check-stale"]))
+    assert (app.regions, app.command, app.plan_file) == (["eu-west-1", "us-east-1"], "apply", "out.json")
+    assert App(parse_args([])).command is None
+
+    assert parse_args(["--check-stale"]) is None
+    with pytest.raises(SystemExit):
+        parse_args(["--plan", "out.json", "--apply", "out.json"])
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import calendar
+from datetime import datetime
+
+from amicleaner.cli import App
+from amicleaner.fake import FakeAutoscaling, FakeEC2
+from amicleaner.planner import get_creation_date_values, get_images_filters
+from amicleaner.utils import parse_args
+from .test_fake import make_backend, make_image
+
+
+def get_filters(filters):
+    return dict((f["Name"], f["Values"]) for f in filters)
+
+
+def test_images_filters_tags():
+    filters = get_filters(get_images_filters({"key": "tags", "values": ["role", "env"]}))
+
+    assert filters == {"state": ["available"], "tag-key": ["role", "env"]}
+
+
+def test_images_filters_names():
+    def name_filter(values, match=None):
+        strategy = {"key": "name", "values": values, "match": match}
+        return get_filters(get_images_filters(strategy)).get("name")
+
+    assert name_filter(["web", "a*b"]) == ["*web*", "*a\\*b*"]
+    assert name_filter(["web"], "prefix") == ["web*"]
+    assert name_filter(["web-.*"], "regex") is None
+    assert name_filter(["web", ""]) is None
+
+
+def test_creation_date_values():
+    cutoff = calendar.timegm(datetime(2008, 3, 2, 12).utctimetuple())
+    values = get_creation_date_values(cutoff)
+
+    assert values == ["2006-*", "2007-*", "2008-01-*", "2008-02-*",
+                      "2008-03-01T*", "2008-03-02T*"]
+
+    now = calendar.timegm(datetime(2008, 4, 1, 12).utctimetuple())
+    filters = get_filters(get_images_filters(ami_min_days=30, now=now))
+    assert filters["creation-date"] == values
+
+
+def test_server_filters_report():
+    backend = make_backend(6)
+    backend.add_images([dict(make_image(10 + i, "api"), Tags=[]) for i in range(3)])
+    backend.images["ami-00000005"]["State"] = "pending"
+
+    def prepare_candidates(*args):
+        app = App(parse_args(["--keep-previous", "1", "--mapping-key", "name",
+                              "--mapping-values", "web", "--ami-min-days", "1"] + list(args)))
+        app.clients = {"ec2": FakeEC2(backend), "autoscaling": FakeAutoscaling(backend)}
+        return app.prepare_candidates()
+
+    calls = backend.calls.get("DescribeImages", 0)
+    candidates = prepare_candidates()
+    filtered = prepare_candidates("--server-filters")
+
+    assert [ami.id for ami in filtered] == [ami.id for ami in candidates[:-1]]
+    assert len(filtered) == 4
+    assert backend.calls["DescribeImages"] == calls + 2
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+
+from amicleaner.cli import App
+from amicleaner.fake import FakeAutoscaling, FakeEC2
+from amicleaner.report import TableReportWriter, get_report_writer
+from amicleaner.resources.models import AMI
+from amicleaner.utils import Printer, parse_args
+from .test_fake import make_backend, make_image
+
+
+def prepare_candidates(*args):
+    app = App(parse_args(["--keep-previous", "1", "--mapping-key", "tags",
+                          "--mapping-values", "role"] + list(args)))
+    backend = make_backend(3)
+    backend.add_images([dict(make_image(10, "api"), Tags=[])])
+    backend.add_instances([{"ImageId": "ami-00000000"}])
+    app.clients = {"ec2": FakeEC2(backend), "autoscaling": FakeAutoscaling(backend)}
+    return app.prepare_candidates()
+
+
+def test_jsonl_report(tmpdir):
+    path = str(tmpdir.join("report.jsonl"))
+    candidates = prepare_candidates("--report-format", "jsonl", "--report-output", path)
+
+    assert [ami.id for ami in candidates] == ["ami-00000001"]
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    groups = dict((r["group"], r) for r in records if r["type"] == "group")
+    assert groups["web"]["candidates"] == 1
+    assert groups["no-tags (excluded)"]["excluded"] is True
+    amis = dict((r["id"], r) for r in records if r["type"] == "ami")
+    assert amis["ami-00000001"]["action"] == "delete"
+    assert amis["ami-00000002"]["action"] == "keep"
+    assert amis["ami-0000000a"]["action"] == "excluded"
+    assert amis["ami-00000000"]["reasons"] == ["instance"]
+
+
+def test_csv_report(tmpdir):
+    path = str(tmpdir.join("report.csv"))
+    prepare_candidates("--report-format", "csv", "--report-output", path)
+
+    with open(path) as f:
+        rows = list(csv.DictReader(f))
+    assert sorted((r["ami_id"], r["action"]) for r in rows) == [
+        ("ami-00000000", "excluded"), ("ami-00000001", "delete"),
+        ("ami-00000002", "keep"), ("ami-0000000a", "excluded"),
+    ]
+    assert rows[0]["creation_date"].startswith("2020-01-")
+
+
+def test_table_report_builds_amis_tables_for_full_report_only(monkeypatch):
+    tables = []
+    monkeypatch.setattr(Printer, "amis_table", staticmethod(tables.append))
+    ami = AMI.object_with_json(make_image(0))
+
+    writer = TableReportWriter()
+    writer.group("web", [ami], [ami])
+    writer.close()
+    assert tables == []
+    assert isinstance(get_report_writer(), TableReportWriter)
+
+
+def test_jsonl_report_on_stdout(capsys):
+    app = App(parse_args(["--dry-run", "--keep-previous", "1", "--report-format", "jsonl"]))
+    backend = make_backend(3)
+    app.clients = {"ec2": FakeEC2(backend), "autoscaling": FakeAutoscaling(backend)}
+    app.run_cli()
+
+    out, err = capsys.readouterr()
+    records = [json.loads(line) for line in out.splitlines()]
+    assert [r["action"] for r in records if r["type"] == "ami"] == ["delete", "delete", "keep"]
+    assert "Default values" in err
+    assert "Found 2 AMIs to remove" in err
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+
+from future.moves.urllib.error import HTTPError
+from future.moves.urllib.request import Request, urlopen
+
+from amicleaner.cli import App
+from amicleaner.fake import FakeAutoscaling, FakeBackend, FakeEC2
+from amicleaner.server import PlanServer, PlanService, is_local_address
+from amicleaner.utils import parse_args
+from .test_fake import make_image
+
+
+def request(server, path, method="GET"):
+    url = "http://127.0.0.1:{0}{1}".format(server.server_port, path)
+    try:
+        # a request with data is a POST
+        response = urlopen(Request(url, data=b"" if method == "POST" else None))
+    except HTTPError as e:
+        return e.code, json.loads(e.read().decode("utf-8"))
+    return response.getcode(), json.loads(response.read().decode("utf-8"))
+
+
+def test_plan_server():
+    backend = FakeBackend()
+    backend.add_images([make_image(i) for i in range(4)])
+    backend.add_images([make_image(10 + i, "api") for i in range(2)])
+    app = App(parse_args(["-f", "--keep-previous", "1",
+                          "--mapping-key", "name", "--mapping-values", "web", "api"]))
+    app.clients = {"ec2": FakeEC2(backend), "autoscaling": FakeAutoscaling(backend)}
+
+    service = PlanService(app, targets=[app])
+    server = PlanServer(("127.0.0.1", 0), service)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        assert request(server, "/health")[1]["status"] == "starting"
+        assert request(server, "/plan")[0] == 503
+
+        plan = service.refresh()
+        status, body = request(server, "/plan")
+        assert status == 200 and body["id"] == plan["id"]
+        groups = body["targets"][0]["groups"]
+        assert groups["web"] == {"candidates": 3, "kept": 1}
+        assert groups["api"] == {"candidates": 1, "kept": 1}
+
+        body = request(server, "/candidates?group=web")[1]
+        assert [group["group"] for group in body["groups"]] == ["web"]
+        assert len(body["groups"][0]["candidates"]) == 3
+        assert request(server, "/exclusions")[1]["exclusions"] == []
+        assert request(server, "/dry-run")[1]["count"] == 4
+        assert request(server, "/unknown")[0] == 404
+
+        assert request(server, "/delete?plan=outdated", "POST")[0] == 409
+
+        # since the plan, a planned AMI is used and a kept AMI is deregistered
+        backend.add_instances([{"ImageId": "ami-00000000"}])
+        backend.images.pop("ami-0000000b")
+
+        status, body = request(server, "/delete?plan={0}".format(plan["id"]), "POST")
+        assert status == 200
+        assert sorted(body["results"][0]["deregistered"]) == ["ami-00000001", "ami-00000002"]
+        assert body["results"][0]["error"] == "stale groups api"
+        assert sorted(backend.images) == ["ami-00000000", "ami-00000003", "ami-0000000a"]
+
+        # a plan is deleted once, the next one is planned in the background
+        assert request(server, "/delete?plan={0}".format(plan["id"]), "POST")[0] == 409
+        assert request(server, "/plan")[0] == 503
+    finally:
+        service.stop()
+        server.shutdown()
+        server.server_close()
+
+
+def test_is_local_address():
+    assert is_local_address("127.0.0.1")
+    assert is_local_address("::1")
+    assert not is_local_address("10.0.0.1")